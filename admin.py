@@ -1,20 +1,26 @@
-from flask import Blueprint, request, jsonify
-from app import db,app
-from models import Book, Borrow, User, Sale
-from decorators import admin_required
+from flask import Blueprint, request, jsonify, current_app
+from extensions import db
+from models import Book, Borrow, User, Sale, BorrowArchive, SaleArchive
+from decorators import admin_required, get_current_user_id
+from database import read_only
 from datetime import datetime 
 from auth import hash_password
-import os
-from werkzeug.utils import secure_filename
-import re
+from cache import catalog_cache, user_cache, book_cache
+import jobs
+from instrumentation import instrumentation
+from rollup import GRANULARITIES, ALL_BOOKS
+import stock
+import payments
+import sweeper
+from uploads import allowed_file, save_upload, photo_urls, UploadTooLarge
+from book_import import validate_book, import_books, detect_format
+from projections import (USER_FIELDS, BORROW_FIELDS, SALE_FIELDS, BORROW_ARCHIVE_FIELDS,
+                         SALE_ARCHIVE_FIELDS, InvalidFields)
+from archive import include_archived
+import queries
 
 admin = Blueprint('admin', __name__)
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
 # User registration route
 @admin.route('/register', methods=['POST'])
 @admin_required
@@ -46,6 +52,7 @@ def delete_user(user_id):
 
     db.session.delete(user)
     db.session.commit()
+    user_cache.invalidate(user_id)
 
     return jsonify({'message': 'User deleted successfully'}), 200
 
@@ -80,25 +87,20 @@ def edit_user(user_id):
         user.role = data['role']
 
     db.session.commit()
+    user_cache.invalidate(user_id)
     return jsonify({'message': 'User updated successfully'}), 200
 
 
 @admin.route('/users', methods=['GET'])
 @admin_required
+@read_only
 def list_users():
     try:
-        users = User.query.all()
-
-        # Convert user objects into a list of dictionaries
-        user_list = [
-            {
-                'id': user.id,
-                'username': user.username,
-                'role': user.role
-            }
-            for user in users
-        ]
-
+        fields = USER_FIELDS.parse(request.args.get('fields'))
+    except InvalidFields as e:
+        return jsonify({'message': str(e)}), 400
+    try:
+        user_list = USER_FIELDS.rows(User.query, fields)
         return jsonify(user_list), 200
     except Exception as e:
         return jsonify({'message': 'Error retrieving users', 'error': str(e)}), 500
@@ -111,91 +113,104 @@ def add_book():
     try:
         # Check if request contains data
         if not request.form:
-            print("No form data received")
             return jsonify({'message': 'No form data received'}), 400
 
-        print("Raw form data received:", request.form)
-        print("Files received:", request.files)
-
         # Extracting the form data
         data = request.form
 
-        # Check if all required fields are present in the data
-        required_fields = ['title', 'description', 'release_date', 'author', 'category', 'price', 'stock']
-        if not all(field in data for field in required_fields):
-            missing_fields = [field for field in required_fields if field not in data]
-            print(f"Missing fields: {missing_fields}")
-            return jsonify({'message': f'Missing fields: {missing_fields}'}), 400
-
-        # Validate the release_date format
-        if not re.match(r'^\d{4}-\d{2}-\d{2}$', data['release_date']):
-            return jsonify({'message': 'Invalid date format. Use YYYY-MM-DD.'}), 400
+        # Validate with the same rules as the bulk importer
+        values, error = validate_book(data)
+        if error:
+            return jsonify({'message': error}), 400
 
         # Handle the file upload for the photo
         if 'photo' not in request.files:
-            print("Missing photo file")
             return jsonify({'message': 'Missing photo file'}), 400
         
         photo = request.files['photo']
         
         if photo and allowed_file(photo.filename):
-            filename = secure_filename(photo.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            photo.save(file_path)
-            print("Photo saved to:", file_path)
+            try:
+                filename, is_new = save_upload(photo)
+            except UploadTooLarge:
+                return jsonify({'message': 'Photo file is too large'}), 413
+            current_app.logger.info("Cover stored as %s (%s)", filename, "new" if is_new else "duplicate")
         else:
-            print("Invalid photo file")
             return jsonify({'message': 'Invalid photo file'}), 400
 
-        # Process and validate release_date
-        try:
-            release_date = datetime.strptime(data['release_date'], '%Y-%m-%d').date()
-        except ValueError as e:
-            print(f"Date format error: {e}")
-            return jsonify({'message': f'Invalid date format: {e}'}), 400
-
         # Create a new book instance
-        new_book = Book(
-            title=data['title'],
-            description=data.get('description', ''),
-            release_date=release_date,
-            author=data['author'],
-            category=data['category'],
-            photo=filename,
-            price=float(data['price']),
-            stock=int(data['stock'])
-        )
+        values['photo'] = filename
+        new_book = Book(**values)
 
         # Add the book to the database
         db.session.add(new_book)
         db.session.commit()
+        catalog_cache.bump()
 
-        print("Book added successfully, ID:", new_book.id)
-        return jsonify({'message': 'Book added successfully!', 'book_id': new_book.id}), 201
+        current_app.logger.info("Book %s added", new_book.id)
+        return jsonify({
+            'message': 'Book added successfully!',
+            'book_id': new_book.id,
+            'photo': new_book.photo,
+            'photo_urls': photo_urls(new_book.photo)
+        }), 201
 
     except Exception as e:
-        print(f"Error occurred: {e}")
+        current_app.logger.exception("Failed to add book")
         return jsonify({'message': f'Failed to add book. Error: {e}'}), 500
 
 
+# Bulk import route
+@admin.route('/books/import', methods=['POST'])
+@admin_required
+def bulk_import_books():
+    # Imports are far larger than a single cover upload
+    request.max_content_length = current_app.config['IMPORT_MAX_BYTES']
+
+    batch_size = request.args.get('batch_size', type=int) or current_app.config['IMPORT_BATCH_SIZE']
+    fmt = request.args.get('format')
+
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'message': 'Missing file'}), 400
+        fmt = fmt or detect_format(upload.filename, upload.mimetype)
+        stream = upload.stream
+    else:
+        fmt = fmt or detect_format(None, request.mimetype)
+        stream = request.stream
+
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({'message': 'Unknown format. Use format=csv or format=jsonl.'}), 400
+
+    try:
+        report = import_books(stream, fmt, max(1, batch_size))
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception("Book import failed")
+        return jsonify({'message': f'Import failed. Error: {e}'}), 500
+
+    return jsonify(report), 200
+
+
 # Manage books route
 @admin.route('/manage_borrow_requests', methods=['GET'])
 @admin_required
+@read_only
 def manage_borrow_requests():
-    borrow_requests = Borrow.query.all()
-    requests_list = [
-        {
-            'id': request.id,
-            'user_id': request.user_id,
-            'book_id': request.book_id,
-            'borrow_date': request.borrow_date,
-            'return_date': request.return_date,
-            'status': request.status,
-            'borrow_price': request.borrow_price,
-            'instructions': request.instructions
-        }
-        for request in borrow_requests
-    ]
+    try:
+        fields = BORROW_FIELDS.parse(request.args.get('fields'))
+    except InvalidFields as e:
+        return jsonify({'message': str(e)}), 400
+    sources = [(Borrow, BORROW_FIELDS)]
+    if include_archived(request.args):
+        sources.insert(0, (BorrowArchive, BORROW_ARCHIVE_FIELDS))
+    requests_list = []
+    for model, projection in sources:
+        filters = {}
+        if 'status' in request.args:
+            filters['status'] = request.args['status']
+        requests_list.extend(projection.rows(queries.borrow_requests(model, **filters), fields))
     return jsonify(requests_list), 200
 
 
@@ -221,11 +236,19 @@ def approve_borrow(borrow_id):
     except ValueError:
         return jsonify({'message': 'Invalid date format. Use YYYY-MM-DD.'}), 400
 
-    borrow.return_date = return_date
-    borrow.instructions = instructions
-    borrow.status = 'awaiting_pickup'
+    if not stock.transition(borrow_id, 'pending', 'awaiting_pickup', return_date=return_date,
+                            instructions=instructions, approved_at=datetime.utcnow()):
+        db.session.rollback()
+        return jsonify({'message': 'Borrow request not found or already processed.'}), 404
+
+    # Hold a copy now so a book cannot be approved for more borrowers than
+    # there are copies
+    if not stock.reserve(borrow.book_id):
+        db.session.rollback()
+        return jsonify({'message': 'No stock available to reserve for this book.'}), 409
 
     db.session.commit()
+    catalog_cache.bump()
 
     return jsonify({'message': 'Borrow request approved!', 'borrow_id': borrow.id}), 200
 
@@ -238,13 +261,16 @@ def mark_picked_up(borrow_id):
     if borrow is None or borrow.status != 'awaiting_pickup':
         return jsonify({'message': 'Invalid borrow record or not ready for pick-up.'}), 404
 
-    book = Book.query.get(borrow.book_id)
-    if book.stock <= 0:
+    if not stock.transition(borrow_id, 'awaiting_pickup', 'picked up'):
+        db.session.rollback()
+        return jsonify({'message': 'Invalid borrow record or not ready for pick-up.'}), 404
+
+    if not stock.check_out(borrow.book_id):
+        db.session.rollback()
         return jsonify({'message': 'No stock available for this book.'}), 400
 
-    borrow.status = 'picked up'
-    book.stock -= 1
     db.session.commit()
+    catalog_cache.bump()
 
     return jsonify({'message': 'Book marked as picked up, stock reduced by 1.'}), 200
 
@@ -257,46 +283,234 @@ def mark_returned(borrow_id):
     if borrow is None or borrow.status != 'picked up':
         return jsonify({'message': 'Invalid borrow record or not picked up yet.'}), 404
 
-    borrow.return_date = datetime.now()
-    borrow.status = 'returned'
+    if not stock.transition(borrow_id, 'picked up', 'returned', return_date=datetime.now().date()):
+        db.session.rollback()
+        return jsonify({'message': 'Invalid borrow record or not picked up yet.'}), 404
 
-    book = Book.query.get(borrow.book_id)
-    book.stock += 1
+    stock.check_in(borrow.book_id)
     db.session.commit()
+    catalog_cache.bump()
 
     return jsonify({'message': 'Book marked as returned, stock increased by 1.'}), 200
 
 
+def load_borrow_batch(borrow_ids):
+    # One query for the borrows and one for their books, locking the book
+    # rows for the rest of the transaction where the database supports it
+    borrows = {borrow.id: borrow for borrow in Borrow.query.filter(Borrow.id.in_(borrow_ids))}
+    book_ids = {borrow.book_id for borrow in borrows.values()}
+    books = {}
+    if book_ids:
+        books = {book.id: book for book in Book.query.filter(Book.id.in_(book_ids)).with_for_update()}
+    return borrows, books
+
+
+def batch_ids(data, key='borrow_ids'):
+    borrow_ids = data.get(key) if isinstance(data, dict) else None
+    if not isinstance(borrow_ids, list) or not borrow_ids:
+        return None, f'{key} must be a non-empty list.'
+    if len(borrow_ids) > current_app.config['BATCH_MAX_ITEMS']:
+        return None, f"At most {current_app.config['BATCH_MAX_ITEMS']} items per batch."
+    try:
+        return [int(borrow_id) for borrow_id in borrow_ids], None
+    except (TypeError, ValueError):
+        return None, f'{key} must contain integers.'
+
+
+def finish_batch(results, applied):
+    if not applied:
+        db.session.rollback()
+        return jsonify({'message': 'Some borrow requests changed while processing. Please retry.'}), 409
+    db.session.commit()
+    catalog_cache.bump()
+    succeeded = sum(1 for result in results if result['ok'])
+    return jsonify({'results': results, 'succeeded': succeeded, 'failed': len(results) - succeeded}), 200
+
+
+@admin.route('/batch/approve_borrow', methods=['POST'])
+@admin_required
+def approve_borrow_batch():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'message': 'items must be a non-empty list.'}), 400
+    borrow_ids, error = batch_ids({'borrow_ids': [item.get('borrow_id') for item in items if isinstance(item, dict)]})
+    if error or len(borrow_ids) != len(items):
+        return jsonify({'message': error or 'Every item needs a borrow_id.'}), 400
+
+    borrows, books = load_borrow_batch(borrow_ids)
+    available = {book.id: book.stock - book.reserved for book in books.values()}
+    results, updates, reserve = [], {}, {}
+    approved_at = datetime.utcnow()
+
+    for borrow_id, item in zip(borrow_ids, items):
+        borrow = borrows.get(borrow_id)
+        if borrow is None or borrow.status != 'pending' or borrow_id in updates:
+            results.append({'borrow_id': borrow_id, 'ok': False, 'message': 'Borrow request not found or already processed.'})
+            continue
+        try:
+            return_date = datetime.strptime(item.get('return_date') or '', '%Y-%m-%d').date()
+        except ValueError:
+            results.append({'borrow_id': borrow_id, 'ok': False, 'message': 'Return date is required. Use YYYY-MM-DD.'})
+            continue
+        if available.get(borrow.book_id, 0) <= 0:
+            results.append({'borrow_id': borrow_id, 'ok': False, 'message': 'No stock available to reserve for this book.'})
+            continue
+
+        available[borrow.book_id] -= 1
+        reserve[borrow.book_id] = reserve.get(borrow.book_id, 0) + 1
+        updates[borrow_id] = {'return_date': return_date, 'instructions': item.get('instructions'),
+                              'approved_at': approved_at}
+        results.append({'borrow_id': borrow_id, 'ok': True, 'message': 'Borrow request approved!'})
+
+    applied = stock.transition_many('pending', 'awaiting_pickup', updates) and stock.reserve_many(reserve)
+    return finish_batch(results, applied)
+
+
+@admin.route('/batch/mark_picked_up', methods=['POST'])
+@admin_required
+def mark_picked_up_batch():
+    borrow_ids, error = batch_ids(request.get_json(silent=True))
+    if error:
+        return jsonify({'message': error}), 400
+
+    borrows, books = load_borrow_batch(borrow_ids)
+    on_shelf = {book.id: book.stock for book in books.values()}
+    results, updates, check_out = [], {}, {}
+
+    for borrow_id in borrow_ids:
+        borrow = borrows.get(borrow_id)
+        if borrow is None or borrow.status != 'awaiting_pickup' or borrow_id in updates:
+            results.append({'borrow_id': borrow_id, 'ok': False, 'message': 'Invalid borrow record or not ready for pick-up.'})
+            continue
+        if on_shelf.get(borrow.book_id, 0) <= 0:
+            results.append({'borrow_id': borrow_id, 'ok': False, 'message': 'No stock available for this book.'})
+            continue
+
+        on_shelf[borrow.book_id] -= 1
+        check_out[borrow.book_id] = check_out.get(borrow.book_id, 0) + 1
+        updates[borrow_id] = {}
+        results.append({'borrow_id': borrow_id, 'ok': True, 'message': 'Book marked as picked up, stock reduced by 1.'})
+
+    applied = stock.transition_many('awaiting_pickup', 'picked up', updates) and stock.check_out_many(check_out)
+    return finish_batch(results, applied)
+
+
+@admin.route('/batch/mark_returned', methods=['POST'])
+@admin_required
+def mark_returned_batch():
+    borrow_ids, error = batch_ids(request.get_json(silent=True))
+    if error:
+        return jsonify({'message': error}), 400
+
+    borrows, books = load_borrow_batch(borrow_ids)
+    today = datetime.now().date()
+    results, updates, check_in = [], {}, {}
+
+    for borrow_id in borrow_ids:
+        borrow = borrows.get(borrow_id)
+        if borrow is None or borrow.status != 'picked up' or borrow_id in updates:
+            results.append({'borrow_id': borrow_id, 'ok': False, 'message': 'Invalid borrow record or not picked up yet.'})
+            continue
+
+        check_in[borrow.book_id] = check_in.get(borrow.book_id, 0) + 1
+        updates[borrow_id] = {'return_date': today}
+        results.append({'borrow_id': borrow_id, 'ok': True, 'message': 'Book marked as returned, stock increased by 1.'})
+
+    applied = stock.transition_many('picked up', 'returned', updates) and stock.check_in_many(check_in)
+    return finish_batch(results, applied)
+
+
+@admin.route('/cache/stats', methods=['GET'])
+@admin_required
+def cache_stats():
+    return jsonify(catalog_cache.stats()), 200
+
+
+@admin.route('/cache/books/stats', methods=['GET'])
+@admin_required
+def book_cache_stats():
+    return jsonify(book_cache.stats()), 200
+
+
+@admin.route('/jobs/metrics', methods=['GET'])
+@admin_required
+def job_metrics():
+    job_stats = jobs.metrics.snapshot()
+    job_stats['queue_depth'] = jobs.queue_depth()
+    return jsonify(job_stats), 200
+
+
+@admin.route('/payments/callbacks/metrics', methods=['GET'])
+@admin_required
+def callback_metrics():
+    if payments.ingester is None:
+        return jsonify({"message": "No callbacks received since startup"}), 200
+    return jsonify(payments.ingester.snapshot()), 200
+
+
+@admin.route('/payments/status/metrics', methods=['GET'])
+@admin_required
+def payment_status_metrics():
+    if payments.sale_events is None:
+        return jsonify({"message": "No payment status waits since startup"}), 200
+    return jsonify(payments.sale_events.snapshot()), 200
+
+
+@admin.route('/borrows/expiry/metrics', methods=['GET'])
+@admin_required
+def expiry_metrics():
+    return jsonify(sweeper.metrics.snapshot()), 200
+
+
+@admin.route('/metrics', methods=['GET'])
+@admin_required
+def request_metrics():
+    return jsonify(instrumentation.snapshot()), 200
+
+
 @admin.route('/sales', methods=['GET'])
 @admin_required
+@read_only
 def get_sales():
-    sales = Sale.query.all() 
-    sales_list = [
-        {
-            "id": sale.id,
-            "user_id": sale.user_id,
-            "book_id": sale.book_id,
-            "phone_number": sale.phone_number,
-            "amount": sale.amount,
-            "status": sale.status,
-            "created_at": sale.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        }
-        for sale in sales
-    ]
+    try:
+        fields = SALE_FIELDS.parse(request.args.get('fields'))
+    except InvalidFields as e:
+        return jsonify({'message': str(e)}), 400
+    sources = [(Sale, SALE_FIELDS)]
+    if include_archived(request.args):
+        sources.insert(0, (SaleArchive, SALE_ARCHIVE_FIELDS))
+    sales_list = []
+    for model, projection in sources:
+        filters = {}
+        if 'status' in request.args:
+            filters['status'] = request.args['status']
+        if 'user_id' in request.args:
+            filters['user_id'] = request.args.get('user_id', type=int)
+        sales_list.extend(projection.rows(queries.sales(model, **filters), fields))
     return jsonify(sales_list), 200
 
 
 @admin.route('/sales/analytics', methods=['GET'])
 @admin_required
+@read_only
 def sales_analytics():
-    results = (
-        db.session.query(
-            func.strftime('%Y-%m', Sale.created_at),  # Format date to YYYY-MM
-            func.sum(Sale.amount)
-        )
-        .group_by(func.strftime('%Y-%m', Sale.created_at))
-        .all()
-    )
-
-    analytics_data = [{"month": month, "total_sales": total} for month, total in results]
-    return jsonify(analytics_data), 200
\ No newline at end of file
+    # Reads only the pre-aggregated rollup, so the cost does not grow with
+    # the number of sales
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in GRANULARITIES:
+        return jsonify({'message': f'granularity must be one of {sorted(GRANULARITIES)}'}), 400
+
+    book_id = request.args.get('book_id', type=int) or ALL_BOOKS
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+
+    results = queries.sales_analytics(granularity, book_id, date_from, date_to,
+                                      request.args.get('status')).all()
+
+    analytics_data = [
+        {granularity: period, "total_sales": total, "sales_count": count}
+        for period, total, count in results
+        if count
+    ]
+    return jsonify(analytics_data), 200
@@ -1,63 +1,153 @@
+import importlib
+import click
 from flask import Flask, jsonify
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from flask_migrate import Migrate
-from flask_jwt_extended import JWTManager
+from fast_json import FastJSONProvider
+from config import Config
+from database import engine_options, configure_binds, init_sqlite_pragmas
+from extensions import db, migrate, jwt
 import os
 
-app = Flask(__name__)
 
-CORS(app, resources={r"/*": {"origins": "*"}})
+def create_app(config=None):
+    """Build the application.
+
+    ``config`` is a dict or an object whose upper-case attributes override
+    the environment-driven defaults in ``config.Config``.
+    """
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    CORS(app, resources={r"/*": {"origins": "*"}})
+
+    # Initialize SQLAlchemy, Migrate, and JWTManager
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    configure_binds(app.config)
+    db.init_app(app)
+    migrate.init_app(app, db)
+    jwt.init_app(app)
+    with app.app_context():
+        init_sqlite_pragmas(app.config, db.engines.values())
+
+    from instrumentation import instrumentation
+    instrumentation.init_app(app)
+    from compression import compressor
+    compressor.init_app(app)
+
+    from models import User
+    from decorators import load_user
+
+    @jwt.user_lookup_loader
+    def user_lookup_callback(_jwt_header, jwt_data):
+        identity = jwt_data['sub']
+        if 'id' not in identity:
+            return User.query.filter_by(username=identity['username']).one_or_none()
+        return load_user(identity['id'])
+
+    # Create the uploads directory if it does not exist
+    os.makedirs(os.path.join(app.root_path, app.config['UPLOAD_FOLDER']), exist_ok=True)
+
+    # Workers and `flask` commands publish cache invalidations through one
+    # stamp file per cache
+    from cache import catalog_cache, book_cache, user_cache
+    for name, cache in (('catalog', catalog_cache), ('book', book_cache), ('user', user_cache)):
+        version_file = app.config[f'{name.upper()}_VERSION_FILE']
+        if not version_file:
+            os.makedirs(app.instance_path, exist_ok=True)
+            version_file = os.path.join(app.instance_path, f'{name}.version')
+        cache.share_version(version_file)
+
+    # Import and register blueprints
+    from auth import auth as auth_blueprint, PasswordHasherBusy
+    from admin import admin as admin_blueprint
+    from user import user as user_blueprint
+    from uploads import media as media_blueprint
+
+    app.register_blueprint(user_blueprint)
+    app.register_blueprint(auth_blueprint)
+    app.register_blueprint(admin_blueprint)
+    app.register_blueprint(media_blueprint)
+
+    register_commands(app)
+
+    import jobs
+    import sweeper
+
+    # Start the job worker with the first request rather than at import time, so
+    # CLI commands such as `flask db upgrade` never spawn worker threads, and
+    # gunicorn workers start their own threads after the fork
+    @app.before_request
+    def start_job_worker():
+        if app.config['JOBS_IN_PROCESS'] and jobs.worker is None:
+            jobs.start_worker(app)
+        if app.config['SWEEP_INTERVAL'] > 0 and sweeper.sweeper is None:
+            sweeper.start_sweeper(app)
+
+    # Simple home route
+    @app.route('/')
+    def home():
+        return jsonify(message="Welcome to Quiet Library Tracker API")
+
+    # Error handling
+    @app.errorhandler(404)
+    def not_found(error):
+        return jsonify(message="Resource not found"), 404
+
+    @app.errorhandler(500)
+    def internal_error(error):
+        return jsonify(message="An internal error occurred"), 500
+
+    @app.errorhandler(PasswordHasherBusy)
+    def password_hasher_busy(error):
+        return jsonify(message="Server is busy, please try again shortly"), 503, {'Retry-After': '1'}
+
+    return app
+
+
+class LazyCommand(click.Command):
+    """A CLI command whose module is imported only when the command runs.
+
+    Keeps heavyweight tooling out of every ``create_app``; ``path`` is
+    ``'module:attribute'`` naming the real click command.
+    """
+
+    def __init__(self, name, path, help):
+        super().__init__(name, help=help, short_help=help)
+        self.path = path
+
+    def load(self):
+        module, attribute = self.path.split(':')
+        return getattr(importlib.import_module(module), attribute)
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        # Hand parsing, --help and invocation over to the real command
+        return self.load().make_context(info_name, args, parent=parent, **extra)
+
+
+def register_commands(app):
+    from jobs import run_jobs
+    from sweeper import expire_borrows
+    from archive import archive_command
+    from rollup import rebuild_sales_rollup
+    from book_import import import_books_command
+    from queryplans import check_query_plans_command
+
+    for command in (run_jobs, expire_borrows, archive_command, rebuild_sales_rollup,
+                    import_books_command, check_query_plans_command):
+        app.cli.add_command(command)
+
+    # Development tooling, imported only when used
+    app.cli.add_command(LazyCommand('seed', 'seed:seed', 'Generate synthetic users, books, borrows and sales.'))
+    app.cli.add_command(LazyCommand('loadtest', 'loadtest:loadtest',
+                                   'Run a mixed-endpoint load test and report latency per endpoint.'))
+    app.cli.add_command(LazyCommand('bench', 'bench:bench', 'Run micro-benchmarks.'))
 
-# Configuration settings
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///db.sqlite3')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
-
-# JWT Configuration
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'S)83@Jp0LqE0=pufzcI=jcW*0B#XLoBd6+g=y6P*rQ=8dpYfZ')
-app.secret_key = os.getenv('SECRET_KEY', 'xNFzG46=+^CCqwTcMge07q-$5GZ^1vbNm$JBPvRMx2zY#Fb2D*')
-
-# Initialize SQLAlchemy, Migrate, and JWTManager
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-jwt = JWTManager(app)
-
-
-from models import User
-
-@jwt.user_lookup_loader
-def user_lookup_callback(_jwt_header, jwt_data):
-    username = jwt_data['sub']['username'] 
-    return User.query.filter_by(username=username).one_or_none()
-
-
-# Create the uploads directory if it does not exist
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-
-# Import and register blueprints
-from auth import auth as auth_blueprint
-from admin import admin as admin_blueprint
-from user import user as user_blueprint
-
-app.register_blueprint(user_blueprint)
-app.register_blueprint(auth_blueprint)
-app.register_blueprint(admin_blueprint)
-
-# Simple home route
-@app.route('/')
-def home():
-    return jsonify(message="Welcome to Quiet Library Tracker API")
-
-# Error handling
-@app.errorhandler(404)
-def not_found(error):
-    return jsonify(message="Resource not found"), 404
-
-@app.errorhandler(500)
-def internal_error(error):
-    return jsonify(message="An internal error occurred"), 500
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
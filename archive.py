@@ -0,0 +1,90 @@
+"""Move finished borrows and settled sales into the archive tables.
+
+Borrows that were returned, rejected or expired, and sales that completed or
+failed, move to borrow_archive and sale_archive once they are older than the
+retention window. Each batch copies rows with INSERT ... SELECT and deletes
+the originals in the same transaction, so a row is always in exactly one
+table. Sales are deleted with a Core statement, which skips the rollup's
+mapper events: archived sales keep counting in the analytics, and
+rebuild_rollup reads the archive as well.
+"""
+import time
+from datetime import date, datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from extensions import db
+from models import Borrow, Sale, BorrowArchive, SaleArchive
+import queries
+
+FINISHED_BORROW_STATUSES = ('returned', 'rejected', 'expired')
+SETTLED_SALE_STATUSES = ('completed', 'failed')
+
+
+def include_archived(args):
+    # Listings show hot rows only unless ?include_archived=1
+    return args.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def archive_batch(model, archive_model, date_column, statuses, cutoff, batch_size):
+    table = model.__table__
+    archive_table = archive_model.__table__
+    ids = [row_id for (row_id,) in queries.archivable(model, date_column, statuses, cutoff, batch_size)]
+    if not ids:
+        return 0
+
+    # The status guard is repeated so a row that changed since the select
+    # is neither copied nor deleted
+    selected = table.c.id.in_(ids) & table.c.status.in_(statuses)
+    columns = [column.name for column in table.columns]
+    db.session.execute(
+        archive_table.insert().from_select(
+            columns + ['archived_at'],
+            db.select(*table.columns, db.literal(datetime.utcnow(), db.DateTime)).where(selected)
+        )
+    )
+    moved = db.session.execute(table.delete().where(selected)).rowcount
+    db.session.commit()
+    return moved
+
+
+def archive(borrow_days=None, sale_days=None, batch_size=None, max_batches=None, today=None):
+    """Run one bounded archive pass and return how many rows moved."""
+    borrow_days = borrow_days if borrow_days is not None else current_app.config['ARCHIVE_BORROW_DAYS']
+    sale_days = sale_days if sale_days is not None else current_app.config['ARCHIVE_SALE_DAYS']
+    batch_size = batch_size or current_app.config['ARCHIVE_BATCH_SIZE']
+    max_batches = max_batches or current_app.config['ARCHIVE_MAX_BATCHES']
+    today = today or date.today()
+
+    plans = [
+        ('borrows', Borrow, BorrowArchive, Borrow.borrow_date, FINISHED_BORROW_STATUSES,
+         today - timedelta(days=borrow_days)),
+        ('sales', Sale, SaleArchive, Sale.created_at, SETTLED_SALE_STATUSES,
+         datetime.combine(today - timedelta(days=sale_days), datetime.min.time())),
+    ]
+    result = {'borrows': 0, 'sales': 0, 'batches': 0}
+    for name, model, archive_model, date_column, statuses, cutoff in plans:
+        while result['batches'] < max_batches:
+            moved = archive_batch(model, archive_model, date_column, statuses, cutoff, batch_size)
+            result['batches'] += 1
+            result[name] += moved
+            if moved < batch_size:
+                break
+    result['complete'] = result['batches'] < max_batches
+    return result
+
+
+@click.command('archive')
+@with_appcontext
+@click.option('--borrow-days', default=None, type=int, help='Archive finished borrows older than this.')
+@click.option('--sale-days', default=None, type=int, help='Archive settled sales older than this.')
+@click.option('--batch-size', default=None, type=int, help='Rows moved per transaction.')
+@click.option('--max-batches', default=None, type=int, help='Stop after this many batches.')
+def archive_command(borrow_days, sale_days, batch_size, max_batches):
+    """Move old finished borrows and settled sales to the archive tables."""
+    started = time.perf_counter()
+    result = archive(borrow_days, sale_days, batch_size, max_batches)
+    print(f"Archived {result['borrows']} borrows and {result['sales']} sales in "
+          f"{result['batches']} batches, {time.perf_counter() - started:.2f}s")
+    if not result['complete']:
+        print("Batch limit reached; run again to continue")
@@ -1,18 +1,78 @@
-from flask import Blueprint, request, jsonify
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request, jsonify, current_app
 from bcrypt import gensalt, hashpw, checkpw
 from models import User
-from app import db
+from extensions import db
+from cache import user_cache
 from flask_jwt_extended import create_access_token
 
 auth = Blueprint('auth', __name__)
 
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated, size-limited pool.
+
+    bcrypt releases the GIL, so the pool bounds how many cores a burst of
+    logins can take. Once ``workers + queue_size`` calls are pending, new
+    ones fail fast with PasswordHasherBusy instead of piling up.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher():
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(current_app.config['BCRYPT_WORKERS'],
+                                         current_app.config['BCRYPT_QUEUE_SIZE'])
+    return _hasher
+
+
+def _as_bytes(value):
+    return value.encode('utf-8') if isinstance(value, str) else value
+
+
 def hash_password(password):
-    salt = gensalt()
-    return hashpw(password.encode('utf-8'), salt)
+    salt = gensalt(rounds=current_app.config['BCRYPT_ROUNDS'])
+    return get_hasher().run(hashpw, password.encode('utf-8'), salt)
 
 
 def check_password(stored_password, provided_password):
-    return checkpw(provided_password.encode('utf-8'), stored_password)
+    return get_hasher().run(checkpw, provided_password.encode('utf-8'), _as_bytes(stored_password))
+
+
+def needs_rehash(stored_password):
+    # bcrypt hashes look like $2b$12$<salt+hash>; the middle field is the cost
+    try:
+        rounds = int(_as_bytes(stored_password).split(b'$')[2])
+    except (IndexError, ValueError):
+        return False
+    return rounds != current_app.config['BCRYPT_ROUNDS']
 
 
 @auth.route('/login', methods=['POST'])
@@ -23,7 +83,14 @@ def login():
     if not user or not check_password(user.password, data['password']):
         return jsonify({'message': 'Invalid username or password!'}), 401
 
-    access_token = create_access_token(identity={'username': user.username, 'role': user.role})
+    # Move the stored hash to the configured work factor while the plain
+    # password is at hand
+    if needs_rehash(user.password):
+        user.password = hash_password(data['password'])
+        db.session.commit()
+        user_cache.invalidate(user.id)
+
+    access_token = create_access_token(identity={'id': user.id, 'username': user.username, 'role': user.role})
 
     redirect_url = 'user-dashboard'  
     if user.role == 'admin':
@@ -35,4 +102,4 @@ def login():
         'message': 'Login successful',
         'redirect': redirect_url,
         'access_token': access_token
-    }), 200
\ No newline at end of file
+    }), 200
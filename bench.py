@@ -0,0 +1,591 @@
+"""Micro-benchmarks, run with ``flask bench <name>``.
+
+Every benchmark prints one JSON object per line so runs can be diffed or
+collected across commits.
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask.json.provider import DefaultJSONProvider
+from flask_jwt_extended import create_access_token
+from bcrypt import gensalt, hashpw, checkpw
+from datetime import date
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from extensions import db
+from auth import PasswordHasher
+from models import Book, Borrow, User, Sale, PaymentCallback
+from database import READ_BIND
+from fast_json import FastJSONProvider
+from compression import compress, available_encodings
+from projections import BOOK_FIELDS, USER_FIELDS, BORROW_FIELDS, SALE_FIELDS
+from uploads import photo_urls
+from rollup import apply_delta
+from cache import book_cache
+import payments
+
+bench = AppGroup('bench', help='Run micro-benchmarks.')
+
+
+def emit(result):
+    print(json.dumps(result, sort_keys=True))
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+@bench.command('bcrypt')
+@click.option('--rounds', default='10,11,12,13', help='Comma separated bcrypt costs to measure.')
+@click.option('--seconds', default=3.0, help='Duration of each run.')
+@click.option('--concurrency', default=None, type=int, help='Concurrent login threads (default: 2x workers).')
+def bench_bcrypt(rounds, seconds, concurrency):
+    """Report password checks (logins) per second at each bcrypt cost."""
+    workers = current_app.config['BCRYPT_WORKERS']
+    concurrency = concurrency or workers * 2
+    password = b'correct horse battery staple'
+
+    for cost in parse_int_list(rounds):
+        stored = hashpw(password, gensalt(rounds=cost))
+        hasher = PasswordHasher(workers, queue_size=concurrency)
+        deadline = time.perf_counter() + seconds
+        counts = [0] * concurrency
+
+        def login_loop(slot):
+            while time.perf_counter() < deadline:
+                hasher.run(checkpw, password, stored)
+                counts[slot] += 1
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=login_loop, args=(i,)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = sum(counts)
+        emit({
+            'benchmark': 'bcrypt',
+            'rounds': cost,
+            'workers': workers,
+            'concurrency': concurrency,
+            'logins': total,
+            'logins_per_sec': round(total / elapsed, 2),
+            'mean_ms': round(elapsed * concurrency / total * 1000, 2) if total else None
+        })
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+@bench.command('rw')
+@click.option('--readers', default=8, help='Concurrent reader threads.')
+@click.option('--writers', default=2, help='Concurrent writer threads (0 for a read-only baseline).')
+@click.option('--seconds', default=5.0, help='Duration of the run.')
+@click.option('--page-size', default=50, help='Books read per query.')
+def bench_rw(readers, writers, seconds, page_size):
+    """Measure read throughput while writers are committing.
+
+    Uses the configured engines, so compare runs by changing the engine
+    settings, e.g. SQLITE_JOURNAL_MODE=DELETE SQLITE_SYNCHRONOUS=FULL.
+    """
+    app = current_app._get_current_object()
+    with app.app_context():
+        user = User(username=f'bench-rw-{time.time_ns()}', password='x', role='user')
+        book = Book(title='Read/write benchmark', description='', release_date=date.today(),
+                    author='bench', price=1.0, stock=0, reserved=0)
+        db.session.add_all([user, book])
+        db.session.commit()
+        user_id, book_id = user.id, book.id
+        write_engine = db.engine
+        read_engine = db.engines.get(READ_BIND, write_engine)
+        journal_mode = None
+        if write_engine.dialect.name == 'sqlite':
+            with write_engine.connect() as conn:
+                journal_mode = conn.exec_driver_sql('PRAGMA journal_mode').scalar()
+        high = db.session.query(db.func.max(Book.id)).scalar()
+
+    book_table = Book.__table__
+    borrow_table = Borrow.__table__
+    lock = threading.Lock()
+    read_times, write_times = [], []
+    errors = {'read': 0, 'write': 0}
+    deadline = time.perf_counter() + seconds
+
+    def read_loop(slot):
+        local = []
+        after = slot * page_size
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                with read_engine.connect() as conn:
+                    rows = conn.execute(
+                        db.select(book_table.c.id, book_table.c.title, book_table.c.stock)
+                        .where(book_table.c.id > after).order_by(book_table.c.id).limit(page_size)
+                    ).all()
+                    conn.execute(
+                        db.select(db.func.count()).select_from(borrow_table)
+                        .where(borrow_table.c.book_id == book_id, borrow_table.c.status == 'pending')
+                    ).scalar()
+            except Exception:
+                with lock:
+                    errors['read'] += 1
+                continue
+            local.append(time.perf_counter() - started)
+            after = rows[-1].id if rows and rows[-1].id < high else 0
+        with lock:
+            read_times.extend(local)
+
+    def write_loop():
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                with write_engine.begin() as conn:
+                    conn.execute(borrow_table.insert().values(
+                        user_id=user_id, book_id=book_id, borrow_date=date.today(), status='pending'))
+                    conn.execute(book_table.update().where(book_table.c.id == book_id)
+                                 .values(stock=book_table.c.stock + 1))
+            except Exception:
+                with lock:
+                    errors['write'] += 1
+                continue
+            local.append(time.perf_counter() - started)
+        with lock:
+            write_times.extend(local)
+
+    threads = [threading.Thread(target=read_loop, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=write_loop) for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        Borrow.query.filter_by(book_id=book_id).delete()
+        db.session.delete(db.session.get(Book, book_id))
+        db.session.delete(db.session.get(User, user_id))
+        db.session.commit()
+
+    emit({
+        'benchmark': 'rw',
+        'database': write_engine.dialect.name,
+        'journal_mode': journal_mode,
+        'read_replica': read_engine is not write_engine,
+        'readers': readers,
+        'writers': writers,
+        'reads_per_sec': round(len(read_times) / elapsed, 2),
+        'read_p50_ms': round(percentile(read_times, 0.5) * 1000, 3) if read_times else None,
+        'read_p99_ms': round(percentile(read_times, 0.99) * 1000, 3) if read_times else None,
+        'writes_per_sec': round(len(write_times) / elapsed, 2),
+        'write_p99_ms': round(percentile(write_times, 0.99) * 1000, 3) if write_times else None,
+        'read_errors': errors['read'],
+        'write_errors': errors['write']
+    })
+
+
+def legacy_book(book):
+    return {
+        'id': book.id, 'title': book.title, 'author': book.author, 'description': book.description,
+        'release_date': book.release_date, 'category': book.category, 'price': book.price,
+        'stock': book.stock, 'available': book.stock - book.reserved, 'photo': book.photo,
+        'photo_urls': photo_urls(book.photo)
+    }
+
+
+def legacy_row(columns):
+    return lambda obj: {name: getattr(obj, name) for name in columns}
+
+
+@bench.command('serialize')
+@click.option('--limit', default=5000, help='Rows listed per endpoint.')
+@click.option('--repeat', default=5, help='Runs per mode; the fastest is reported.')
+@click.option('--fields', default=None, help='Also measure this ?fields= projection of the books listing.')
+def bench_serialize(limit, repeat, fields):
+    """Compare ORM entities + stdlib json with projected rows + the fast encoder."""
+    app = current_app._get_current_object()
+    stdlib = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+    cases = [
+        ('books', Book, legacy_book, BOOK_FIELDS, None),
+        ('users', User, legacy_row(list(USER_FIELDS.fields)), USER_FIELDS, None),
+        ('borrows', Borrow, legacy_row(list(BORROW_FIELDS.fields)), BORROW_FIELDS, None),
+        ('sales', Sale, legacy_row(list(SALE_FIELDS.fields)), SALE_FIELDS, None),
+    ]
+    if fields:
+        cases.append(('books', Book, None, BOOK_FIELDS, fields))
+
+    def measure(run):
+        best_time, peak = None, None
+        for _ in range(repeat):
+            db.session.expunge_all()
+            tracemalloc.start()
+            started = time.perf_counter()
+            rows, size = run()
+            elapsed = time.perf_counter() - started
+            _, run_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+            peak = run_peak if peak is None else min(peak, run_peak)
+        return rows, size, best_time, peak
+
+    with app.test_request_context():
+        for name, model, to_dict, projection, field_param in cases:
+            query = model.query.order_by(model.id).limit(limit)
+            names = projection.parse(field_param)
+
+            def legacy():
+                objects = query.all()
+                body = stdlib.dumps([to_dict(obj) for obj in objects]).encode('utf-8')
+                return len(objects), len(body)
+
+            def projected():
+                rows = projection.rows(query, names)
+                return len(rows), len(fast.dumps_bytes(rows))
+
+            modes = [('projected', projected)] if field_param else [('legacy', legacy), ('projected', projected)]
+            for mode, run in modes:
+                rows, size, elapsed, peak = measure(run)
+                emit({
+                    'benchmark': 'serialize',
+                    'endpoint': name,
+                    'mode': mode,
+                    'fields': field_param or 'all',
+                    'rows': rows,
+                    'bytes': size,
+                    'us_per_row': round(elapsed / rows * 1e6, 2) if rows else None,
+                    'peak_alloc_bytes_per_row': round(peak / rows) if rows else None
+                })
+
+
+@bench.command('compress')
+@click.option('--limit', default=1000, help='Rows per listed endpoint (0 for all).')
+@click.option('--gzip-levels', default='1,6,9', help='Comma separated gzip levels.')
+@click.option('--brotli-qualities', default='1,5,9', help='Comma separated brotli qualities.')
+@click.option('--repeat', default=5, help='Runs per setting; the fastest is reported.')
+def bench_compress(limit, gzip_levels, brotli_qualities, repeat):
+    """Report bytes on the wire and compression CPU per response.
+
+    all_books pays this cost once per catalog version; later requests are
+    served the compressed bytes from the cache.
+    """
+    app = current_app._get_current_object()
+    encoder = FastJSONProvider(app)
+    settings = [('gzip', level) for level in parse_int_list(gzip_levels)]
+    if 'br' in available_encodings():
+        settings += [('br', quality) for quality in parse_int_list(brotli_qualities)]
+
+    endpoints = [
+        ('all_books', Book, BOOK_FIELDS),
+        ('manage_borrow_requests', Borrow, BORROW_FIELDS),
+        ('sales', Sale, SALE_FIELDS),
+        ('users', User, USER_FIELDS),
+    ]
+    with app.test_request_context():
+        for name, model, projection in endpoints:
+            query = model.query.order_by(model.id)
+            if limit:
+                query = query.limit(limit)
+            body = encoder.dumps_bytes(projection.rows(query, projection.parse(None)))
+            emit({'benchmark': 'compress', 'endpoint': name, 'encoding': 'identity', 'bytes': len(body)})
+
+            for encoding, level in settings:
+                config = dict(app.config, COMPRESS_GZIP_LEVEL=level, COMPRESS_BROTLI_QUALITY=level)
+                best = None
+                for _ in range(repeat):
+                    started = time.process_time()
+                    encoded = compress(body, encoding, config)
+                    elapsed = time.process_time() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                emit({
+                    'benchmark': 'compress',
+                    'endpoint': name,
+                    'encoding': encoding,
+                    'level': level,
+                    'bytes': len(encoded),
+                    'ratio': round(len(body) / len(encoded), 2),
+                    'cpu_ms_per_request': round(best * 1000, 3)
+                })
+
+
+@bench.command('payment-status')
+@click.option('--sales', default=20, help='Concurrent checkouts waiting for their callback.')
+@click.option('--min-delay', default=1.0, help='Fastest callback, in seconds after checkout.')
+@click.option('--max-delay', default=8.0, help='Slowest callback, in seconds after checkout.')
+@click.option('--poll-interval', default=1.0, help='Seconds between status checks when polling.')
+@click.option('--wait', default=25.0, help='?wait= sent when long-polling.')
+@click.option('--random-seed', default=1)
+def bench_payment_status(sales, min_delay, max_delay, poll_interval, wait, random_seed):
+    """Compare status requests and wake-up latency of polling and long-polling."""
+    app = current_app._get_current_object()
+    app.config['PAYMENT_STATUS_MAX_WAITERS'] = max(app.config['PAYMENT_STATUS_MAX_WAITERS'], sales)
+    if payments.sale_events is not None:
+        payments.sale_events.max_waiters = app.config['PAYMENT_STATUS_MAX_WAITERS']
+    tag = f'bench-pay-{time.time_ns()}'
+    user = User(username=tag, password='x', role='user')
+    book = Book(title='Payment status benchmark', description='', release_date=date.today(),
+                author='bench', price=1.0, stock=0, reserved=0)
+    db.session.add_all([user, book])
+    db.session.commit()
+    headers = {'Authorization': 'Bearer ' + create_access_token(
+        identity={'id': user.id, 'username': user.username, 'role': user.role})}
+    user_id, book_id = user.id, book.id
+
+    for mode in ('poll', 'long-poll'):
+        rng = random.Random(random_seed)
+        sale_rows = [
+            Sale(user_id=user_id, book_id=book_id, phone_number='254700000000', amount=1.0,
+                 checkout_request_id=f'{tag}-{mode}-{i}')
+            for i in range(sales)
+        ]
+        db.session.add_all(sale_rows)
+        db.session.commit()
+        sale_ids = [(sale.id, sale.checkout_request_id) for sale in sale_rows]
+        settled_at = {}
+        results = []
+        lock = threading.Lock()
+
+        def send_callback(checkout_request_id):
+            body = {'Body': {'stkCallback': {'MerchantRequestID': tag, 'CheckoutRequestID': checkout_request_id,
+                                             'ResultCode': 0, 'ResultDesc': 'ok'}}}
+            with lock:
+                settled_at[checkout_request_id] = time.perf_counter()
+            app.test_client().post('/mpesa/notification', json=body)
+
+        def client(sale_id, checkout_request_id):
+            http = app.test_client()
+            requests_made = 0
+            query = f'?wait={wait}' if mode == 'long-poll' else ''
+            while True:
+                started = time.perf_counter()
+                response = http.get(f'/payment_status/{sale_id}{query}', headers=headers)
+                requests_made += 1
+                if response.status_code != 200 or response.json['settled']:
+                    break
+                # A long-poll that comes back early was refused a wait slot
+                if mode == 'poll' or time.perf_counter() - started < wait:
+                    time.sleep(poll_interval)
+            seen = time.perf_counter()
+            with lock:
+                results.append((requests_made, seen - settled_at.get(checkout_request_id, seen)))
+
+        timers = [threading.Timer(rng.uniform(min_delay, max_delay), send_callback, args=(checkout_request_id,))
+                  for _, checkout_request_id in sale_ids]
+        clients = [threading.Thread(target=client, args=item) for item in sale_ids]
+        started = time.perf_counter()
+        for thread in clients + timers:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        total = sum(count for count, _ in results)
+        latencies = sorted(latency for _, latency in results)
+        emit({
+            'benchmark': 'payment-status',
+            'mode': mode,
+            'sales': sales,
+            'status_requests': total,
+            'requests_per_sale': round(total / sales, 2),
+            'requests_per_sec': round(total / elapsed, 2),
+            'notify_p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+            'notify_max_ms': round(latencies[-1] * 1000, 1),
+        })
+
+    # Sales are removed one by one, taking them back out of the rollup too.
+    # The callbacks settled them in another session, so reload the status.
+    for sale in Sale.query.filter(Sale.user_id == user_id).populate_existing():
+        apply_delta(db.session.connection(), sale.created_at, sale.book_id, sale.status, -1, -sale.amount)
+        db.session.delete(sale)
+    PaymentCallback.query.filter(PaymentCallback.checkout_request_id.like(tag + '-%')).delete(
+        synchronize_session=False)
+    db.session.delete(db.session.get(Book, book_id))
+    db.session.delete(db.session.get(User, user_id))
+    db.session.commit()
+
+
+@bench.command('dashboard')
+@click.option('--limit', default=100, help='Page size asked of the dashboard.')
+@click.option('--repeat', default=5, help='Runs per flow; the fastest is reported.')
+def bench_dashboard(limit, repeat):
+    """Compare the borrowed-books dashboard with the listing + catalog fan-out it replaces."""
+    app = current_app._get_current_object()
+    busiest = (
+        db.session.query(Borrow.user_id, db.func.count())
+        .group_by(Borrow.user_id).order_by(db.func.count().desc()).first()
+    )
+    if busiest is None:
+        raise click.ClickException('No borrows found; run flask seed first.')
+    user = db.session.get(User, busiest[0])
+    headers = {'Authorization': 'Bearer ' + create_access_token(
+        identity={'id': user.id, 'username': user.username, 'role': user.role})}
+    flows = {
+        # Without a book lookup the client downloads the catalog to show titles
+        'borrowed_books+all_books': ['/borrowed_books', '/all_books'],
+        'dashboard': [f'/borrowed_books/dashboard?limit={limit}'],
+    }
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    http = app.test_client()
+    event.listen(Engine, 'before_cursor_execute', count_query)
+    try:
+        for name, paths in flows.items():
+            best = None
+            for _ in range(repeat):
+                queries[0] = 0
+                size = 0
+                started = time.perf_counter()
+                for path in paths:
+                    response = http.get(path, headers=headers)
+                    size += len(response.get_data())
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            emit({
+                'benchmark': 'dashboard',
+                'flow': name,
+                'borrows': busiest[1],
+                'requests': len(paths),
+                'bytes': size,
+                'queries': queries[0],
+                'best_ms': round(best * 1000, 2),
+            })
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count_query)
+
+
+@bench.command('books')
+@click.option('--count', default=20, help='Books the client needs details for.')
+@click.option('--repeat', default=5, help='Runs per flow; the fastest is reported.')
+@click.option('--random-seed', default=7)
+def bench_books(count, repeat, random_seed):
+    """Compare fetching a handful of books from the catalog, one by one and in one batch."""
+    app = current_app._get_current_object()
+    book_ids = [book_id for book_id, in db.session.query(Book.id)]
+    if len(book_ids) < count:
+        raise click.ClickException('Not enough books; run flask seed first.')
+    wanted = random.Random(random_seed).sample(book_ids, count)
+    user = User.query.first()
+    headers = {'Authorization': 'Bearer ' + create_access_token(
+        identity={'id': user.id, 'username': user.username, 'role': user.role})}
+    ids = ','.join(str(book_id) for book_id in wanted)
+    flows = {
+        # Without a lookup by id the client downloads the catalog and filters it
+        'all_books': ['/all_books'],
+        'one_by_one': [f'/books/{book_id}' for book_id in wanted],
+        'batch': [f'/books?ids={ids}'],
+    }
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    http = app.test_client()
+    event.listen(Engine, 'before_cursor_execute', count_query)
+    try:
+        for name, paths in flows.items():
+            for cached in (False, True):
+                if name == 'all_books' and cached:
+                    continue
+                best = None
+                for _ in range(repeat):
+                    if not cached:
+                        book_cache.clear()
+                    queries[0] = 0
+                    size = 0
+                    started = time.perf_counter()
+                    for path in paths:
+                        response = http.get(path, headers=headers)
+                        size += len(response.get_data())
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                emit({
+                    'benchmark': 'books',
+                    'flow': name,
+                    'cache': 'warm' if cached else 'cold',
+                    'books': count,
+                    'requests': len(paths),
+                    'bytes': size,
+                    'queries': queries[0],
+                    'best_ms': round(best * 1000, 2),
+                })
+    finally:
+        event.remove(Engine, 'before_cursor_execute', count_query)
+
+
+# Runs in a fresh interpreter: imports the WSGI entry point the way gunicorn
+# does, serves one request and reports timings, RSS and what got imported
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import wsgi
+created = time.perf_counter()
+wsgi.app.test_client().get('/')
+served = time.perf_counter()
+
+def rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+print(json.dumps({
+    'import_ms': (created - started) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'rss_kb': rss_kb(),
+    'modules': len(sys.modules),
+    'loaded': sorted(name for name in sys.argv[1:] if name in sys.modules),
+}))
+"""
+
+
+@bench.command('startup')
+@click.option('--runs', default=5, help='Fresh interpreters to start; the median is reported.')
+@click.option('--watch', default='requests,PIL,brotli,sqlalchemy.dialects.postgresql',
+              help='Comma separated modules to report as loaded or not.')
+def bench_startup(runs, watch):
+    """Report cold-start time and resident memory of the WSGI entry point."""
+    watched = [name for name in watch.split(',') if name]
+    env = dict(os.environ, JOBS_IN_PROCESS='0', SWEEP_INTERVAL='0')
+    results = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.check_output([sys.executable, '-c', STARTUP_PROBE, *watched],
+                                         cwd=current_app.root_path, env=env)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        result['process_ms'] = (time.perf_counter() - started) * 1000
+        results.append(result)
+
+    def median(key):
+        values = sorted(result[key] for result in results)
+        return round(values[len(values) // 2], 2)
+
+    emit({
+        'benchmark': 'startup',
+        'runs': runs,
+        'process_ms': median('process_ms'),
+        'import_ms': median('import_ms'),
+        'first_request_ms': median('first_request_ms'),
+        'rss_mb': round(median('rss_kb') / 1024, 1),
+        'modules': results[-1]['modules'],
+        'loaded': results[-1]['loaded'],
+    })
@@ -0,0 +1,166 @@
+import csv
+import io
+import json
+import math
+import re
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from datetime import datetime
+from extensions import db
+from models import Book
+from cache import catalog_cache
+
+REQUIRED_FIELDS = ['title', 'description', 'release_date', 'author', 'category', 'price', 'stock']
+
+# Keeps the error report bounded however bad the input file is
+MAX_REPORTED_ERRORS = 1000
+
+# Text columns and their declared lengths (None for unbounded), checked per
+# row so one bad value is reported instead of failing a committed-halfway
+# import on databases that enforce the length
+TEXT_FIELDS = {name: Book.__table__.c[name].type.length for name in ('title', 'description', 'author', 'category')}
+
+
+def validate_book(data):
+    """Check book fields the way add_book does.
+
+    Returns ``(values, None)`` with the column values of a new Book, or
+    ``(None, message)`` describing the first problem found.
+    """
+    missing_fields = [field for field in REQUIRED_FIELDS if data.get(field) is None]
+    if missing_fields:
+        return None, f'Missing fields: {missing_fields}'
+
+    # Covers only come in through add_book, which stores them content-addressed
+    if data.get('photo'):
+        return None, 'photo cannot be set here; upload the cover through add_book.'
+
+    for field, max_length in TEXT_FIELDS.items():
+        value = data[field]
+        if not isinstance(value, str):
+            return None, f'{field} must be text.'
+        if max_length is not None and len(value) > max_length:
+            return None, f'{field} is longer than {max_length} characters.'
+
+    release_date = str(data['release_date'])
+    if not re.match(r'^\d{4}-\d{2}-\d{2}$', release_date):
+        return None, 'Invalid date format. Use YYYY-MM-DD.'
+    try:
+        release_date = datetime.strptime(release_date, '%Y-%m-%d').date()
+    except ValueError as e:
+        return None, f'Invalid date format: {e}'
+
+    try:
+        price = float(data['price'])
+        stock = int(data['stock'])
+    except (TypeError, ValueError):
+        return None, 'Invalid price or stock.'
+    if not math.isfinite(price) or price < 0 or stock < 0:
+        return None, 'Price and stock cannot be negative.'
+
+    return {
+        'title': data['title'],
+        'description': data['description'],
+        'release_date': release_date,
+        'author': data['author'],
+        'category': data['category'],
+        'photo': None,
+        'price': price,
+        'stock': stock,
+        'reserved': 0,
+    }, None
+
+
+def iter_rows(stream, fmt):
+    # Yields (row_number, dict or None, parse error) one line at a time
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            yield number, row, None
+        return
+
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(row, dict):
+            yield number, None, 'Each line must be a JSON object'
+            continue
+        yield number, row, None
+
+
+def import_books(stream, fmt, batch_size):
+    """Stream books from a CSV or JSONL file into the book table.
+
+    Valid rows are inserted with one executemany per batch and committed per
+    batch, so memory use depends on the batch size, not on the file size.
+    """
+    table = Book.__table__
+    report = {'rows': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+    batch = []
+    started = time.perf_counter()
+
+    def flush():
+        if batch:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            report['inserted'] += len(batch)
+            batch.clear()
+
+    try:
+        for number, row, error in iter_rows(stream, fmt):
+            report['rows'] += 1
+            if error is None:
+                values, error = validate_book(row)
+            if error is not None:
+                report['failed'] += 1
+                if len(report['errors']) < MAX_REPORTED_ERRORS:
+                    report['errors'].append({'row': number, 'error': error})
+                continue
+            batch.append(values)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        if report['inserted']:
+            catalog_cache.bump()
+
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_sec'] = round(report['rows'] / elapsed, 1) if elapsed else None
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report
+
+
+def detect_format(filename, mimetype=None):
+    name = (filename or '').lower()
+    if name.endswith('.csv') or mimetype == 'text/csv':
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')) or mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return 'jsonl'
+    return None
+
+
+@click.command('import-books')
+@with_appcontext
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Input format (default: from the file extension).')
+@click.option('--batch-size', default=None, type=int, help='Rows per insert transaction.')
+def import_books_command(path, fmt, batch_size):
+    """Bulk import books from a CSV or JSONL file."""
+    fmt = fmt or detect_format(path)
+    if fmt is None:
+        raise click.UsageError('Cannot tell the file format; pass --format.')
+    with open(path, 'rb') as stream:
+        report = import_books(stream, fmt, batch_size or current_app.config['IMPORT_BATCH_SIZE'])
+    for error in report['errors']:
+        print(f"row {error['row']}: {error['error']}")
+    print(f"Imported {report['inserted']} of {report['rows']} rows "
+          f"({report['failed']} failed) in {report['seconds']}s, {report['rows_per_sec']} rows/sec")
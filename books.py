@@ -0,0 +1,63 @@
+"""Book lookups by id for /books, cached per book.
+
+Each cached entry is a book's default projection. Whatever changes a book
+row records its id on the session: the stock helpers do it explicitly and
+ORM changes go through the Book mapper events. Those ids are dropped from
+the cache once the transaction commits. Missing ids are never cached, so a
+newly added book shows up straight away.
+"""
+import hashlib
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Book
+from projections import BOOK_FIELDS
+from cache import book_cache
+
+
+def mark_books_changed(book_ids):
+    db.session.info.setdefault('books_changed', set()).update(book_ids)
+
+
+@event.listens_for(Book, 'after_insert')
+@event.listens_for(Book, 'after_update')
+@event.listens_for(Book, 'after_delete')
+def book_row_changed(mapper, connection, book):
+    session = inspect(book).session
+    if session is not None:
+        session.info.setdefault('books_changed', set()).add(book.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_books(session):
+    changed = session.info.pop('books_changed', None)
+    if changed:
+        book_cache.invalidate(changed)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_changed_books(session, previous_transaction):
+    session.info.pop('books_changed', None)
+
+
+def load_books(book_ids):
+    """Return ``{id: (book, digest)}`` for the ids that exist.
+
+    Cache misses are read with a single IN query.
+    """
+    found = book_cache.get_many(book_ids)
+    missing = [book_id for book_id in book_ids if book_id not in found]
+    if missing:
+        generation = book_cache.generation
+        names = BOOK_FIELDS.default
+        to_dict = BOOK_FIELDS.row_converter(names)
+        query = BOOK_FIELDS.query(Book.query.filter(Book.id.in_(missing)), names, Book.id)
+        found.update(book_cache.set_many(generation, {row[-1]: to_dict(row) for row in query}))
+    return found
+
+
+def books_etag(entries, fields):
+    # Built from content digests, so every worker process gives the same
+    # rows the same ETag
+    key = repr((fields, [digest for _, digest in entries]))
+    return 'book-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
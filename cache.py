@@ -0,0 +1,319 @@
+import os
+import threading
+import time
+import hashlib
+from collections import OrderedDict
+
+
+class SharedVersion:
+    """Keeps a cache's version token in a stamp file shared by every process.
+
+    After ``share_version(path)`` a ``_new_version()`` in any process on the
+    host (another gunicorn worker, a ``flask`` command) is seen by the next
+    ``current_version()`` everywhere else, which checks the file's stat and
+    drops every local entry when the token moved. Subclasses set
+    ``version`` and ``_lock`` and implement ``_reset()``, called with the
+    lock held.
+    """
+
+    _stamp_path = None
+    _stamp_seen = None
+
+    def share_version(self, path):
+        """Keep the version in the stamp file at ``path``, creating it if needed."""
+        try:
+            with open(path, 'x') as f:
+                f.write(self.version)
+        except FileExistsError:
+            pass
+        with self._lock:
+            self._stamp_path = path
+            self._stamp_seen = None
+            self._reset()
+        self.current_version()
+
+    def current_version(self):
+        """Return the version, picking up changes made by other processes."""
+        path = self._stamp_path
+        if path is None:
+            return self.version
+        try:
+            st = os.stat(path)
+        except OSError:
+            return self.version
+        # os.replace gives every new version a new inode, so two within one
+        # mtime tick are still told apart
+        seen = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if seen == self._stamp_seen:
+            return self.version
+        try:
+            with open(path) as f:
+                token = f.read().strip()
+        except OSError:
+            return self.version
+        with self._lock:
+            self._stamp_seen = seen
+            if token and token != self.version:
+                self.version = token
+                self._reset()
+            return self.version
+
+    def _new_version(self):
+        # Publishes a new token; the caller resets what it has to, under the
+        # lock it already holds
+        token = os.urandom(8).hex()
+        path = self._stamp_path
+        if path is not None:
+            temp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+            with open(temp, 'w') as f:
+                f.write(token)
+            os.replace(temp, path)
+        self.version = token
+        self._stamp_seen = None
+
+
+class ResponseCache(SharedVersion):
+    """LRU of serialized responses, invalidated by a version token.
+
+    Writers call ``bump()`` after committing; every entry stored under an older
+    version becomes unreachable. ETags are derived from the version and the
+    variant key only, so a conditional request can be answered without
+    touching the database.
+
+    After ``share_version(path)`` a bump in any process on the host is seen
+    by the next read everywhere else. Entries also expire after ``ttl``
+    seconds, which bounds staleness for processes that do not share the
+    file.
+    """
+
+    def __init__(self, name, max_entries=64, ttl=60):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Compressed copies of entries, keyed by (key, encoding)
+        self._encoded = {}
+        self.version = os.urandom(8).hex()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _reset(self):
+        self._entries.clear()
+        self._encoded.clear()
+
+    def bump(self):
+        with self._lock:
+            self._new_version()
+            self._reset()
+
+    def etag(self, key, version=None):
+        version = self.current_version() if version is None else version
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+        return '{}-{}-{}'.format(self.name, version, digest)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:2]
+
+    def set(self, key, version, body, headers=None):
+        with self._lock:
+            # A write landed while this entry was being built, so it is stale
+            if version != self.version:
+                return
+            self._entries[key] = (body, headers or {}, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted = next(iter(self._entries))
+                self._drop(evicted)
+
+    def _drop(self, key):
+        del self._entries[key]
+        for encoding in [k[1] for k in self._encoded if k[0] == key]:
+            del self._encoded[(key, encoding)]
+
+    def get_encoded(self, key, encoding):
+        with self._lock:
+            return self._encoded.get((key, encoding))
+
+    def set_encoded(self, key, version, encoding, body):
+        # Stored next to the identity body, so each variant is compressed
+        # once per version
+        with self._lock:
+            if version == self.version and key in self._entries:
+                self._encoded[(key, encoding)] = body
+
+    def record_not_modified(self):
+        with self._lock:
+            self.hits += 1
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'version': self.version,
+                'entries': len(self._entries),
+                'encoded_entries': len(self._encoded),
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+class TTLCache(SharedVersion):
+    """Small thread-safe LRU whose entries also expire after ``ttl`` seconds.
+
+    ``invalidate`` and ``clear`` reach the other processes sharing the
+    version stamp, which drop all their entries.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.version = os.urandom(8).hex()
+        self.hits = 0
+        self.misses = 0
+
+    def _reset(self):
+        self._entries.clear()
+
+    def get(self, key):
+        self.current_version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, version=None):
+        with self._lock:
+            # Another process changed something while the value was read
+            if version is not None and version != self.version:
+                return
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._new_version()
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._new_version()
+            self._reset()
+
+
+class EntityCache(SharedVersion):
+    """Thread-safe LRU of per-entity values, each with a content digest.
+
+    Writers call ``invalidate(keys)`` after committing. A fill started
+    before an invalidation is dropped (``generation`` is read before the
+    query), so a reader cannot put back a row that was just changed.
+    Invalidations reach the other processes sharing the version stamp,
+    which drop all their entries; entries also expire after ``ttl``
+    seconds for processes that do not share it.
+    """
+
+    def __init__(self, name, max_entries=4096, ttl=60):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.version = os.urandom(8).hex()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _reset(self):
+        self.generation += 1
+        self._entries.clear()
+
+    def get_many(self, keys):
+        """Return ``{key: (value, digest)}`` for the keys that are cached."""
+        self.current_version()
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None or entry[2] < now:
+                    if entry is not None:
+                        del self._entries[key]
+                    self.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                found[key] = entry[:2]
+        return found
+
+    def set_many(self, generation, values):
+        """Store ``{key: value}`` and return it as ``{key: (value, digest)}``."""
+        entries = {
+            key: (value, hashlib.sha1(repr(value).encode('utf-8')).hexdigest()[:16])
+            for key, value in values.items()
+        }
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            # A write landed while these values were being read
+            if generation != self.generation:
+                return entries
+            for key, (value, digest) in entries.items():
+                self._entries[key] = (value, digest, expires)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entries
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._new_version()
+            self.generation += 1
+            self.invalidations += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._new_version()
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+catalog_cache = ResponseCache('catalog', max_entries=int(os.getenv('CATALOG_CACHE_ENTRIES', 64)), ttl=int(os.getenv('CATALOG_CACHE_TTL', 60)))
+user_cache = TTLCache(max_entries=int(os.getenv('USER_CACHE_ENTRIES', 1024)), ttl=int(os.getenv('USER_CACHE_TTL', 60)))
+book_cache = EntityCache('book', max_entries=int(os.getenv('BOOK_CACHE_ENTRIES', 4096)), ttl=int(os.getenv('BOOK_CACHE_TTL', 60)))
@@ -0,0 +1,94 @@
+"""Response compression negotiated from Accept-Encoding.
+
+Brotli is preferred when the client accepts it and the ``brotli`` package is
+installed, gzip otherwise. Bodies under COMPRESS_MIN_BYTES are sent as they
+are. Streamed responses are compressed chunk by chunk as they are sent.
+Handlers can compress a body themselves (the catalog stores its compressed
+bytes in the cache) by setting Content-Encoding, which this leaves alone.
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def available_encodings():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate_encoding():
+    """Return the encoding to use for the current request, or None."""
+    if not request.accept_encodings:
+        return None
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def compress(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, config):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=config['COMPRESS_BROTLI_QUALITY'])
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(config['COMPRESS_GZIP_LEVEL'], zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            data = process(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def mark_encoded(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # The compressed bytes differ from the identity ones, so the validator
+    # becomes weak; If-None-Match uses weak comparison anyway
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+class Compressor:
+    def init_app(self, app):
+        self.config = app.config
+        self.mimetypes = set(app.config['COMPRESS_MIMETYPES'])
+        self.min_bytes = app.config['COMPRESS_MIN_BYTES']
+        if app.config['COMPRESS_RESPONSES']:
+            app.after_request(self.after_request)
+
+    def after_request(self, response):
+        if (response.status_code != 200 or response.mimetype not in self.mimetypes
+                or 'Content-Encoding' in response.headers or response.direct_passthrough):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, self.config)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_bytes:
+                return response
+            response.set_data(compress(data, encoding, self.config))
+        mark_encoded(response, encoding)
+        return response
+
+
+compressor = Compressor()
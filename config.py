@@ -0,0 +1,94 @@
+import os
+
+
+class Config:
+    # Configuration settings
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///db.sqlite3')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    UPLOAD_FOLDER = 'static/uploads'
+    MEDIA_URL = os.getenv('MEDIA_URL', '/media/')
+    MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', 5 * 1024 * 1024))
+    MAX_CONTENT_LENGTH = MAX_UPLOAD_BYTES + 1024 * 1024
+    WEBP_QUALITY = int(os.getenv('WEBP_QUALITY', 80))
+
+    # Database engine
+    DATABASE_READ_URL = os.getenv('DATABASE_READ_URL')  # replica used by read-only handlers
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 20))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', -64000))  # negative means KiB
+
+    # Batch borrow transitions
+    BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))
+
+    # Bulk catalog import
+    IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', 1000))
+    IMPORT_MAX_BYTES = int(os.getenv('IMPORT_MAX_BYTES', 512 * 1024 * 1024))
+
+    # Catalog listing
+    BOOKS_PAGE_SIZE = int(os.getenv('BOOKS_PAGE_SIZE', 100))
+    BOOKS_MAX_PAGE_SIZE = int(os.getenv('BOOKS_MAX_PAGE_SIZE', 1000))
+    BOOKS_STREAM_BATCH = int(os.getenv('BOOKS_STREAM_BATCH', 500))
+    CATALOG_CACHE_MAX_BYTES = int(os.getenv('CATALOG_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    CATALOG_VERSION_FILE = os.getenv('CATALOG_VERSION_FILE')  # shared by every process on the host; defaults to the instance folder
+    BOOK_VERSION_FILE = os.getenv('BOOK_VERSION_FILE')  # likewise for the /books cache
+    USER_VERSION_FILE = os.getenv('USER_VERSION_FILE')  # and for the cached users
+
+    # Response compression
+    COMPRESS_RESPONSES = os.getenv('COMPRESS_RESPONSES', '1') == '1'
+    COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+    COMPRESS_MIMETYPES = ['application/json']
+
+    # Background jobs
+    JOBS_IN_PROCESS = os.getenv('JOBS_IN_PROCESS', '1') == '1'
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+    JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 300))
+    JOB_BACKOFF_BASE = float(os.getenv('JOB_BACKOFF_BASE', 2.0))
+    JOB_BACKOFF_CAP = float(os.getenv('JOB_BACKOFF_CAP', 300.0))
+
+    # Borrow expiry
+    BORROW_PENDING_TTL_DAYS = int(os.getenv('BORROW_PENDING_TTL_DAYS', 7))
+    BORROW_PICKUP_TTL_DAYS = int(os.getenv('BORROW_PICKUP_TTL_DAYS', 3))
+    SWEEP_BATCH_SIZE = int(os.getenv('SWEEP_BATCH_SIZE', 500))
+    SWEEP_MAX_BATCHES = int(os.getenv('SWEEP_MAX_BATCHES', 20))
+    SWEEP_INTERVAL = float(os.getenv('SWEEP_INTERVAL', 0))  # seconds, 0 disables the in-process timer
+
+    # Archival of finished borrows and settled sales
+    ARCHIVE_BORROW_DAYS = int(os.getenv('ARCHIVE_BORROW_DAYS', 180))
+    ARCHIVE_SALE_DAYS = int(os.getenv('ARCHIVE_SALE_DAYS', 365))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 1000))
+    ARCHIVE_MAX_BATCHES = int(os.getenv('ARCHIVE_MAX_BATCHES', 100))
+
+    # M-Pesa callbacks
+    MPESA_CALLBACK_BATCH_SIZE = int(os.getenv('MPESA_CALLBACK_BATCH_SIZE', 50))
+    MPESA_CALLBACK_FLUSH_INTERVAL = float(os.getenv('MPESA_CALLBACK_FLUSH_INTERVAL', 0.1))
+    MPESA_CALLBACK_SEEN_KEYS = int(os.getenv('MPESA_CALLBACK_SEEN_KEYS', 10000))
+    MPESA_CALLBACK_MAX_ATTEMPTS = int(os.getenv('MPESA_CALLBACK_MAX_ATTEMPTS', 5))  # per row, before it is dropped and logged
+    MPESA_CALLBACK_RECONCILE_INTERVAL = float(os.getenv('MPESA_CALLBACK_RECONCILE_INTERVAL', 30))  # seconds
+
+    # Payment status long-polling
+    PAYMENT_STATUS_MAX_WAIT = float(os.getenv('PAYMENT_STATUS_MAX_WAIT', 25))  # seconds
+    PAYMENT_STATUS_RECHECK = float(os.getenv('PAYMENT_STATUS_RECHECK', 5))  # re-read for other processes' callbacks
+    PAYMENT_STATUS_MAX_WAITERS = int(os.getenv('PAYMENT_STATUS_MAX_WAITERS', 8))  # per process; each holds a thread
+
+    # Instrumentation
+    SQL_INSTRUMENTATION = os.getenv('SQL_INSTRUMENTATION', '0') == '1'
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
+
+    # Password hashing
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+    BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', os.cpu_count() or 2))
+    BCRYPT_QUEUE_SIZE = int(os.getenv('BCRYPT_QUEUE_SIZE', 32))
+
+    # JWT Configuration
+    JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'S)83@Jp0LqE0=pufzcI=jcW*0B#XLoBd6+g=y6P*rQ=8dpYfZ')
+    SECRET_KEY = os.getenv('SECRET_KEY', 'xNFzG46=+^CCqwTcMge07q-$5GZ^1vbNm$JBPvRMx2zY#Fb2D*')
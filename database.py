@@ -0,0 +1,83 @@
+"""Engine tuning and read/write routing.
+
+``engine_options`` and ``configure_binds`` fill in the Flask-SQLAlchemy
+config before the extension is initialised. SQLite connections get their
+pragmas on connect, and handlers marked with ``read_only`` send their
+queries to the ``replica`` bind when ``DATABASE_READ_URL`` is set.
+"""
+from functools import wraps
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+READ_BIND = 'replica'
+
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    # Pool settings only make sense for server databases; SQLite picks its
+    # own pool depending on whether the database is a file or in memory
+    if is_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def configure_binds(config):
+    read_url = config.get('DATABASE_READ_URL')
+    if not read_url:
+        return
+    binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+    options = engine_options(dict(config, SQLALCHEMY_DATABASE_URI=read_url))
+    binds[READ_BIND] = dict(options, url=read_url)
+    config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_sqlite_pragmas(config, engines):
+    pragmas = [
+        ('journal_mode', config['SQLITE_JOURNAL_MODE']),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('busy_timeout', config['SQLITE_BUSY_TIMEOUT_MS']),
+        ('mmap_size', config['SQLITE_MMAP_SIZE']),
+        ('cache_size', config['SQLITE_CACHE_SIZE']),
+    ]
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    # Listen on each app's own engines, so building several apps (tests,
+    # `flask` commands) never stacks listeners on every Engine
+    for engine in engines:
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', set_sqlite_pragmas)
+
+
+def read_only(f):
+    # Lets the handler's queries go to the read replica, if one is configured.
+    # Only use it on handlers that never write. The flag lives on g, so a
+    # streamed response body keeps reading from the replica too.
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context()
+                and g.get('db_read_only') and READ_BIND in self._db.engines):
+            return self._db.engines[READ_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
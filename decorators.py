@@ -2,6 +2,37 @@ from functools import wraps
 from flask import redirect, url_for, flash
 from flask_login import current_user
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from extensions import db
+from models import User
+from cache import user_cache
+
+
+def get_current_user_id():
+    identity = get_jwt_identity()
+    user_id = identity.get('id')
+    if user_id is None:
+        # Tokens issued before the id was added to the identity
+        user_id = db.session.query(User.id).filter_by(username=identity['username']).scalar()
+    return user_id
+
+
+def load_user(user_id):
+    # Users are cached detached and merged into the current session without
+    # a SELECT; admin.edit_user and admin.delete_user invalidate the entry in
+    # every process through the cache's version stamp
+    if user_id is None:
+        return None
+    user = user_cache.get(user_id)
+    if user is None:
+        # Read first, so a change committed during the SELECT is not cached
+        version = user_cache.version
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        db.session.expunge(user)
+        user_cache.set(user_id, user, version)
+    return db.session.merge(user, load=False)
+
 
 # admin access only
 def admin_required(f):
@@ -0,0 +1,13 @@
+"""Extension instances, bound to an app by ``create_app``.
+
+Models, blueprints and commands import ``db`` from here rather than from
+``app``, so importing them never builds an application.
+"""
+from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
+from flask_jwt_extended import JWTManager
+from database import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
+jwt = JWTManager()
@@ -0,0 +1,138 @@
+"""Local stand-in for the Daraja endpoints used by mpesa.py.
+
+Run ``python fake_mpesa.py --port 8099`` and start the app with
+``MPESA_BASE_URL=http://127.0.0.1:8099``.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+
+class FakeDarajaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        if urlparse(self.path).path != '/oauth/v1/generate':
+            return self._send_json(404, {'errorMessage': 'Not found'})
+        if not self.headers.get('Authorization', '').startswith('Basic '):
+            return self._send_json(400, {'errorMessage': 'Invalid Authentication passed'})
+
+        with server.lock:
+            server.token_requests += 1
+            server.token = uuid.uuid4().hex
+        self._send_json(200, {'access_token': server.token, 'expires_in': str(server.expires_in)})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        if urlparse(self.path).path != '/mpesa/stkpush/v1/processrequest':
+            return self._send_json(404, {'errorMessage': 'Not found'})
+        if self.headers.get('Authorization') != 'Bearer %s' % server.token:
+            return self._send_json(401, {'errorCode': '404.001.03', 'errorMessage': 'Invalid Access Token'})
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        with server.lock:
+            server.stk_requests += 1
+        checkout_request_id = 'ws_CO_%s' % uuid.uuid4().hex[:20]
+        merchant_request_id = uuid.uuid4().hex[:12]
+        self._send_json(200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing'
+        })
+
+        if server.callback_delay is not None and payload.get('CallBackURL'):
+            timer = threading.Timer(
+                server.callback_delay, send_callback,
+                args=(payload, merchant_request_id, checkout_request_id)
+            )
+            timer.daemon = True
+            timer.start()
+
+
+def send_callback(payload, merchant_request_id, checkout_request_id):
+    body = {
+        'Body': {
+            'stkCallback': {
+                'MerchantRequestID': merchant_request_id,
+                'CheckoutRequestID': checkout_request_id,
+                'ResultCode': 0,
+                'ResultDesc': 'The service request is processed successfully.',
+                'CallbackMetadata': {
+                    'Item': [
+                        {'Name': 'Amount', 'Value': payload.get('Amount')},
+                        {'Name': 'MpesaReceiptNumber', 'Value': uuid.uuid4().hex[:10].upper()},
+                        {'Name': 'TransactionDate', 'Value': int(time.strftime('%Y%m%d%H%M%S'))},
+                        {'Name': 'PhoneNumber', 'Value': payload.get('PhoneNumber')}
+                    ]
+                }
+            }
+        }
+    }
+    try:
+        requests.post(payload['CallBackURL'], json=body, timeout=5)
+    except requests.RequestException as e:
+        print(f"Fake M-Pesa callback failed: {e}")
+
+
+def start_fake_mpesa(host='127.0.0.1', port=0, latency=0.0, expires_in=3599, callback_delay=None):
+    """Start the stand-in server on a background thread and return it.
+
+    The base URL to hand to ``MpesaClient`` is available as ``server.url``.
+    """
+    server = ThreadingHTTPServer((host, port), FakeDarajaHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.token = None
+    server.token_requests = 0
+    server.stk_requests = 0
+    server.latency = latency
+    server.expires_in = expires_in
+    server.callback_delay = callback_delay
+    server.url = 'http://%s:%d' % server.server_address[:2]
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Daraja (M-Pesa) server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each STK push')
+    parser.add_argument('--callback-delay', type=float, default=None,
+                        help='post a success callback to CallBackURL after this many seconds')
+    args = parser.parse_args()
+
+    server = start_fake_mpesa(args.host, args.port, args.latency, callback_delay=args.callback_delay)
+    print(f"Fake M-Pesa listening on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,50 @@
+"""JSON provider backed by orjson.
+
+Output matches what ``jsonify`` produced before: keys are sorted and dates
+use the HTTP date format. Without orjson installed the stdlib encoder is
+used as before.
+"""
+from functools import lru_cache
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Listings repeat the same dates many times, so formatting is memoized
+format_date = lru_cache(maxsize=4096)(http_date)
+
+
+def _default(o):
+    # orjson hands dates and datetimes here because of OPT_PASSTHROUGH_DATETIME
+    if hasattr(o, 'timetuple'):
+        return format_date(o)
+    return DefaultJSONProvider.default(o)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps_bytes(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return DefaultJSONProvider.dumps(self, obj, **kwargs).encode('utf-8')
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj, **kwargs).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Pretty printing in debug mode goes through the stdlib encoder
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,57 @@
+"""Gunicorn settings, used with ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+The app is built once in the master (``preload_app``) and workers are forked
+from it, so imports, config and blueprints are paid for once and the
+workers share those pages copy-on-write. Each worker runs a thread pool
+(``gthread``): handlers spend most of their time waiting on the database,
+bcrypt (which releases the GIL) or M-Pesa, so threads are a cheaper way to
+add concurrency than more processes.
+
+Nothing in ``create_app`` opens a database connection or starts a thread;
+the job worker, callback ingester and sweeper start in each worker on its
+first request.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# Long-polling payment_status requests hold a thread each while they wait;
+# keep PAYMENT_STATUS_MAX_WAITERS well below this
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+preload_app = True
+
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# With gthread workers ``timeout`` is not a request deadline: the worker's
+# main loop heartbeats while its threads serve requests, so a long-poll or
+# a slow handler never trips it. The master kills a worker whose heartbeat
+# stops for this long, i.e. a worker that is wedged as a whole.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+# Recycle workers now and then so slow leaks cannot grow without bound;
+# the jitter keeps them from restarting together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+
+
+def pre_fork(server, worker):
+    # Move everything the preloaded app allocated out of the collector's
+    # reach, so collections in the worker do not touch (and copy) the
+    # shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections must not be shared across processes; drop any pool the
+    # master may have opened without closing the master's sockets
+    from wsgi import app
+    from extensions import db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,143 @@
+"""Opt-in per-request SQL and timing instrumentation.
+
+Enabled with ``SQL_INSTRUMENTATION=1``. When it is off nothing below is
+registered, so requests pay no extra cost at all.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict, deque
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from fast_json import FastJSONProvider
+from extensions import db
+
+# Upper bounds of the request-duration histogram buckets, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+
+class RequestHistogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS_MS)
+        self.requests = 0
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+
+    def observe(self, total_ms, db_ms, queries):
+        self.counts[bisect.bisect_left(BUCKETS_MS, total_ms)] += 1
+        self.requests += 1
+        self.total_ms += total_ms
+        self.db_ms += db_ms
+        self.queries += queries
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'mean_ms': round(self.total_ms / self.requests, 3) if self.requests else None,
+            'mean_db_ms': round(self.db_ms / self.requests, 3) if self.requests else None,
+            'queries_per_request': round(self.queries / self.requests, 2) if self.requests else None,
+            'buckets': {
+                ('+Inf' if bound == float('inf') else str(bound)): count
+                for bound, count in zip(BUCKETS_MS, self.counts)
+            }
+        }
+
+
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_ms = 100.0
+        self._lock = threading.Lock()
+        self.histograms = defaultdict(RequestHistogram)
+        self.slow_queries = deque(maxlen=200)
+
+    def init_app(self, app):
+        self.enabled = app.config['SQL_INSTRUMENTATION']
+        if not self.enabled:
+            return
+        self.slow_query_ms = app.config['SLOW_QUERY_MS']
+        self.logger = app.logger
+
+        # Only this app's engines; listening on the Engine class would time
+        # every engine in the process and stack up when apps are rebuilt
+        with app.app_context():
+            engines = list(db.engines.values())
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.json = TimedJSONProvider(app)
+
+    def _before_request(self):
+        g.sql_queries = 0
+        g.sql_time = 0.0
+        g.serialize_time = 0.0
+        g.request_started = time.perf_counter()
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        endpoint = None
+        if has_request_context() and 'sql_queries' in g:
+            g.sql_queries += 1
+            g.sql_time += elapsed
+            endpoint = request.endpoint
+
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms >= self.slow_query_ms:
+            entry = {
+                'endpoint': endpoint,
+                'duration_ms': round(elapsed_ms, 3),
+                'statement': statement,
+                'at': time.time()
+            }
+            with self._lock:
+                self.slow_queries.append(entry)
+            self.logger.warning("Slow query (%.1f ms) in %s: %s", elapsed_ms, endpoint, statement)
+
+    def _after_request(self, response):
+        if 'request_started' not in g:
+            return response
+        total = time.perf_counter() - g.request_started
+        db_time = g.sql_time
+        serialize_time = g.serialize_time
+        handler_time = max(total - db_time - serialize_time, 0.0)
+
+        response.headers['Server-Timing'] = ', '.join([
+            'db;dur=%.3f;desc="%d queries"' % (db_time * 1000, g.sql_queries),
+            'serialize;dur=%.3f' % (serialize_time * 1000),
+            'handler;dur=%.3f' % (handler_time * 1000),
+            'total;dur=%.3f' % (total * 1000),
+        ])
+
+        with self._lock:
+            self.histograms[request.endpoint or 'unknown'].observe(total * 1000, db_time * 1000, g.sql_queries)
+        return response
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'slow_query_ms': self.slow_query_ms,
+                'endpoints': {name: hist.as_dict() for name, hist in self.histograms.items()},
+                'slow_queries': list(self.slow_queries)
+            }
+
+
+class TimedJSONProvider(FastJSONProvider):
+    # Attributes time spent encoding JSON to the current request
+
+    def dumps_bytes(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps_bytes(obj, **kwargs)
+        finally:
+            if has_request_context() and 'serialize_time' in g:
+                g.serialize_time += time.perf_counter() - started
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,299 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from extensions import db
+from models import Job
+
+# Registered job handlers, keyed by job kind
+handlers = {}
+
+
+def job_handler(kind, on_failure=None):
+    # on_failure runs once a job has used up all of its attempts
+    def decorator(f):
+        handlers[kind] = (f, on_failure)
+        return f
+    return decorator
+
+
+def enqueue(kind, payload, max_attempts=None):
+    """Add a job to the current session.
+
+    The job is committed together with the caller's own changes, so it is
+    never lost and never runs for a transaction that was rolled back.
+    """
+    job = Job(kind=kind, payload=json.dumps(payload), status='queued', run_at=datetime.utcnow())
+    if max_attempts is not None:
+        job.max_attempts = max_attempts
+    db.session.add(job)
+    db.session.info['jobs_enqueued'] = True
+    return job
+
+
+@event.listens_for(Session, 'after_commit')
+def wake_worker_after_commit(session):
+    # Wake the pool only once the job is visible to other connections
+    if session.info.pop('jobs_enqueued', False) and worker is not None:
+        worker.wake()
+
+
+def backoff_delay(attempts, base, cap):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * (2 ** (attempts - 1))))
+
+
+class JobMetrics:
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        self.abandoned = 0
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self, kind, seconds, outcome):
+        with self._lock:
+            self.in_flight -= 1
+            self.latencies[kind].append(seconds)
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def abandon(self):
+        with self._lock:
+            self.abandoned += 1
+
+    def snapshot(self):
+        with self._lock:
+            latency = {}
+            for kind, samples in self.latencies.items():
+                ordered = sorted(samples)
+                if not ordered:
+                    continue
+                latency[kind] = {
+                    'count': len(ordered),
+                    'p50_ms': round(ordered[len(ordered) // 2] * 1000, 2),
+                    'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+                    'max_ms': round(ordered[-1] * 1000, 2)
+                }
+            return {
+                'in_flight': self.in_flight,
+                'succeeded': self.succeeded,
+                'retried': self.retried,
+                'failed': self.failed,
+                'abandoned': self.abandoned,
+                'latency': latency
+            }
+
+
+metrics = JobMetrics()
+
+
+def queue_depth():
+    return Job.query.filter(Job.status == 'queued').count()
+
+
+class JobWorker:
+    """Pool of threads that run jobs from the job table.
+
+    The pool size bounds how many jobs (and therefore gateway calls) run at
+    once. Jobs are claimed with a conditional UPDATE, so several processes can
+    share one table without running a job twice.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.size = app.config['JOB_WORKERS']
+        self.poll_interval = app.config['JOB_POLL_INTERVAL']
+        self.lease = timedelta(seconds=app.config['JOB_LEASE_SECONDS'])
+        self.backoff_base = app.config['JOB_BACKOFF_BASE']
+        self.backoff_cap = app.config['JOB_BACKOFF_CAP']
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.size):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    ran = self.run_once()
+            except Exception:
+                self.app.logger.exception('Job worker error')
+                ran = False
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        stale = now - self.lease
+        candidate = (
+            db.session.query(Job.id)
+            .filter(db.or_(
+                db.and_(Job.status == 'queued', Job.run_at <= now),
+                # Jobs left running by a worker that died are picked up again,
+                # as long as they have attempts left
+                db.and_(Job.status == 'running', Job.locked_at < stale, Job.attempts < Job.max_attempts)
+            ))
+            .order_by(Job.run_at)
+            .limit(1)
+            .scalar()
+        )
+        if candidate is None:
+            return None
+
+        claimed = (
+            Job.query
+            .filter(Job.id == candidate, db.or_(
+                db.and_(Job.status == 'queued', db.or_(Job.locked_at.is_(None), Job.locked_at < stale)),
+                db.and_(Job.status == 'running', Job.locked_at < stale, Job.attempts < Job.max_attempts)
+            ))
+            .update({'status': 'running', 'locked_at': now, 'attempts': Job.attempts + 1},
+                    synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed != 1:
+            # Another worker got there first; try again straight away
+            return False
+        return db.session.get(Job, candidate)
+
+    def fail_abandoned(self, limit=10):
+        """Fail jobs whose worker died during their last attempt.
+
+        They are not run again, since their side effect (an STK push) may
+        already have happened, but their on_failure still runs.
+        """
+        stale = datetime.utcnow() - self.lease
+        abandoned = (
+            db.session.query(Job.id, Job.kind)
+            .filter(Job.status == 'running', Job.locked_at < stale, Job.attempts >= Job.max_attempts)
+            .limit(limit)
+            .all()
+        )
+        for job_id, kind in abandoned:
+            failed = (
+                Job.query
+                .filter(Job.id == job_id, Job.status == 'running', Job.locked_at < stale)
+                .update({'status': 'failed', 'locked_at': None,
+                         'last_error': 'Lease expired during the last attempt'},
+                        synchronize_session=False)
+            )
+            db.session.commit()
+            if failed == 1:
+                metrics.abandon()
+                self._run_on_failure(job_id, kind)
+        return len(abandoned)
+
+    def run_once(self):
+        self.fail_abandoned()
+        job = self._claim()
+        if job is None:
+            return False
+        if job is False:
+            return True
+
+        job_id, kind = job.id, job.kind
+        handler, _ = handlers.get(kind, (None, None))
+        metrics.started()
+        started = time.perf_counter()
+        outcome = 'failed'
+        try:
+            try:
+                if handler is None:
+                    raise LookupError(f'No handler registered for job kind {kind!r}')
+                handler(json.loads(job.payload), job)
+                job.status = 'done'
+                job.last_error = None
+                job.locked_at = None
+                db.session.commit()
+                outcome = 'succeeded'
+            except Exception as e:
+                db.session.rollback()
+                outcome = self._record_failure(job_id, e)
+                if outcome == 'failed':
+                    self._run_on_failure(job_id, kind)
+        finally:
+            metrics.finished(kind, time.perf_counter() - started, outcome)
+        return True
+
+    def _record_failure(self, job_id, error):
+        job = db.session.get(Job, job_id)
+        job.last_error = str(error)
+        job.locked_at = None
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            outcome = 'failed'
+        else:
+            job.status = 'queued'
+            job.run_at = datetime.utcnow() + timedelta(
+                seconds=backoff_delay(job.attempts, self.backoff_base, self.backoff_cap))
+            outcome = 'retried'
+        db.session.commit()
+        return outcome
+
+    def _run_on_failure(self, job_id, kind):
+        # Runs after the terminal status is committed, in its own
+        # transaction, so a failing hook can never leave the job running
+        _, on_failure = handlers.get(kind, (None, None))
+        if on_failure is None:
+            return
+        job = db.session.get(Job, job_id)
+        try:
+            on_failure(json.loads(job.payload), job)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('on_failure hook for job %s (%s) failed', job_id, kind)
+
+
+worker = None
+_worker_lock = threading.Lock()
+
+
+def start_worker(app):
+    global worker
+    with _worker_lock:
+        if worker is None:
+            worker = JobWorker(app)
+            worker.start()
+    return worker
+
+
+@click.command('run-jobs')
+@with_appcontext
+def run_jobs():
+    """Run the background job worker in the foreground."""
+    current_app.config['JOBS_IN_PROCESS'] = False
+    job_worker = start_worker(current_app._get_current_object())
+    print(f"Job worker running with {job_worker.size} threads")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        job_worker.stop(timeout=30)
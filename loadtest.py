@@ -0,0 +1,206 @@
+"""Load test harness, run with ``flask loadtest``.
+
+Drives the real HTTP endpoints with a weighted mix of requests from
+concurrent virtual users and prints per-endpoint latency percentiles and
+throughput as JSON. Without ``--url`` the app is served in-process on a
+local port and M-Pesa calls go to the stand-in server from fake_mpesa.py,
+so no external services are needed. Seed data first with ``flask seed``.
+"""
+import json
+import random
+import subprocess
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.serving import make_server, WSGIRequestHandler
+from extensions import db
+from models import Book
+
+DEFAULT_MIX = 'login=5,all_books=35,borrow_book=15,checkout=10,manage_borrow_requests=15,sales_analytics=20'
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise click.BadParameter(f'unknown endpoint {name!r}; choose from {sorted(OPERATIONS)}')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class VirtualUser:
+    def __init__(self, base_url, ctx, rng):
+        import requests
+        self.base_url = base_url
+        self.ctx = ctx
+        self.rng = rng
+        self.session = requests.Session()
+        self.tokens = {}
+
+    def request(self, method, path, role=None, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if role is not None:
+            headers['Authorization'] = 'Bearer ' + self.tokens[role]
+        return self.session.request(method, self.base_url + path, headers=headers, timeout=30, **kwargs)
+
+    def login(self, role='user'):
+        count = self.ctx['users'] if role == 'user' else self.ctx['admins']
+        username = '%s-%s-%d' % (self.ctx['prefix'], role, self.rng.randrange(count))
+        response = self.request('POST', '/login', json={'username': username, 'password': self.ctx['password']})
+        if response.status_code == 200:
+            self.tokens[role] = response.json()['access_token']
+        return response
+
+    def random_book(self):
+        return self.rng.randint(self.ctx['book_low'], self.ctx['book_high'])
+
+
+OPERATIONS = {
+    'login': lambda vu: vu.login('user'),
+    'all_books': lambda vu: vu.request('GET', '/all_books?limit=50&after=%d' % (vu.random_book() - 1), 'user'),
+    'borrow_book': lambda vu: vu.request('POST', '/borrow_book/%d' % vu.random_book(), 'user'),
+    'checkout': lambda vu: vu.request('POST', '/checkout/%d' % vu.random_book(), 'user',
+                                      json={'phone_number': '07%08d' % vu.rng.randrange(10 ** 8)}),
+    'manage_borrow_requests': lambda vu: vu.request('GET', '/manage_borrow_requests?status=pending', 'admin'),
+    'sales_analytics': lambda vu: vu.request('GET', '/sales/analytics', 'admin'),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=current_app.root_path,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command('loadtest')
+@with_appcontext
+@click.option('--url', default=None, help='Test a running server instead of an in-process one.')
+@click.option('--duration', default=30.0, help='Measured seconds.')
+@click.option('--warmup', default=5.0, help='Seconds of load before measuring starts.')
+@click.option('--concurrency', default=16, help='Concurrent virtual users.')
+@click.option('--mix', default=DEFAULT_MIX, help='Comma separated endpoint=weight pairs.')
+@click.option('--prefix', default='seed', help='Username prefix used by flask seed.')
+@click.option('--users', default=1000, help='Seeded regular users to log in as.')
+@click.option('--admins', default=5, help='Seeded admins to log in as.')
+@click.option('--password', default='password')
+@click.option('--mpesa-latency', default=0.3, help='Seconds the fake M-Pesa server takes per STK push.')
+@click.option('--random-seed', default=1)
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Also write the JSON report here.')
+def loadtest(url, duration, warmup, concurrency, mix, prefix, users, admins, password,
+             mpesa_latency, random_seed, output):
+    """Run a mixed-endpoint load test and report latency per endpoint."""
+    # Imported here so serving the app never loads the HTTP client
+    import requests
+    import mpesa
+    from fake_mpesa import start_fake_mpesa
+
+    mix = parse_mix(mix)
+    book_low, book_high = db.session.query(db.func.min(Book.id), db.func.max(Book.id)).one()
+    if book_low is None:
+        raise click.ClickException('No books found; run flask seed first.')
+    db.session.remove()
+
+    server = fake = None
+    if url is None:
+        fake = start_fake_mpesa(latency=mpesa_latency)
+        mpesa._client = mpesa.MpesaClient(mpesa.consumer_key, mpesa.consumer_secret, mpesa.shortcode,
+                                          mpesa.passkey, mpesa.callback_url, base_url=fake.url)
+        server = make_server('127.0.0.1', 0, current_app._get_current_object(), threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d' % server.server_port
+
+    ctx = {'prefix': prefix, 'users': users, 'admins': admins, 'password': password,
+           'book_low': book_low, 'book_high': book_high}
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    measure_from = time.perf_counter() + warmup
+    deadline = measure_from + duration
+    samples = []
+    failures = []
+
+    def run(index):
+        rng = random.Random(random_seed * 1000 + index)
+        vu = VirtualUser(url, ctx, rng)
+        local, local_failures = [], []
+        try:
+            vu.login('user')
+            vu.login('admin')
+        except requests.RequestException as e:
+            local_failures.append(('login', str(e)))
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = OPERATIONS[name](vu).status_code
+            except (requests.RequestException, KeyError) as e:
+                status = None
+                local_failures.append((name, str(e)))
+            if started >= measure_from:
+                local.append((name, time.perf_counter() - started, status))
+        samples.extend(local)
+        failures.extend(local_failures)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if server is not None:
+        server.shutdown()
+    if fake is not None:
+        fake.shutdown()
+
+    endpoints = {}
+    for name in names:
+        rows = [sample for sample in samples if sample[0] == name]
+        latencies = sorted(sample[1] for sample in rows)
+        statuses = {}
+        for _, _, status in rows:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints[name] = {
+            'requests': len(rows),
+            'rps': round(len(rows) / duration, 2),
+            'errors': sum(1 for _, _, status in rows if status is None or status >= 500),
+            'statuses': statuses,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        }
+
+    report = {
+        'commit': git_commit(),
+        'database': db.engine.dialect.name,
+        'url': url,
+        'duration': duration,
+        'concurrency': concurrency,
+        'mix': mix,
+        'total_requests': len(samples),
+        'total_rps': round(len(samples) / duration, 2),
+        'endpoints': endpoints,
+        'transport_errors': failures[:20],
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
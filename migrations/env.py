@@ -51,6 +51,20 @@ def get_metadata():
     return target_db.metadata
 
 
+# Search index objects are created by hand in the book_search_index revision
+# and have no model, so autogenerate must not treat them as removed
+SEARCH_INDEX_TABLE_PREFIX = 'book_fts'
+SEARCH_INDEX_NAMES = {'ix_book_search'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and name.startswith(SEARCH_INDEX_TABLE_PREFIX):
+        return False
+    if type_ == 'index' and name in SEARCH_INDEX_NAMES:
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +79,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +108,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
@@ -0,0 +1,78 @@
+"""book search index
+
+Revision ID: 3f1c9a7d2b64
+Revises: acc91214e971
+Create Date: 2026-10-18 09:12:44.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b64'
+down_revision = 'acc91214e971'
+branch_labels = None
+depends_on = None
+
+
+FTS_COLUMNS = 'title, author, category, description'
+
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(book.title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(book.author, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(book.category, '')), 'C') || "
+    "setweight(to_tsvector('english', coalesce(book.description, '')), 'D')"
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        # External-content FTS5 table over book, kept in sync by triggers so
+        # add_book and any later edit are indexed in the same transaction
+        op.execute(
+            "CREATE VIRTUAL TABLE book_fts USING fts5("
+            f"{FTS_COLUMNS}, content='book', content_rowid='id', tokenize='unicode61')"
+        )
+        op.execute(
+            "CREATE TRIGGER book_fts_ai AFTER INSERT ON book BEGIN "
+            f"INSERT INTO book_fts(rowid, {FTS_COLUMNS}) "
+            "VALUES (new.id, new.title, new.author, new.category, new.description); "
+            "END"
+        )
+        op.execute(
+            "CREATE TRIGGER book_fts_ad AFTER DELETE ON book BEGIN "
+            f"INSERT INTO book_fts(book_fts, rowid, {FTS_COLUMNS}) "
+            "VALUES ('delete', old.id, old.title, old.author, old.category, old.description); "
+            "END"
+        )
+        # Only text edits touch the index; stock updates do not
+        op.execute(
+            f"CREATE TRIGGER book_fts_au AFTER UPDATE OF {FTS_COLUMNS} ON book BEGIN "
+            f"INSERT INTO book_fts(book_fts, rowid, {FTS_COLUMNS}) "
+            "VALUES ('delete', old.id, old.title, old.author, old.category, old.description); "
+            f"INSERT INTO book_fts(rowid, {FTS_COLUMNS}) "
+            "VALUES (new.id, new.title, new.author, new.category, new.description); "
+            "END"
+        )
+        # Backfill existing rows
+        op.execute("INSERT INTO book_fts(book_fts) VALUES ('rebuild')")
+
+    elif dialect == 'postgresql':
+        # Expression index: Postgres maintains it on every write, no triggers needed
+        op.execute(f"CREATE INDEX ix_book_search ON book USING GIN (({PG_DOCUMENT}))")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS book_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS book_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS book_fts_ai")
+        op.execute("DROP TABLE IF EXISTS book_fts")
+
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_book_search")
@@ -0,0 +1,38 @@
+"""borrow approved_at
+
+Revision ID: 4d8a1c6e9f02
+Revises: b6d29e4f7a13
+Create Date: 2026-10-18 19:02:17.403115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d8a1c6e9f02'
+down_revision = 'b6d29e4f7a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('borrow', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('approved_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_borrow_status_approved_at', ['status', 'approved_at'], unique=False)
+
+    with op.batch_alter_table('borrow_archive', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('approved_at', sa.DateTime(), nullable=True))
+
+    # When these were approved is unknown; give them a full pickup window
+    # from now rather than expiring them on the first sweep
+    op.execute("UPDATE borrow SET approved_at = CURRENT_TIMESTAMP WHERE status = 'awaiting_pickup'")
+
+
+def downgrade():
+    with op.batch_alter_table('borrow_archive', schema=None) as batch_op:
+        batch_op.drop_column('approved_at')
+
+    with op.batch_alter_table('borrow', schema=None) as batch_op:
+        batch_op.drop_index('ix_borrow_status_approved_at')
+        batch_op.drop_column('approved_at')
@@ -0,0 +1,40 @@
+"""hot filter indexes
+
+Revision ID: 5a0c7e2b9d18
+Revises: d41e6a9f3c52
+Create Date: 2026-10-18 14:22:51.604418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a0c7e2b9d18'
+down_revision = 'd41e6a9f3c52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('borrow', schema=None) as batch_op:
+        batch_op.create_index('ix_borrow_user_book_status', ['user_id', 'book_id', 'status'], unique=False)
+        batch_op.create_index('ix_borrow_book_status', ['book_id', 'status'], unique=False)
+        batch_op.create_index('ix_borrow_status_borrow_date', ['status', 'borrow_date'], unique=False)
+
+    with op.batch_alter_table('sale', schema=None) as batch_op:
+        batch_op.create_index('ix_sale_created_at', ['created_at'], unique=False)
+        batch_op.create_index('ix_sale_status_created_at', ['status', 'created_at'], unique=False)
+        batch_op.create_index('ix_sale_user_created_at', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sale', schema=None) as batch_op:
+        batch_op.drop_index('ix_sale_user_created_at')
+        batch_op.drop_index('ix_sale_status_created_at')
+        batch_op.drop_index('ix_sale_created_at')
+
+    with op.batch_alter_table('borrow', schema=None) as batch_op:
+        batch_op.drop_index('ix_borrow_status_borrow_date')
+        batch_op.drop_index('ix_borrow_book_status')
+        batch_op.drop_index('ix_borrow_user_book_status')
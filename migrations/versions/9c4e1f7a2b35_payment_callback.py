@@ -0,0 +1,42 @@
+"""payment callback
+
+Revision ID: 9c4e1f7a2b35
+Revises: e7b3d5a81f26
+Create Date: 2026-10-18 16:12:44.208517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e1f7a2b35'
+down_revision = 'e7b3d5a81f26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payment_callback',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('idempotency_key', sa.String(length=100), nullable=False),
+    sa.Column('checkout_request_id', sa.String(length=100), nullable=False),
+    sa.Column('result_code', sa.Integer(), nullable=False),
+    sa.Column('result_desc', sa.String(length=255), nullable=True),
+    sa.Column('receipt_number', sa.String(length=50), nullable=True),
+    sa.Column('amount', sa.Float(), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.Column('received_at', sa.DateTime(), nullable=True),
+    sa.Column('applied_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('idempotency_key')
+    )
+    with op.batch_alter_table('payment_callback', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_payment_callback_checkout_request_id'), ['checkout_request_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payment_callback', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_payment_callback_checkout_request_id'))
+
+    op.drop_table('payment_callback')
@@ -0,0 +1,59 @@
+"""archive tables
+
+Revision ID: b6d29e4f7a13
+Revises: 9c4e1f7a2b35
+Create Date: 2026-10-18 17:05:31.662049
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d29e4f7a13'
+down_revision = '9c4e1f7a2b35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('borrow_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('borrow_date', sa.Date(), nullable=False),
+    sa.Column('return_date', sa.Date(), nullable=True),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('borrow_price', sa.Float(), nullable=True),
+    sa.Column('instructions', sa.Text(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('borrow_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_borrow_archive_user_id'), ['user_id'], unique=False)
+
+    op.create_table('sale_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('phone_number', sa.String(length=15), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('checkout_request_id', sa.String(length=100), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('sale_archive', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_sale_archive_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sale_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_sale_archive_user_id'))
+
+    op.drop_table('sale_archive')
+    with op.batch_alter_table('borrow_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_borrow_archive_user_id'))
+
+    op.drop_table('borrow_archive')
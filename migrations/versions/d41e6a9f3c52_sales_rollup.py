@@ -0,0 +1,35 @@
+"""sales rollup
+
+Revision ID: d41e6a9f3c52
+Revises: 8b27e4d1c0a9
+Create Date: 2026-10-18 13:40:05.224817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41e6a9f3c52'
+down_revision = '8b27e4d1c0a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sales_rollup',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=10), nullable=False),
+    sa.Column('period', sa.String(length=10), nullable=False),
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('sale_count', sa.Integer(), nullable=False),
+    sa.Column('total_amount', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('granularity', 'book_id', 'period', 'status', name='uq_sales_rollup_key')
+    )
+    # Existing sales are loaded with `flask rebuild-sales-rollup`
+
+
+def downgrade():
+    op.drop_table('sales_rollup')
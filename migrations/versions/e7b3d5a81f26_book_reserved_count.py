@@ -0,0 +1,33 @@
+"""book reserved count
+
+Revision ID: e7b3d5a81f26
+Revises: 5a0c7e2b9d18
+Create Date: 2026-10-18 15:31:09.870342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3d5a81f26'
+down_revision = '5a0c7e2b9d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reserved', sa.Integer(), server_default='0', nullable=False))
+
+    # Borrows approved before this migration already hold a copy
+    op.execute(
+        "UPDATE book SET reserved = ("
+        "SELECT COUNT(*) FROM borrow "
+        "WHERE borrow.book_id = book.id AND borrow.status = 'awaiting_pickup')"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('book', schema=None) as batch_op:
+        batch_op.drop_column('reserved')
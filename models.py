@@ -1,6 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from app import db
+from extensions import db
 from datetime import datetime
 
 class User(UserMixin, db.Model):
@@ -20,6 +20,7 @@ class Book(db.Model):
     photo = db.Column(db.String(200))  # Path to the book cover image
     price = db.Column(db.Float, nullable=False)
     stock = db.Column(db.Integer, default=0)  # Number of books in stock
+    reserved = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Approved borrows awaiting pickup
     borrowers = db.relationship('Borrow', backref='book', lazy=True)
 
 class Borrow(db.Model):
@@ -31,6 +32,14 @@ class Borrow(db.Model):
     status = db.Column(db.String(50), default='pending')  # Status: pending, approved, rejected
     borrow_price = db.Column(db.Float)  
     instructions = db.Column(db.Text)  
+    approved_at = db.Column(db.DateTime)  # Starts the pickup window
+
+    __table_args__ = (
+        db.Index('ix_borrow_user_book_status', 'user_id', 'book_id', 'status'),  # duplicate check, user's borrows
+        db.Index('ix_borrow_book_status', 'book_id', 'status'),
+        db.Index('ix_borrow_status_borrow_date', 'status', 'borrow_date'),  # admin queue by status
+        db.Index('ix_borrow_status_approved_at', 'status', 'approved_at'),  # expiry of uncollected approvals
+    )
 
 class Sale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -39,4 +48,82 @@ class Sale(db.Model):
     phone_number = db.Column(db.String(15), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(50), default='pending')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    checkout_request_id = db.Column(db.String(100), index=True)  # Set once the STK push is accepted
+
+    __table_args__ = (
+        db.Index('ix_sale_created_at', 'created_at'),
+        db.Index('ix_sale_status_created_at', 'status', 'created_at'),
+        db.Index('ix_sale_user_created_at', 'user_id', 'created_at'),
+    )
+
+class SalesRollup(db.Model):
+    __tablename__ = 'sales_rollup'
+    id = db.Column(db.Integer, primary_key=True)
+    granularity = db.Column(db.String(10), nullable=False)  # month or day
+    period = db.Column(db.String(10), nullable=False)  # YYYY-MM or YYYY-MM-DD
+    book_id = db.Column(db.Integer, nullable=False, default=0)  # 0 aggregates every book
+    status = db.Column(db.String(50), nullable=False)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.UniqueConstraint('granularity', 'book_id', 'period', 'status', name='uq_sales_rollup_key'),
+    )
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON encoded arguments
+    status = db.Column(db.String(20), nullable=False, default='queued')  # Status: queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+class PaymentCallback(db.Model):
+    __tablename__ = 'payment_callback'
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=False)  # CheckoutRequestID unless the sender gives one
+    checkout_request_id = db.Column(db.String(100), nullable=False, index=True)
+    result_code = db.Column(db.Integer, nullable=False)
+    result_desc = db.Column(db.String(255))
+    receipt_number = db.Column(db.String(50))  # MpesaReceiptNumber, only on success
+    amount = db.Column(db.Float)
+    payload = db.Column(db.Text)  # Raw callback body, JSON encoded
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    applied_at = db.Column(db.DateTime)  # Set once the matching sale has been updated
+
+# Cold copies of finished borrows and settled sales, moved by `flask archive`.
+# Ids are kept, and there are no foreign keys so history outlives users and books.
+class BorrowArchive(db.Model):
+    __tablename__ = 'borrow_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    book_id = db.Column(db.Integer, nullable=False)
+    borrow_date = db.Column(db.Date, nullable=False)
+    return_date = db.Column(db.Date)
+    status = db.Column(db.String(50))
+    borrow_price = db.Column(db.Float)
+    instructions = db.Column(db.Text)
+    approved_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SaleArchive(db.Model):
+    __tablename__ = 'sale_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    book_id = db.Column(db.Integer, nullable=False)
+    phone_number = db.Column(db.String(15), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    status = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime)
+    checkout_request_id = db.Column(db.String(100))
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -1,48 +1,148 @@
-import requests
-from requests.auth import HTTPBasicAuth
+import os
+import time
+import threading
 import datetime
 import base64
 
 # M-Pesa credentials
-consumer_key = 'jfwlVsN2rEvuDTffw790ZqbLymXgHRP4eVnO3NrvLyMOzzae'
-consumer_secret = 'RrEhBk5VGpAL7NHFyiqr1gHnQHYgxMBv1RrQUWCBsAuGLf9wTG2l8KM1ZNwZZiSO'
-shortcode = '174379'
-passkey = 'bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919'
-callback_url = 'https://your-domain.com/mpesa/callback'
+consumer_key = os.getenv('MPESA_CONSUMER_KEY', 'jfwlVsN2rEvuDTffw790ZqbLymXgHRP4eVnO3NrvLyMOzzae')
+consumer_secret = os.getenv('MPESA_CONSUMER_SECRET', 'RrEhBk5VGpAL7NHFyiqr1gHnQHYgxMBv1RrQUWCBsAuGLf9wTG2l8KM1ZNwZZiSO')
+shortcode = os.getenv('MPESA_SHORTCODE', '174379')
+passkey = os.getenv('MPESA_PASSKEY', 'bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919')
+callback_url = os.getenv('MPESA_CALLBACK_URL', 'https://your-domain.com/mpesa/callback')
+
+# Point this at a local stand-in server (see fake_mpesa.py) for development
+base_url = os.getenv('MPESA_BASE_URL', 'https://sandbox.safaricom.co.ke')
+connect_timeout = float(os.getenv('MPESA_CONNECT_TIMEOUT', 3.05))
+read_timeout = float(os.getenv('MPESA_READ_TIMEOUT', 10))
+pool_size = int(os.getenv('MPESA_POOL_SIZE', 10))
+
+
+class MpesaClient:
+    """Daraja API client with a pooled session and a cached OAuth token."""
+
+    # Refresh the token this many seconds before Safaricom expires it
+    TOKEN_EXPIRY_MARGIN = 60
+
+    def __init__(self, consumer_key, consumer_secret, shortcode, passkey, callback_url,
+                 base_url=base_url, connect_timeout=connect_timeout,
+                 read_timeout=read_timeout, pool_size=pool_size):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.shortcode = shortcode
+        self.passkey = passkey
+        self.callback_url = callback_url
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+
+        # requests is imported on first use, so processes that never call
+        # Daraja (CLI commands, workers before the first checkout) skip it
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # Keep-alive connections are reused across checkouts instead of paying
+        # for a new TLS handshake every time
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+
+    def _token_valid(self):
+        return self._token is not None and time.monotonic() < self._token_expires_at
+
+    def get_access_token(self):
+        if self._token_valid():
+            return self._token
+
+        # Single-flight refresh: concurrent callers wait for the first one
+        with self._token_lock:
+            if self._token_valid():
+                return self._token
+
+            from requests.auth import HTTPBasicAuth
+
+            response = self.session.get(
+                self.base_url + '/oauth/v1/generate',
+                params={'grant_type': 'client_credentials'},
+                auth=HTTPBasicAuth(self.consumer_key, self.consumer_secret),
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            json_response = response.json()
+
+            expires_in = int(json_response.get('expires_in', 3599))
+            self._token = json_response['access_token']
+            self._token_expires_at = time.monotonic() + max(expires_in - self.TOKEN_EXPIRY_MARGIN, 0)
+            return self._token
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+            self._token_expires_at = 0.0
+
+    def generate_password(self):
+        timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        data_to_encode = self.shortcode + self.passkey + timestamp
+        encoded_string = base64.b64encode(data_to_encode.encode())
+        return encoded_string.decode('utf-8'), timestamp
+
+    def stk_push(self, phone_number, amount):
+        password, timestamp = self.generate_password()
+        payload = {
+            "BusinessShortCode": self.shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": amount,
+            "PartyA": phone_number,  # This is the phone number of the customer making the payment
+            "PartyB": self.shortcode,
+            "PhoneNumber": phone_number,
+            "CallBackURL": self.callback_url,
+            "AccountReference": "SaleTransaction",
+            "TransactionDesc": "Payment for book"
+        }
+
+        response = self._post_stk(payload)
+        # The token may have been revoked early; refresh once and retry
+        if response.status_code == 401:
+            self.invalidate_token()
+            response = self._post_stk(payload)
+        return response.json()
+
+    def _post_stk(self, payload):
+        headers = {
+            "Authorization": "Bearer " + self.get_access_token()
+        }
+        return self.session.post(
+            self.base_url + '/mpesa/stkpush/v1/processrequest',
+            json=payload,
+            headers=headers,
+            timeout=self.timeout
+        )
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MpesaClient(consumer_key, consumer_secret, shortcode, passkey, callback_url)
+    return _client
+
 
 def generate_oauth_token():
-    url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    response = requests.get(url, auth=HTTPBasicAuth(consumer_key, consumer_secret))
-    json_response = response.json()
-    return json_response['access_token']
+    return get_client().get_access_token()
 
 def generate_password():
-    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
-    data_to_encode = shortcode + passkey + timestamp
-    encoded_string = base64.b64encode(data_to_encode.encode())
-    return encoded_string.decode('utf-8'), timestamp
+    return get_client().generate_password()
 
 def stk_push_request(phone_number, amount):
-    access_token = generate_oauth_token()
-    password, timestamp = generate_password()
-    
-    url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-    headers = {
-        "Authorization": "Bearer " + access_token
-    }
-    payload = {
-        "BusinessShortCode": shortcode,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",
-        "Amount": amount,
-        "PartyA": phone_number,  # This is the phone number of the customer making the payment
-        "PartyB": shortcode,
-        "PhoneNumber": phone_number,
-        "CallBackURL": callback_url,
-        "AccountReference": "SaleTransaction",
-        "TransactionDesc": "Payment for book"
-    }
-
-    response = requests.post(url, json=payload, headers=headers)
-    return response.json()
+    return get_client().stk_push(phone_number, amount)
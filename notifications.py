@@ -0,0 +1,83 @@
+"""In-process notification hub for long-polling handlers.
+
+A handler subscribes to a key, then reads the current state, then waits on
+the subscription. A publish on that key wakes every waiting subscriber, so a
+change that lands between the read and the wait is not missed. The hub only
+reaches threads in the same process; callers that may run in several
+processes should wake up now and then to re-read the state themselves.
+"""
+import threading
+from collections import defaultdict
+
+
+class TooManyWaiters(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, hub, key):
+        self.hub = hub
+        self.key = key
+        self._event = threading.Event()
+
+    def wait(self, timeout):
+        """Return True if a publish arrived, False on timeout."""
+        woken = self._event.wait(timeout)
+        self._event.clear()
+        return woken
+
+    def close(self):
+        self.hub._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NotificationHub:
+    def __init__(self, max_waiters):
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        self._count = 0
+        self.stats = {'subscribed': 0, 'rejected': 0, 'published': 0, 'woken': 0}
+
+    def subscribe(self, key):
+        # Each waiter holds a server thread, so past the limit callers are
+        # told to answer straight away instead
+        with self._lock:
+            if self._count >= self.max_waiters:
+                self.stats['rejected'] += 1
+                raise TooManyWaiters()
+            subscription = Subscription(self, key)
+            self._subscriptions[key].add(subscription)
+            self._count += 1
+            self.stats['subscribed'] += 1
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.key)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.key]
+            self._count -= 1
+
+    def publish(self, key):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(key, ()))
+            self.stats['published'] += 1
+            self.stats['woken'] += len(subscriptions)
+        for subscription in subscriptions:
+            subscription._event.set()
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['waiting'] = self._count
+            stats['max_waiters'] = self.max_waiters
+        return stats
@@ -0,0 +1,369 @@
+"""M-Pesa STK callback ingestion.
+
+Callbacks are parsed and acknowledged straight away, then handed to a
+background flusher that applies them in small batches: one query finds the
+sales for the whole batch by CheckoutRequestID and one commit stores the
+callbacks and the new sale statuses. Retried deliveries are dropped by
+their idempotency key, both in memory and by the unique column on
+payment_callback.
+
+If a batch fails to commit, its callbacks are retried one by one, so a
+single bad row cannot hold up the ones behind it. A row that keeps failing
+is dropped after MPESA_CALLBACK_MAX_ATTEMPTS tries and logged with its
+payload; errors that look like a database outage are retried without
+counting.
+
+A callback can arrive before the STK job has stored the sale's
+CheckoutRequestID. It is kept unmatched, and both the job (after its
+commit) and the flusher's periodic reconcile pass apply it once the sale
+can be found.
+
+Callbacks still buffered when the process dies are lost, in which case the
+sale stays pending; Daraja's STK query API can be used to reconcile it.
+
+Committed sale status changes are published on a notification hub, which
+wakes ``payment_status`` requests long-polling for that sale.
+"""
+import atexit
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+from extensions import db
+from models import Sale, PaymentCallback
+from notifications import NotificationHub, TooManyWaiters
+import queries
+
+
+CHECKOUT_REQUEST_ID_LENGTH = PaymentCallback.__table__.c.checkout_request_id.type.length
+
+
+class InvalidCallback(ValueError):
+    pass
+
+
+def parse_amount(value):
+    # The raw value stays in the payload; the column only takes numbers
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_stk_callback(data, idempotency_key=None):
+    """Turn a Daraja ``Body.stkCallback`` body into a flat dict."""
+    try:
+        callback = data['Body']['stkCallback']
+        checkout_request_id = callback['CheckoutRequestID']
+        result_code = int(callback['ResultCode'])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidCallback('Not an STK callback')
+    if not checkout_request_id or not isinstance(checkout_request_id, str):
+        raise InvalidCallback('Missing CheckoutRequestID')
+    if len(checkout_request_id) > CHECKOUT_REQUEST_ID_LENGTH:
+        raise InvalidCallback('CheckoutRequestID is too long')
+
+    # Only successful payments carry metadata
+    items = (callback.get('CallbackMetadata') or {}).get('Item') or []
+    metadata = {item.get('Name'): item.get('Value') for item in items if isinstance(item, dict)}
+
+    return {
+        'idempotency_key': idempotency_key or checkout_request_id,
+        'checkout_request_id': checkout_request_id,
+        'result_code': result_code,
+        'result_desc': (callback.get('ResultDesc') or '')[:255],
+        'receipt_number': metadata.get('MpesaReceiptNumber'),
+        'amount': parse_amount(metadata.get('Amount')),
+        'payload': json.dumps(data),
+    }
+
+
+def sale_status_for(result_code):
+    return 'completed' if result_code == 0 else 'failed'
+
+
+def apply_callback(sale, callback):
+    # Only a pending sale moves, so replaying a callback never flips a
+    # settled sale. Status changes go through the ORM so the rollup follows.
+    if sale.status == 'pending':
+        sale.status = sale_status_for(callback.result_code)
+    callback.applied_at = datetime.utcnow()
+
+
+def reconcile_unmatched(limit=100):
+    """Apply stored callbacks whose sale got its CheckoutRequestID later.
+
+    Returns how many were applied. The caller commits.
+    """
+    pairs = queries.unmatched_callbacks(limit).all()
+    for sale, callback in pairs:
+        apply_callback(sale, callback)
+    return len(pairs)
+
+
+def is_transient(error):
+    # A lost connection or a locked database says nothing about the row
+    return (isinstance(error, (OperationalError, InterfaceError))
+            or (isinstance(error, DBAPIError) and error.connection_invalidated))
+
+
+class CallbackIngester:
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = app.config['MPESA_CALLBACK_BATCH_SIZE']
+        self.flush_interval = app.config['MPESA_CALLBACK_FLUSH_INTERVAL']
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pending = OrderedDict()
+        # Keys applied recently, so retries are dropped without a query
+        self._seen = OrderedDict()
+        self._seen_max = app.config['MPESA_CALLBACK_SEEN_KEYS']
+        # Failed tries per idempotency key, for rows retried on their own
+        self._attempts = {}
+        self.max_attempts = app.config['MPESA_CALLBACK_MAX_ATTEMPTS']
+        self.reconcile_interval = app.config['MPESA_CALLBACK_RECONCILE_INTERVAL']
+        self._thread = None
+        self.stats = {'received': 0, 'duplicates': 0, 'applied': 0, 'unmatched': 0,
+                      'reconciled': 0, 'batches': 0, 'errors': 0, 'dead_lettered': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='mpesa-callbacks', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, parsed):
+        """Buffer a parsed callback. Returns False for a duplicate."""
+        key = parsed['idempotency_key']
+        with self._lock:
+            self.stats['received'] += 1
+            if key in self._pending or key in self._seen:
+                self.stats['duplicates'] += 1
+                return False
+            self._pending[key] = parsed
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+        return True
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['buffered'] = len(self._pending)
+        return stats
+
+    def _run(self):
+        next_reconcile = time.monotonic() + self.reconcile_interval
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._drain()
+            if time.monotonic() >= next_reconcile:
+                self.reconcile()
+                next_reconcile = time.monotonic() + self.reconcile_interval
+        self._drain()
+
+    def reconcile(self):
+        try:
+            with self.app.app_context():
+                reconciled = reconcile_unmatched()
+                db.session.commit()
+        except Exception:
+            self.app.logger.exception('M-Pesa callback reconcile failed')
+            return 0
+        with self._lock:
+            self.stats['reconciled'] += reconciled
+        return reconciled
+
+    def _take(self):
+        with self._lock:
+            keys = list(self._pending)[:self.batch_size]
+            return [self._pending.pop(key) for key in keys]
+
+    def _drain(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            try:
+                with self.app.app_context():
+                    self.flush(batch)
+            except Exception as e:
+                with self._lock:
+                    self.stats['errors'] += 1
+                if is_transient(e):
+                    self.app.logger.warning('M-Pesa callback flush failed, retrying next tick: %s', e)
+                    self._requeue_front(batch)
+                    return
+                self.app.logger.warning('M-Pesa callback batch failed, retrying row by row: %s', e)
+                # Rows put back behind newer callbacks wait for the next tick
+                self._flush_rows(batch)
+                return
+
+    def _requeue_front(self, batch):
+        with self._lock:
+            for parsed in reversed(batch):
+                self._pending[parsed['idempotency_key']] = parsed
+                self._pending.move_to_end(parsed['idempotency_key'], last=False)
+
+    def _flush_rows(self, batch):
+        for index, parsed in enumerate(batch):
+            try:
+                with self.app.app_context():
+                    self.flush([parsed])
+            except Exception as e:
+                if is_transient(e):
+                    self._requeue_front(batch[index:])
+                    return
+                self._row_failed(parsed, e)
+
+    def _row_failed(self, parsed, error):
+        key = parsed['idempotency_key']
+        with self._lock:
+            attempts = self._attempts.pop(key, 0) + 1
+            dead = attempts >= self.max_attempts
+            if dead:
+                self.stats['dead_lettered'] += 1
+            else:
+                self._attempts[key] = attempts
+                self._pending[key] = parsed
+        if dead:
+            self.app.logger.error('Dropping M-Pesa callback %s after %d failed attempts: %s; payload: %s',
+                                  key, attempts, error, parsed['payload'])
+
+    def flush(self, batch):
+        keys = [parsed['idempotency_key'] for parsed in batch]
+        stored = {key for (key,) in queries.stored_callback_keys(keys)}
+        fresh = [parsed for parsed in batch if parsed['idempotency_key'] not in stored]
+
+        sales = {}
+        checkout_ids = {parsed['checkout_request_id'] for parsed in fresh}
+        if checkout_ids:
+            sales = {
+                sale.checkout_request_id: sale
+                for sale in queries.sales_by_checkout_ids(checkout_ids)
+            }
+
+        applied = unmatched = 0
+        for parsed in fresh:
+            callback = PaymentCallback(**parsed)
+            db.session.add(callback)
+            sale = sales.get(parsed['checkout_request_id'])
+            if sale is None:
+                # The STK job may not have stored the id yet; it applies
+                # the callback itself once it does
+                unmatched += 1
+                continue
+            apply_callback(sale, callback)
+            applied += 1
+        db.session.commit()
+
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['applied'] += applied
+            self.stats['unmatched'] += unmatched
+            self.stats['duplicates'] += len(batch) - len(fresh)
+            for key in keys:
+                self._seen[key] = True
+                self._attempts.pop(key, None)
+            while len(self._seen) > self._seen_max:
+                self._seen.popitem(last=False)
+
+
+ingester = None
+_ingester_lock = threading.Lock()
+
+
+def get_ingester():
+    global ingester
+    with _ingester_lock:
+        if ingester is None:
+            ingester = CallbackIngester(current_app._get_current_object())
+            ingester.start()
+    return ingester
+
+
+sale_events = None
+_sale_events_lock = threading.Lock()
+
+
+def get_sale_events():
+    global sale_events
+    with _sale_events_lock:
+        if sale_events is None:
+            sale_events = NotificationHub(current_app.config['PAYMENT_STATUS_MAX_WAITERS'])
+    return sale_events
+
+
+# Sales are published only once their change is committed, so a woken
+# request always reads the new status. This covers the callback flush, the
+# STK job applying an early callback and a failed STK push alike.
+@event.listens_for(Sale, 'after_update')
+def sale_status_changed(mapper, connection, sale):
+    state = inspect(sale)
+    if state.attrs.status.history.has_changes() and state.session is not None:
+        state.session.info.setdefault('sales_changed', set()).add(sale.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def publish_sale_changes(session):
+    changed = session.info.pop('sales_changed', None)
+    if changed and sale_events is not None:
+        for sale_id in changed:
+            sale_events.publish(sale_id)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def forget_sale_changes(session, previous_transaction):
+    session.info.pop('sales_changed', None)
+
+
+def read_sale_status(sale_id):
+    row = db.session.query(Sale.status).filter(Sale.id == sale_id).first()
+    return None if row is None else row.status
+
+
+def wait_for_sale(sale_id, timeout):
+    """Return the sale's status, waiting up to ``timeout`` seconds while it is pending.
+
+    Returns None when there is no such sale. When too many requests are
+    already waiting the current status is returned straight away.
+    """
+    subscription = None
+    if timeout > 0:
+        try:
+            # Subscribe before reading, so a change in between still wakes us
+            subscription = get_sale_events().subscribe(sale_id)
+        except TooManyWaiters:
+            pass
+    try:
+        status = read_sale_status(sale_id)
+        if subscription is None:
+            return status
+        # The callback may be handled by another worker process, whose
+        # publish never reaches this hub, so re-read every so often too
+        recheck = current_app.config['PAYMENT_STATUS_RECHECK']
+        deadline = time.monotonic() + timeout
+        while status == 'pending':
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Hand the connection back to the pool while waiting
+            db.session.close()
+            subscription.wait(min(remaining, recheck))
+            status = read_sale_status(sale_id)
+        return status
+    finally:
+        if subscription is not None:
+            subscription.close()
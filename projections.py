@@ -0,0 +1,137 @@
+"""Column projections for the list endpoints.
+
+Each projection maps an output field to the column it is read from, and
+optionally a function that converts the value. List queries select only
+the requested columns and get plain row tuples back, so no ORM objects are
+built and unrequested columns (like Book.description) are never loaded.
+Clients pick fields with ``?fields=id,title,price``.
+"""
+from models import Book, Borrow, User, Sale, BorrowArchive, SaleArchive
+from uploads import photo_urls
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+class Projection:
+    def __init__(self, fields, default=None):
+        self.fields = {
+            name: spec if isinstance(spec, tuple) else (spec, None)
+            for name, spec in fields.items()
+        }
+        self.default = default or list(self.fields)
+
+    def for_model(self, model):
+        # The same fields read from another table with the same column names
+        return Projection(
+            {name: (getattr(model, column.key), convert) for name, (column, convert) in self.fields.items()},
+            self.default
+        )
+
+    def parse(self, value):
+        # No ?fields= gives the endpoint's usual response shape
+        if not value:
+            return list(self.default)
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown or not names:
+            raise InvalidFields(f"Unknown fields: {', '.join(unknown)}. Choose from: {', '.join(self.fields)}")
+        return list(dict.fromkeys(names))
+
+    def columns(self, names):
+        return [self.fields[name][0].label(name) for name in names]
+
+    def query(self, query, names, *extra):
+        # Extra columns come after the fields and are left out of the dicts
+        return query.with_entities(*self.columns(names), *extra)
+
+    def row_converter(self, names):
+        converters = [(i, self.fields[name][1]) for i, name in enumerate(names) if self.fields[name][1]]
+        if not converters:
+            return lambda row: dict(zip(names, row))
+
+        def convert(row):
+            values = list(row)
+            for i, f in converters:
+                values[i] = f(values[i])
+            return dict(zip(names, values))
+        return convert
+
+    def rows(self, query, names):
+        convert = self.row_converter(names)
+        return [convert(row) for row in self.query(query, names)]
+
+
+def format_created_at(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value is not None else None
+
+
+BOOK_FIELDS = Projection({
+    'id': Book.id,
+    'title': Book.title,
+    'author': Book.author,
+    'description': Book.description,
+    'release_date': Book.release_date,
+    'category': Book.category,
+    'price': Book.price,
+    'stock': Book.stock,
+    'available': Book.stock - Book.reserved,
+    'photo': Book.photo,
+    'photo_urls': (Book.photo, photo_urls),
+})
+
+USER_FIELDS = Projection({
+    'id': User.id,
+    'username': User.username,
+    'role': User.role,
+})
+
+BORROW_FIELDS = Projection({
+    'id': Borrow.id,
+    'user_id': Borrow.user_id,
+    'book_id': Borrow.book_id,
+    'borrow_date': Borrow.borrow_date,
+    'return_date': Borrow.return_date,
+    'status': Borrow.status,
+    'borrow_price': Borrow.borrow_price,
+    'instructions': Borrow.instructions,
+})
+
+# A user's own borrows, without the redundant user_id
+MY_BORROW_FIELDS = Projection(
+    BORROW_FIELDS.fields,
+    default=['id', 'book_id', 'borrow_date', 'return_date', 'status', 'borrow_price', 'instructions']
+)
+
+SALE_FIELDS = Projection({
+    'id': Sale.id,
+    'user_id': Sale.user_id,
+    'book_id': Sale.book_id,
+    'phone_number': Sale.phone_number,
+    'amount': Sale.amount,
+    'status': Sale.status,
+    'created_at': (Sale.created_at, format_created_at),
+})
+
+BORROW_ARCHIVE_FIELDS = BORROW_FIELDS.for_model(BorrowArchive)
+MY_BORROW_ARCHIVE_FIELDS = MY_BORROW_FIELDS.for_model(BorrowArchive)
+SALE_ARCHIVE_FIELDS = SALE_FIELDS.for_model(SaleArchive)
+
+# Book columns a borrow listing can carry; the query joins book on book_id
+BORROW_BOOK_FIELDS = {
+    'title': Book.title,
+    'author': Book.author,
+    'photo': Book.photo,
+    'photo_urls': (Book.photo, photo_urls),
+    'price': Book.price,
+}
+
+
+def with_book_fields(projection):
+    return Projection(dict(projection.fields, **BORROW_BOOK_FIELDS),
+                      default=projection.default + list(BORROW_BOOK_FIELDS))
+
+
+MY_BORROW_DASHBOARD_FIELDS = with_book_fields(MY_BORROW_FIELDS)
+MY_BORROW_ARCHIVE_DASHBOARD_FIELDS = with_book_fields(MY_BORROW_ARCHIVE_FIELDS)
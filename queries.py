@@ -0,0 +1,109 @@
+"""Queries behind the hot handlers and batch jobs.
+
+The handlers build their queries here, and ``queryplans`` EXPLAINs the very
+same builders, so the plan check cannot drift from what actually runs.
+Builders return unexecuted queries; callers add projections, limits and
+locks where the handler needs them.
+"""
+from extensions import db
+from models import Book, Borrow, Sale, SalesRollup, PaymentCallback
+
+
+def pending_borrow(user_id, book_id):
+    # borrow_book's duplicate check
+    return Borrow.query.filter_by(user_id=user_id, book_id=book_id, status='pending')
+
+
+def user_borrows(model, user_id):
+    return model.query.filter_by(user_id=user_id)
+
+
+def borrow_dashboard(model, user_id, statuses=None, before=None):
+    # Outer join: an archived borrow may outlive its book
+    query = model.query.outerjoin(Book, Book.id == model.book_id).filter(model.user_id == user_id)
+    if statuses:
+        query = query.filter(model.status.in_(statuses))
+    # Keyset pagination, newest first
+    if before is not None:
+        query = query.filter(model.id < before)
+    return query.order_by(model.id.desc())
+
+
+def borrow_requests(model, **filters):
+    # The admin queue; ``filters`` holds the query arguments the admin gave
+    return model.query.filter_by(**filters)
+
+
+def sales(model, **filters):
+    return model.query.filter_by(**filters)
+
+
+def sales_analytics(granularity, book_id, date_from=None, date_to=None, status=None):
+    query = (
+        db.session.query(
+            SalesRollup.period,
+            db.func.sum(SalesRollup.total_amount),
+            db.func.sum(SalesRollup.sale_count)
+        )
+        .filter(SalesRollup.granularity == granularity, SalesRollup.book_id == book_id)
+    )
+    # Periods are zero-padded strings, so they compare in date order; a
+    # YYYY-MM bound also works against daily periods
+    if date_from:
+        query = query.filter(SalesRollup.period >= date_from)
+    if date_to:
+        query = query.filter(SalesRollup.period <= date_to + '~')
+    if status is not None:
+        query = query.filter(SalesRollup.status == status)
+    return query.group_by(SalesRollup.period).order_by(SalesRollup.period)
+
+
+def stale_borrows(status, date_column, cutoff, batch_size):
+    # One sweeper batch; borrows an admin is working on right now are
+    # skipped instead of waited for
+    return (
+        db.session.query(Borrow.id, Borrow.book_id)
+        .filter(Borrow.status == status, date_column < cutoff)
+        .order_by(date_column, Borrow.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def archivable(model, date_column, statuses, cutoff, batch_size):
+    # One archive batch, oldest first
+    return (
+        db.session.query(model.id)
+        .filter(model.status.in_(statuses), date_column < cutoff)
+        .order_by(date_column, model.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def sales_by_checkout_ids(checkout_ids):
+    return Sale.query.filter(Sale.checkout_request_id.in_(checkout_ids))
+
+
+def stored_callback_keys(keys):
+    return db.session.query(PaymentCallback.idempotency_key).filter(PaymentCallback.idempotency_key.in_(keys))
+
+
+def unmatched_callbacks(limit):
+    # Stored callbacks whose sale has since got its CheckoutRequestID. Driven
+    # from the few pending sales, and locked so two reconcilers never apply
+    # the same callback twice.
+    return (
+        db.session.query(Sale, PaymentCallback)
+        .join(PaymentCallback, PaymentCallback.checkout_request_id == Sale.checkout_request_id)
+        .filter(Sale.status == 'pending', Sale.checkout_request_id.isnot(None),
+                PaymentCallback.applied_at.is_(None))
+        .order_by(PaymentCallback.received_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+
+
+def unapplied_callback(checkout_request_id):
+    # A callback that raced ahead of the STK push job
+    return PaymentCallback.query.filter_by(checkout_request_id=checkout_request_id, applied_at=None)
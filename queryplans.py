@@ -0,0 +1,117 @@
+"""Query-plan regression checks for the hot filters.
+
+Every query below comes from the same ``queries`` builder its handler uses.
+``flask check-query-plans`` (and tests/test_query_plans.py) runs EXPLAIN for
+each against the configured database and fails if any of them falls back to
+a full table scan. Run it after ``flask db upgrade`` in CI.
+"""
+import sys
+from datetime import date, datetime
+import click
+from flask.cli import with_appcontext
+from extensions import db
+from models import Borrow, Sale, BorrowArchive
+from projections import MY_BORROW_DASHBOARD_FIELDS
+from rollup import ALL_BOOKS
+from archive import FINISHED_BORROW_STATUSES, SETTLED_SALE_STATUSES
+import queries
+
+# Listings that return the whole table when no filter is given. They are
+# still planned and reported, but a scan is what they are meant to do.
+FULL_LISTINGS = {'manage_borrow_requests.all', 'get_sales.all'}
+
+
+def hot_queries():
+    # Representative parameters; only the plan shape matters
+    dashboard = MY_BORROW_DASHBOARD_FIELDS
+    return {
+        'borrow_book.duplicate_check':
+            queries.pending_borrow(1, 1),
+        'get_borrowed_books':
+            queries.user_borrows(Borrow, 1),
+        'get_borrowed_books.archived':
+            queries.user_borrows(BorrowArchive, 1),
+        'borrowed_books_dashboard':
+            dashboard.query(queries.borrow_dashboard(Borrow, 1, ['pending', 'awaiting_pickup'], 500),
+                            dashboard.default, Borrow.id).limit(101),
+        'manage_borrow_requests.by_status':
+            queries.borrow_requests(Borrow, status='pending'),
+        'manage_borrow_requests.all':
+            queries.borrow_requests(Borrow),
+        'expire_borrows.pending_batch':
+            queries.stale_borrows('pending', Borrow.borrow_date, date(2024, 1, 1), 500),
+        'expire_borrows.awaiting_pickup_batch':
+            queries.stale_borrows('awaiting_pickup', Borrow.approved_at, datetime(2024, 1, 1), 500),
+        'archive.borrows_batch':
+            queries.archivable(Borrow, Borrow.borrow_date, FINISHED_BORROW_STATUSES, date(2024, 1, 1), 1000),
+        'archive.sales_batch':
+            queries.archivable(Sale, Sale.created_at, SETTLED_SALE_STATUSES, datetime(2024, 1, 1), 1000),
+        'get_sales.by_status':
+            queries.sales(Sale, status='pending'),
+        'get_sales.by_user':
+            queries.sales(Sale, user_id=1),
+        'get_sales.all':
+            queries.sales(Sale),
+        'mpesa_callbacks.stored_keys':
+            queries.stored_callback_keys(['ws_CO_0', 'ws_CO_1']),
+        'mpesa_callbacks.sales_by_checkout_id':
+            queries.sales_by_checkout_ids(['ws_CO_0', 'ws_CO_1']),
+        'mpesa_callbacks.unmatched':
+            queries.unmatched_callbacks(100),
+        'stk_push.unapplied_callback':
+            queries.unapplied_callback('ws_CO_0'),
+        'sales_analytics':
+            queries.sales_analytics('month', ALL_BOOKS, date_from='2024-01', date_to='2024-12'),
+    }
+
+
+def explain(connection, query):
+    compiled = query.statement.compile(dialect=connection.dialect,
+                                       compile_kwargs={'render_postcompile': True})
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+        plan = [row[3] for row in rows]
+        scans = [step for step in plan if step.startswith('SCAN ')]
+    else:
+        rows = connection.exec_driver_sql('EXPLAIN ' + str(compiled), params).fetchall()
+        plan = [row[0] for row in rows]
+        scans = [step for step in plan if 'Seq Scan' in step]
+    return plan, scans
+
+
+def check_query_plans():
+    results = []
+    with db.engine.connect() as connection:
+        if connection.dialect.name == 'postgresql':
+            # Small test tables make a sequential scan look cheapest; this
+            # only leaves a Seq Scan in the plan when no index can be used
+            connection.exec_driver_sql('SET enable_seqscan = off')
+        for name, query in hot_queries().items():
+            plan, scans = explain(connection, query)
+            results.append({'query': name, 'ok': not scans or name in FULL_LISTINGS,
+                            'scan': bool(scans), 'plan': plan})
+        connection.rollback()
+    return results
+
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans_command():
+    """Fail if any hot query regresses to a table scan."""
+    results = check_query_plans()
+    for result in results:
+        label = 'SCAN  ' if not result['ok'] else 'full  ' if result['scan'] else 'ok    '
+        print(label + result['query'])
+        if not result['ok']:
+            for step in result['plan']:
+                print('        ' + step)
+    failed = [result for result in results if not result['ok']]
+    if failed:
+        print(f"{len(failed)} of {len(results)} hot queries use a table scan")
+        sys.exit(1)
+    print(f"All {len(results)} hot queries use an index or are full listings")
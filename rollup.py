@@ -0,0 +1,131 @@
+import time
+from collections import defaultdict
+from itertools import chain
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import click
+from flask.cli import with_appcontext
+from extensions import db
+from models import Sale, SaleArchive, SalesRollup
+
+ALL_BOOKS = 0
+
+GRANULARITIES = {
+    'month': '%Y-%m',
+    'day': '%Y-%m-%d',
+}
+
+
+def rollup_keys(sale_created_at, book_id, status):
+    for granularity, fmt in GRANULARITIES.items():
+        period = sale_created_at.strftime(fmt)
+        for key_book_id in (ALL_BOOKS, book_id):
+            yield granularity, period, key_book_id, status or 'pending'
+
+
+def apply_delta(connection, created_at, book_id, status, count, amount):
+    """Add ``count`` sales worth ``amount`` to every rollup row of a sale."""
+    table = SalesRollup.__table__
+    dialect = connection.dialect.name
+
+    for granularity, period, key_book_id, key_status in rollup_keys(created_at, book_id, status):
+        values = {
+            'granularity': granularity,
+            'period': period,
+            'book_id': key_book_id,
+            'status': key_status,
+            'sale_count': count,
+            'total_amount': amount,
+        }
+        if dialect in ('sqlite', 'postgresql'):
+            insert = sqlite_insert if dialect == 'sqlite' else pg_insert
+            statement = insert(table).values(**values)
+            statement = statement.on_conflict_do_update(
+                index_elements=['granularity', 'book_id', 'period', 'status'],
+                set_={
+                    'sale_count': table.c.sale_count + statement.excluded.sale_count,
+                    'total_amount': table.c.total_amount + statement.excluded.total_amount,
+                }
+            )
+            connection.execute(statement)
+            continue
+
+        updated = connection.execute(
+            table.update()
+            .where(table.c.granularity == granularity, table.c.book_id == key_book_id,
+                   table.c.period == period, table.c.status == key_status)
+            .values(sale_count=table.c.sale_count + count,
+                    total_amount=table.c.total_amount + amount)
+        )
+        if updated.rowcount == 0:
+            connection.execute(table.insert().values(**values))
+
+
+# The rollup is written on the same connection as the sale, so both commit
+# or roll back together. Bulk Query.update() calls bypass these events and
+# must call apply_delta themselves.
+@event.listens_for(Sale, 'after_insert')
+def sale_inserted(mapper, connection, sale):
+    apply_delta(connection, sale.created_at, sale.book_id, sale.status, 1, sale.amount)
+
+
+@event.listens_for(Sale.status, 'set', active_history=True)
+def sale_status_set(sale, value, old_value, initiator):
+    # active_history loads the old status even when it was expired (say by a
+    # commit), so sale_updated can take the sale out of its old rollup row
+    pass
+
+
+@event.listens_for(Sale, 'after_update')
+def sale_updated(mapper, connection, sale):
+    history = inspect(sale).attrs.status.history
+    if not history.has_changes() or not history.deleted:
+        return
+    old_status = history.deleted[0]
+    if old_status == sale.status:
+        return
+    apply_delta(connection, sale.created_at, sale.book_id, old_status, -1, -sale.amount)
+    apply_delta(connection, sale.created_at, sale.book_id, sale.status, 1, sale.amount)
+
+
+def rebuild_rollup(batch_size=5000):
+    """Recompute the whole rollup from the sale and sale_archive tables in one transaction."""
+    totals = defaultdict(lambda: [0, 0.0])
+    queries = [
+        db.session.query(model.created_at, model.book_id, model.status, model.amount)
+        .execution_options(yield_per=batch_size)
+        for model in (Sale, SaleArchive)
+    ]
+    sales = 0
+    for created_at, book_id, status, amount in chain(*queries):
+        sales += 1
+        for key in rollup_keys(created_at, book_id, status):
+            totals[key][0] += 1
+            totals[key][1] += amount
+
+    db.session.query(SalesRollup).delete(synchronize_session=False)
+    rows = [
+        {
+            'granularity': granularity,
+            'period': period,
+            'book_id': book_id,
+            'status': status,
+            'sale_count': count,
+            'total_amount': amount,
+        }
+        for (granularity, period, book_id, status), (count, amount) in totals.items()
+    ]
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(SalesRollup.__table__.insert(), rows[start:start + batch_size])
+    db.session.commit()
+    return sales, len(rows)
+
+
+@click.command('rebuild-sales-rollup')
+@with_appcontext
+def rebuild_sales_rollup():
+    """Rebuild the sales_rollup table from the sale and sale_archive tables."""
+    started = time.perf_counter()
+    sales, rows = rebuild_rollup()
+    print(f"Rolled up {sales} sales into {rows} rows in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,88 @@
+import re
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from extensions import db
+from models import Book
+
+# Column weights used for ranking: title, author, category, description
+SQLITE_WEIGHTS = (10.0, 5.0, 2.0, 1.0)
+
+# Must match the expression of the GIN index created by the migration,
+# otherwise Postgres cannot use it
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(book.title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(book.author, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(book.category, '')), 'C') || "
+    "setweight(to_tsvector('english', coalesce(book.description, '')), 'D')"
+)
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(q):
+    return TERM_RE.findall(q or '')[:16]
+
+
+def _sqlite_match(terms):
+    # Quote every term so user input can never be parsed as FTS5 syntax, and
+    # allow prefix matches so partial words still find results
+    return ' '.join('"%s"*' % term for term in terms)
+
+
+def _search_sqlite(terms, limit):
+    sql = text(
+        "SELECT book_fts.rowid FROM book_fts "
+        "WHERE book_fts MATCH :match "
+        "ORDER BY bm25(book_fts, %s) LIMIT :limit" % ', '.join(str(w) for w in SQLITE_WEIGHTS)
+    )
+    rows = db.session.execute(sql, {'match': _sqlite_match(terms), 'limit': limit})
+    return [row[0] for row in rows]
+
+
+def _search_postgres(terms, limit):
+    sql = text(
+        "SELECT book.id FROM book "
+        "WHERE (%s) @@ to_tsquery('english', :query) "
+        "ORDER BY ts_rank(%s, to_tsquery('english', :query)) DESC LIMIT :limit" % (PG_DOCUMENT, PG_DOCUMENT)
+    )
+    query = ' & '.join('%s:*' % term for term in terms)
+    rows = db.session.execute(sql, {'query': query, 'limit': limit})
+    return [row[0] for row in rows]
+
+
+def _search_scan(terms, limit):
+    # Fallback for databases that have not been migrated yet
+    query = Book.query
+    for term in terms:
+        pattern = '%{}%'.format(term)
+        query = query.filter(db.or_(
+            Book.title.ilike(pattern),
+            Book.author.ilike(pattern),
+            Book.category.ilike(pattern),
+            Book.description.ilike(pattern)
+        ))
+    return [book.id for book in query.order_by(Book.id).limit(limit)]
+
+
+def search_books(q, limit):
+    """Return the books matching ``q``, best match first."""
+    terms = search_terms(q)
+    if not terms:
+        return []
+
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            ids = _search_sqlite(terms, limit)
+        elif dialect == 'postgresql':
+            ids = _search_postgres(terms, limit)
+        else:
+            ids = _search_scan(terms, limit)
+    except OperationalError:
+        db.session.rollback()
+        ids = _search_scan(terms, limit)
+
+    if not ids:
+        return []
+    books = {book.id: book for book in Book.query.filter(Book.id.in_(ids))}
+    return [books[book_id] for book_id in ids if book_id in books]
@@ -0,0 +1,147 @@
+import random
+import time
+import click
+from flask.cli import with_appcontext
+from datetime import date, datetime, timedelta
+from bcrypt import gensalt, hashpw
+from extensions import db
+from models import User, Book, Borrow, Sale
+from rollup import rebuild_rollup
+from cache import catalog_cache, book_cache
+
+CATEGORIES = ['Fiction', 'History', 'Science', 'Children', 'Biography', 'Poetry', 'Business', 'Travel']
+WORDS = ['river', 'silent', 'garden', 'empire', 'journey', 'light', 'shadow', 'market', 'harvest',
+         'storm', 'letter', 'island', 'mountain', 'city', 'winter', 'promise', 'secret', 'road']
+BORROW_STATUSES = ['pending', 'awaiting_pickup', 'picked up', 'returned', 'returned', 'rejected']
+SALE_STATUSES = ['pending', 'completed', 'completed', 'completed', 'failed']
+
+
+def insert_batches(table, rows, batch_size):
+    batch = []
+    inserted = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            inserted += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        inserted += len(batch)
+    return inserted
+
+
+def id_range(model):
+    low, high = db.session.query(db.func.min(model.id), db.func.max(model.id)).one()
+    return low, high
+
+
+@click.command('seed')
+@with_appcontext
+@click.option('--users', default=1000, help='Regular users to create.')
+@click.option('--admins', default=5, help='Admin users to create.')
+@click.option('--books', default=10000)
+@click.option('--borrows', default=50000)
+@click.option('--sales', default=50000)
+@click.option('--batch-size', default=10000, help='Rows per insert transaction.')
+@click.option('--prefix', default='seed', help='Username prefix; use a new one to seed again.')
+@click.option('--password', default='password', help='Password given to every seeded user.')
+@click.option('--random-seed', default=42, help='Makes the generated data reproducible.')
+def seed(users, admins, books, borrows, sales, batch_size, prefix, password, random_seed):
+    """Generate synthetic users, books, borrows and sales.
+
+    Users are named <prefix>-user-N and <prefix>-admin-N. Rows are written with
+    batched executemany inserts, so millions of rows only need as much
+    memory as one batch.
+    """
+    rng = random.Random(random_seed)
+    today = date.today()
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    # One low-cost hash shared by every seeded user keeps seeding fast; the
+    # first login rehashes it to the configured cost
+    hashed = hashpw(password.encode('utf-8'), gensalt(rounds=4))
+
+    counts = {}
+    counts['users'] = insert_batches(User.__table__, (
+        {'username': f'{prefix}-user-{i}', 'password': hashed, 'role': 'user'}
+        for i in range(users)
+    ), batch_size)
+    counts['admins'] = insert_batches(User.__table__, (
+        {'username': f'{prefix}-admin-{i}', 'password': hashed, 'role': 'admin'}
+        for i in range(admins)
+    ), batch_size)
+
+    def book_rows():
+        for i in range(books):
+            title = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+            yield {
+                'title': f'{title} {i}',
+                'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))),
+                'release_date': today - timedelta(days=rng.randint(0, 365 * 40)),
+                'author': f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()}',
+                'category': rng.choice(CATEGORIES),
+                'photo': None,
+                'price': float(rng.randint(3, 60) * 50),
+                'stock': rng.randint(0, 20),
+                'reserved': 0,
+            }
+    counts['books'] = insert_batches(Book.__table__, book_rows(), batch_size)
+
+    user_low, user_high = id_range(User)
+    book_low, book_high = id_range(Book)
+
+    def borrow_rows():
+        for _ in range(borrows):
+            borrow_date = today - timedelta(days=rng.randint(0, 365 * 2))
+            status = rng.choice(BORROW_STATUSES)
+            price = float(rng.randint(3, 60) * 10)
+            yield {
+                'user_id': rng.randint(user_low, user_high),
+                'book_id': rng.randint(book_low, book_high),
+                'borrow_date': borrow_date,
+                'return_date': borrow_date + timedelta(days=14) if status != 'pending' else None,
+                'status': status,
+                'borrow_price': price,
+                'instructions': None,
+            }
+    counts['borrows'] = insert_batches(Borrow.__table__, borrow_rows(), batch_size)
+
+    # Approved borrows hold a reserved copy
+    awaiting = (
+        db.select(db.func.count(Borrow.id))
+        .where(Borrow.book_id == Book.id, Borrow.status == 'awaiting_pickup')
+        .scalar_subquery()
+    )
+    db.session.execute(
+        db.update(Book).values(reserved=db.case((awaiting > Book.stock, Book.stock), else_=awaiting))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    def sale_rows():
+        for _ in range(sales):
+            yield {
+                'user_id': rng.randint(user_low, user_high),
+                'book_id': rng.randint(book_low, book_high),
+                'phone_number': '2547%08d' % rng.randint(0, 99999999),
+                'amount': float(rng.randint(3, 60) * 50),
+                'status': rng.choice(SALE_STATUSES),
+                'created_at': now - timedelta(seconds=rng.randint(0, 86400 * 365 * 2)),
+                'checkout_request_id': None,
+            }
+    counts['sales'] = insert_batches(Sale.__table__, sale_rows(), batch_size)
+
+    # Bulk inserts bypass the Sale mapper events that maintain the rollup
+    if sales:
+        rebuild_rollup()
+    catalog_cache.bump()
+    book_cache.clear()
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(', '.join(f'{count} {name}' for name, count in counts.items()) +
+          f' in {elapsed:.1f}s ({total / elapsed:.0f} rows/sec)')
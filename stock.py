@@ -0,0 +1,153 @@
+"""Atomic stock changes for the borrow lifecycle.
+
+Every change is a single conditional UPDATE, so concurrent admins can never
+lose an update and row locks are held only for one statement plus the
+commit. ``Book.reserved`` counts approved borrows waiting for pickup; the
+copies available to new requests are ``stock - reserved``.
+
+The functions return True when the row changed. The caller commits. Books
+whose stock moved are marked on the session so their cached copies are
+dropped once that commit lands.
+"""
+from extensions import db
+from models import Book, Borrow
+from books import mark_books_changed
+
+
+def _update(statement):
+    return db.session.execute(statement.execution_options(synchronize_session=False)).rowcount == 1
+
+
+def _update_book(book_id, statement):
+    changed = _update(statement)
+    if changed:
+        mark_books_changed([book_id])
+    return changed
+
+
+def transition(borrow_id, from_status, to_status, **values):
+    # Moves a borrow between states only if nobody else moved it first
+    return _update(
+        db.update(Borrow)
+        .where(Borrow.id == borrow_id, Borrow.status == from_status)
+        .values(status=to_status, **values)
+    )
+
+
+def reserve(book_id):
+    return _update_book(book_id,
+        db.update(Book)
+        .where(Book.id == book_id, Book.stock - Book.reserved > 0)
+        .values(reserved=Book.reserved + 1)
+    )
+
+
+def release(book_id):
+    return _update_book(book_id,
+        db.update(Book)
+        .where(Book.id == book_id, Book.reserved > 0)
+        .values(reserved=Book.reserved - 1)
+    )
+
+
+def check_out(book_id):
+    # A reserved copy leaves the shelf
+    return _update_book(book_id,
+        db.update(Book)
+        .where(Book.id == book_id, Book.stock > 0)
+        .values(stock=Book.stock - 1,
+                reserved=db.case((Book.reserved > 0, Book.reserved - 1), else_=0))
+    )
+
+
+def check_in(book_id):
+    return _update_book(book_id,
+        db.update(Book)
+        .where(Book.id == book_id)
+        .values(stock=Book.stock + 1)
+    )
+
+
+# Batch variants: one executemany per table instead of one UPDATE per item.
+# Callers lock the affected book rows first (SELECT ... FOR UPDATE where the
+# database supports it), and the WHERE guards still hold: a row that
+# changed shows up as a short rowcount and the batch reports False.
+
+def _update_many(statement, params):
+    if not params:
+        return True
+    if db.session.get_bind().dialect.supports_sane_multi_rowcount:
+        return db.session.execute(statement, params).rowcount == len(params)
+    # Drivers that batch executemany (psycopg2) cannot say how many rows
+    # matched, so run one statement per item; the caller rolls back on False
+    for param in params:
+        if db.session.execute(statement, param).rowcount != 1:
+            return False
+    return True
+
+
+def transition_many(from_status, to_status, items):
+    # ``items`` maps borrow id -> extra column values, with the same keys for every borrow
+    if not items:
+        return True
+    table = Borrow.__table__
+    keys = sorted(next(iter(items.values())))
+    statement = (
+        table.update()
+        .where(table.c.id == db.bindparam('_id'), table.c.status == from_status)
+        .values(status=to_status, **{key: db.bindparam('_' + key) for key in keys})
+    )
+    params = [
+        dict({'_id': borrow_id}, **{'_' + key: values[key] for key in keys})
+        for borrow_id, values in items.items()
+    ]
+    return _update_many(statement, params)
+
+
+def _update_books(statement, counts):
+    params = [{'_id': book_id, '_n': count} for book_id, count in counts.items() if count]
+    mark_books_changed(param['_id'] for param in params)
+    return _update_many(statement, params)
+
+
+def reserve_many(counts):
+    table = Book.__table__
+    statement = (
+        table.update()
+        .where(table.c.id == db.bindparam('_id'), table.c.stock - table.c.reserved >= db.bindparam('_n'))
+        .values(reserved=table.c.reserved + db.bindparam('_n'))
+    )
+    return _update_books(statement, counts)
+
+
+def release_many(counts):
+    table = Book.__table__
+    count = db.bindparam('_n')
+    statement = (
+        table.update()
+        .where(table.c.id == db.bindparam('_id'))
+        .values(reserved=db.case((table.c.reserved >= count, table.c.reserved - count), else_=0))
+    )
+    return _update_books(statement, counts)
+
+
+def check_out_many(counts):
+    table = Book.__table__
+    count = db.bindparam('_n')
+    statement = (
+        table.update()
+        .where(table.c.id == db.bindparam('_id'), table.c.stock >= count)
+        .values(stock=table.c.stock - count,
+                reserved=db.case((table.c.reserved >= count, table.c.reserved - count), else_=0))
+    )
+    return _update_books(statement, counts)
+
+
+def check_in_many(counts):
+    table = Book.__table__
+    statement = (
+        table.update()
+        .where(table.c.id == db.bindparam('_id'))
+        .values(stock=table.c.stock + db.bindparam('_n'))
+    )
+    return _update_books(statement, counts)
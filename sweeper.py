@@ -0,0 +1,184 @@
+"""Expiry of borrow requests nobody acted on.
+
+Pending requests older than BORROW_PENDING_TTL_DAYS (from borrow_date) and
+approved ones not picked up within BORROW_PICKUP_TTL_DAYS (from
+approved_at) move to ``expired``; expired approvals give their reserved
+copy back. Each batch is its own short transaction found through the
+(status, borrow_date) or (status, approved_at) index, and a pass
+stops after SWEEP_MAX_BATCHES, so a large backlog is worked off over
+several passes instead of one long lock.
+
+Run a pass with ``flask expire-borrows`` (e.g. from cron), or set
+SWEEP_INTERVAL to run it on a timer inside the app process.
+"""
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from extensions import db
+from models import Borrow
+from cache import catalog_cache
+import stock
+import queries
+
+EXPIRED = 'expired'
+
+
+class SweepMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.passes = 0
+        self.expired = Counter()
+        self.released = 0
+        self.conflicts = 0
+        self.last_pass = None
+
+    def record(self, result):
+        with self._lock:
+            self.passes += 1
+            self.expired.update(result['expired'])
+            self.released += result['released']
+            self.conflicts += result['conflicts']
+            self.last_pass = result
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'passes': self.passes,
+                'expired': dict(self.expired),
+                'released': self.released,
+                'conflicts': self.conflicts,
+                'last_pass': self.last_pass
+            }
+
+
+metrics = SweepMetrics()
+
+
+def expire_batch(status, date_column, cutoff, batch_size):
+    """Expire one batch of borrows in ``status`` whose ``date_column`` is before ``cutoff``.
+
+    Returns (rows expired, copies released, conflict). On a conflict, where a
+    borrow changed under us, the batch is rolled back and left for the next
+    pass.
+    """
+    rows = queries.stale_borrows(status, date_column, cutoff, batch_size).all()
+    if not rows:
+        return 0, 0, False
+
+    released = Counter()
+    if status == 'awaiting_pickup':
+        released.update(book_id for _, book_id in rows)
+
+    applied = stock.transition_many(status, EXPIRED, {borrow_id: {} for borrow_id, _ in rows})
+    if applied and released:
+        applied = stock.release_many(released)
+    if not applied:
+        db.session.rollback()
+        return 0, 0, True
+
+    db.session.commit()
+    return len(rows), sum(released.values()), False
+
+
+def sweep(batch_size=None, max_batches=None, today=None, now=None):
+    """Run one bounded expiry pass and return what it did."""
+    batch_size = batch_size or current_app.config['SWEEP_BATCH_SIZE']
+    max_batches = max_batches or current_app.config['SWEEP_MAX_BATCHES']
+    today = today or date.today()
+    now = now or datetime.utcnow()
+    # The pickup window starts at approval, not at the original request
+    cutoffs = {
+        'pending': (Borrow.borrow_date, today - timedelta(days=current_app.config['BORROW_PENDING_TTL_DAYS'])),
+        'awaiting_pickup': (Borrow.approved_at, now - timedelta(days=current_app.config['BORROW_PICKUP_TTL_DAYS'])),
+    }
+
+    started_at = datetime.utcnow()
+    started = time.perf_counter()
+    expired = Counter()
+    released = conflicts = batches = 0
+    for status, (date_column, cutoff) in cutoffs.items():
+        while batches < max_batches:
+            count, copies, conflict = expire_batch(status, date_column, cutoff, batch_size)
+            batches += 1
+            expired[status] += count
+            released += copies
+            conflicts += conflict
+            # A short batch means this status has nothing older left; a
+            # conflicting one is retried on the next pass
+            if conflict or count < batch_size:
+                break
+
+    if released:
+        catalog_cache.bump()
+
+    result = {
+        'started_at': started_at.isoformat(),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+        'batches': batches,
+        'processed': sum(expired.values()),
+        'expired': dict(expired),
+        'released': released,
+        'conflicts': conflicts,
+        'complete': batches < max_batches
+    }
+    metrics.record(result)
+    return result
+
+
+class Sweeper:
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config['SWEEP_INTERVAL']
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='borrow-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    result = sweep()
+                if result['processed']:
+                    self.app.logger.info('Expired %d borrows in %s ms', result['processed'], result['duration_ms'])
+            except Exception:
+                self.app.logger.exception('Borrow sweeper error')
+
+
+sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_sweeper(app):
+    global sweeper
+    with _sweeper_lock:
+        if sweeper is None:
+            sweeper = Sweeper(app)
+            sweeper.start()
+    return sweeper
+
+
+@click.command('expire-borrows')
+@with_appcontext
+@click.option('--batch-size', default=None, type=int, help='Borrows per transaction.')
+@click.option('--max-batches', default=None, type=int, help='Stop the pass after this many batches.')
+def expire_borrows(batch_size, max_batches):
+    """Expire stale pending and awaiting-pickup borrow requests."""
+    result = sweep(batch_size, max_batches)
+    print(f"Expired {result['processed']} borrows {result['expired']} and released "
+          f"{result['released']} reserved copies in {result['batches']} batches, {result['duration_ms']} ms")
+    if result['conflicts']:
+        print(f"{result['conflicts']} batches changed while expiring and were left for the next pass")
+    if not result['complete']:
+        print("Batch limit reached; run again to continue")
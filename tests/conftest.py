@@ -0,0 +1,45 @@
+import shutil
+import pytest
+from app import create_app
+from extensions import db
+from cache import catalog_cache, user_cache, book_cache
+from helpers import app_config, flask_command, make_user
+
+
+@pytest.fixture(scope='session')
+def migrated_db(tmp_path_factory):
+    # Migrate once in a separate process (alembic reconfigures logging), then
+    # give every test its own copy of the file
+    path = tmp_path_factory.mktemp('schema') / 'template.db'
+    flask_command('db', 'upgrade', database=path, check=True)
+    return path
+
+
+@pytest.fixture
+def app(migrated_db, tmp_path):
+    path = tmp_path / 'test.db'
+    shutil.copyfile(migrated_db, path)
+    app = create_app(app_config(path, tmp_path))
+    catalog_cache.bump()
+    user_cache.clear()
+    book_cache.clear()
+    with app.app_context():
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin(app):
+    return make_user('admin', role='admin')
+
+
+@pytest.fixture
+def member(app):
+    return make_user('member')
@@ -0,0 +1,62 @@
+"""Factories shared by the tests; each commits what it creates."""
+import os
+import subprocess
+import sys
+from datetime import date
+from flask_jwt_extended import create_access_token
+from extensions import db
+from models import Book, Borrow, User
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def app_config(database, tmp_path, **overrides):
+    """Config for a test app on the SQLite file ``database``."""
+    return dict({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}',
+        'DATABASE_READ_URL': None,
+        'JOBS_IN_PROCESS': False,
+        'SWEEP_INTERVAL': 0,
+        'JWT_VERIFY_SUB': False,
+        'BCRYPT_ROUNDS': 4,
+        'CATALOG_VERSION_FILE': str(tmp_path / 'catalog.version'),
+        'BOOK_VERSION_FILE': str(tmp_path / 'book.version'),
+        'USER_VERSION_FILE': str(tmp_path / 'user.version'),
+    }, **overrides)
+
+
+def make_user(username, role='user'):
+    user = User(username=username, password='x', role=role)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_book(stock=2, **values):
+    values = dict({'title': 'A book', 'description': 'About things', 'release_date': date(2020, 1, 1),
+                   'author': 'An author', 'category': 'Fiction', 'price': 100.0, 'stock': stock}, **values)
+    book = Book(**values)
+    db.session.add(book)
+    db.session.commit()
+    return book
+
+
+def add_borrows(user, book, count, status='pending'):
+    borrows = [Borrow(user_id=user.id, book_id=book.id, borrow_date=date.today(), status=status)
+               for _ in range(count)]
+    db.session.add_all(borrows)
+    db.session.commit()
+    return [borrow.id for borrow in borrows]
+
+
+def auth_headers(user):
+    token = create_access_token(identity={'id': user.id, 'username': user.username, 'role': user.role})
+    return {'Authorization': 'Bearer ' + token}
+
+
+def flask_command(*args, database, check=False):
+    """Run ``flask <args>`` against the SQLite file ``database`` in a new process."""
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', JOBS_IN_PROCESS='0')
+    return subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', *args],
+                          cwd=ROOT, env=env, check=check, capture_output=True, text=True)
@@ -0,0 +1,29 @@
+from helpers import auth_headers, make_book
+
+
+def test_pages_follow_the_cursor_to_the_end(client, member):
+    ids = [make_book(title=f'Book {n}').id for n in range(5)]
+    headers = auth_headers(member)
+
+    seen, url = [], '/all_books?limit=2&fields=id,title'
+    while url:
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        seen.extend(book['id'] for book in response.json)
+        cursor = response.headers.get('X-Next-Cursor')
+        url = cursor and f'/all_books?limit=2&fields=id,title&after={cursor}'
+    assert seen == ids
+
+
+def test_unpaged_request_streams_the_whole_catalog(client, member):
+    ids = [make_book(title=f'Book {n}').id for n in range(3)]
+    response = client.get('/all_books', headers=auth_headers(member))
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert [book['id'] for book in response.json] == ids
+    assert 'X-Next-Cursor' not in response.headers
+
+
+def test_unknown_fields_are_refused(client, member):
+    response = client.get('/all_books?limit=2&fields=id,password', headers=auth_headers(member))
+    assert response.status_code == 400
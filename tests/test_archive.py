@@ -0,0 +1,62 @@
+from datetime import date, datetime, timedelta
+from extensions import db
+from models import Borrow, BorrowArchive, Sale, SaleArchive
+from helpers import add_borrows, auth_headers, make_book, make_user
+from archive import archive
+
+OLD = date.today() - timedelta(days=400)
+
+
+def age_borrows(borrow_ids, status):
+    for borrow_id in borrow_ids:
+        borrow = db.session.get(Borrow, borrow_id)
+        borrow.borrow_date, borrow.status = OLD, status
+    db.session.commit()
+
+
+def test_only_old_finished_rows_move(app):
+    user, book = make_user('reader'), make_book()
+    returned, active, recent = add_borrows(user, book, 3)
+    age_borrows([returned], 'returned')
+    age_borrows([active], 'picked_up')
+    db.session.get(Borrow, recent).status = 'returned'
+    old_sale = Sale(user_id=user.id, book_id=book.id, phone_number='254700000000', amount=10.0,
+                    status='completed', created_at=datetime.combine(OLD, datetime.min.time()))
+    pending_sale = Sale(user_id=user.id, book_id=book.id, phone_number='254700000000', amount=10.0,
+                        created_at=old_sale.created_at)
+    db.session.add_all([old_sale, pending_sale])
+    db.session.commit()
+    old_sale_id, pending_sale_id = old_sale.id, pending_sale.id
+
+    result = archive(borrow_days=30, sale_days=30)
+    assert (result['borrows'], result['sales'], result['complete']) == (1, 1, True)
+    db.session.expire_all()
+    assert db.session.get(Borrow, returned) is None
+    assert db.session.get(BorrowArchive, returned).status == 'returned'
+    assert {borrow.id for borrow in Borrow.query} == {active, recent}
+    assert [sale.id for sale in Sale.query] == [pending_sale_id]
+    assert db.session.get(SaleArchive, old_sale_id).amount == 10.0
+
+
+def test_batch_limit_leaves_the_rest_for_the_next_pass(app):
+    user, book = make_user('reader'), make_book()
+    age_borrows(add_borrows(user, book, 5), 'expired')
+
+    result = archive(borrow_days=30, sale_days=30, batch_size=2, max_batches=2)
+    assert (result['borrows'], result['complete']) == (4, False)
+    result = archive(borrow_days=30, sale_days=30, batch_size=2, max_batches=2)
+    assert result['borrows'] == 1
+    assert Borrow.query.count() == 0
+
+
+def test_archived_rows_are_listed_on_request(client, member):
+    book = make_book()
+    hot, cold = add_borrows(member, book, 2)
+    age_borrows([cold], 'returned')
+    archive(borrow_days=30, sale_days=30)
+    headers = auth_headers(member)
+
+    listed = client.get('/borrowed_books?fields=id', headers=headers).json
+    assert [borrow['id'] for borrow in listed] == [hot]
+    listed = client.get('/borrowed_books?fields=id&include_archived=1', headers=headers).json
+    assert sorted(borrow['id'] for borrow in listed) == [hot, cold]
@@ -0,0 +1,57 @@
+import threading
+import pytest
+from bcrypt import gensalt, hashpw
+from extensions import db
+from models import User
+import auth
+from auth import PasswordHasher, PasswordHasherBusy, needs_rehash
+from helpers import make_user
+
+
+def add_user(username, password, rounds):
+    user = make_user(username)
+    user.password = hashpw(password.encode('utf-8'), gensalt(rounds=rounds)).decode('utf-8')
+    db.session.commit()
+    return user
+
+
+def test_login_moves_the_hash_to_the_configured_cost(app, client):
+    user = add_user('reader', 'secret', rounds=5)
+    assert needs_rehash(user.password)
+    response = client.post('/login', json={'username': 'reader', 'password': 'secret'})
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert not needs_rehash(db.session.get(User, user.id).password)
+
+    assert client.post('/login', json={'username': 'reader', 'password': 'secret'}).status_code == 200
+    assert client.post('/login', json={'username': 'reader', 'password': 'wrong'}).status_code == 401
+
+
+def test_full_pool_fails_fast():
+    hasher = PasswordHasher(workers=1, queue_size=0)
+    started, release = threading.Event(), threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    thread = threading.Thread(target=hasher.run, args=(block,))
+    thread.start()
+    started.wait(5)
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.run(lambda: None)
+    finally:
+        release.set()
+        thread.join()
+    assert hasher.run(lambda: 'done') == 'done'
+
+
+def test_busy_login_is_503(app, client, monkeypatch):
+    add_user('reader', 'secret', rounds=4)
+    hasher = PasswordHasher(workers=1, queue_size=0)
+    # The only slot is taken, as if by another login
+    hasher._slots.acquire()
+    monkeypatch.setattr(auth, '_hasher', hasher)
+    response = client.post('/login', json={'username': 'reader', 'password': 'secret'})
+    assert response.status_code == 503
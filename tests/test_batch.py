@@ -0,0 +1,36 @@
+import pytest
+from extensions import db
+from models import Book, Borrow
+from helpers import add_borrows, auth_headers, make_book, make_user
+
+
+@pytest.mark.parametrize('path', ['/batch/approve_borrow', '/batch/mark_picked_up', '/batch/mark_returned'])
+@pytest.mark.parametrize('body', [[1], 'items', 7, None])
+def test_body_must_be_an_object(client, admin, path, body):
+    response = client.post(path, json=body, headers=auth_headers(admin))
+    assert response.status_code == 400
+
+
+def test_batch_lifecycle_keeps_stock_right(client, admin):
+    user, book = make_user('reader'), make_book(stock=2)
+    borrow_ids = add_borrows(user, book, 3)
+    headers = auth_headers(admin)
+
+    items = [{'borrow_id': borrow_id, 'return_date': '2030-01-01'} for borrow_id in borrow_ids]
+    response = client.post('/batch/approve_borrow', json={'items': items}, headers=headers)
+    assert response.status_code == 200
+    assert [result['ok'] for result in response.json['results']] == [True, True, False]
+
+    approved = borrow_ids[:2]
+    response = client.post('/batch/mark_picked_up', json={'borrow_ids': approved}, headers=headers)
+    assert response.json['succeeded'] == 2
+    db.session.expire_all()
+    book_row = db.session.get(Book, book.id)
+    assert (book_row.stock, book_row.reserved) == (0, 0)
+
+    response = client.post('/batch/mark_returned', json={'borrow_ids': approved + [borrow_ids[2]]}, headers=headers)
+    assert (response.json['succeeded'], response.json['failed']) == (2, 1)
+    db.session.expire_all()
+    book_row = db.session.get(Book, book.id)
+    assert (book_row.stock, book_row.reserved) == (2, 0)
+    assert [db.session.get(Borrow, borrow_id).status for borrow_id in borrow_ids] == ['returned', 'returned', 'pending']
@@ -0,0 +1,46 @@
+import json
+import pytest
+from book_import import validate_book
+from models import Book
+from helpers import auth_headers
+
+GOOD = {'title': 'Dune', 'description': 'Sand', 'release_date': '1965-08-01', 'author': 'Frank Herbert',
+        'category': 'Science fiction', 'price': '12.5', 'stock': '4'}
+
+
+def test_valid_row():
+    values, error = validate_book(GOOD)
+    assert error is None
+    assert (values['price'], values['stock'], values['photo']) == (12.5, 4, None)
+
+
+@pytest.mark.parametrize('change, message', [
+    ({'title': 'x' * 151}, 'title is longer than 150 characters.'),
+    ({'author': 'x' * 101}, 'author is longer than 100 characters.'),
+    ({'category': 'x' * 101}, 'category is longer than 100 characters.'),
+    ({'title': 1984}, 'title must be text.'),
+    ({'stock': '-1'}, 'Price and stock cannot be negative.'),
+    ({'price': '-0.5'}, 'Price and stock cannot be negative.'),
+    ({'price': 'nan'}, 'Price and stock cannot be negative.'),
+    ({'photo': 'elsewhere.jpg'}, 'photo cannot be set here; upload the cover through add_book.'),
+])
+def test_invalid_rows(change, message):
+    assert validate_book(dict(GOOD, **change)) == (None, message)
+
+
+def test_import_reports_bad_rows_and_keeps_good_ones(app, client, admin):
+    rows = [GOOD, dict(GOOD, title='x' * 151), dict(GOOD, title='Emma', stock='-2'), dict(GOOD, title='Ulysses')]
+    body = '\n'.join(json.dumps(row) for row in rows)
+    response = client.post('/books/import?format=jsonl&batch_size=2', data=body,
+                           headers=auth_headers(admin), content_type='application/x-ndjson')
+    assert response.status_code == 200
+    report = response.json
+    assert (report['rows'], report['inserted'], report['failed']) == (4, 2, 2)
+    assert [error['row'] for error in report['errors']] == [2, 3]
+    assert sorted(title for (title,) in Book.query.with_entities(Book.title)) == ['Dune', 'Ulysses']
+
+
+def test_add_book_uses_the_same_rules(app, client, admin):
+    response = client.post('/add_book', data=dict(GOOD, stock='-1'), headers=auth_headers(admin))
+    assert response.status_code == 400
+    assert response.json['message'] == 'Price and stock cannot be negative.'
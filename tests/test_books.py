@@ -0,0 +1,91 @@
+import subprocess
+import sys
+from extensions import db
+from helpers import ROOT, auth_headers, make_book
+from cache import EntityCache, book_cache
+import stock
+
+# Another app instance, in its own process, reserving a copy the way a
+# second gunicorn worker or a `flask` command would
+RESERVE_IN_ANOTHER_APP = (
+    "from app import create_app\n"
+    "from extensions import db\n"
+    "import stock\n"
+    "app = create_app({config!r})\n"
+    "with app.app_context():\n"
+    "    stock.reserve({book_id})\n"
+    "    db.session.commit()\n"
+)
+
+
+def get_book(client, user, book_id, **headers):
+    return client.get(f'/books/{book_id}', headers=dict(auth_headers(user), **headers))
+
+
+def test_batch_lookup_keeps_the_requested_order(client, member):
+    first, second = make_book(title='First'), make_book(title='Second')
+    response = client.get(f'/books?ids={second.id},999,{first.id}&fields=id,title',
+                          headers=auth_headers(member))
+    assert response.status_code == 200
+    assert response.json['books'] == [{'id': second.id, 'title': 'Second'}, {'id': first.id, 'title': 'First'}]
+    assert response.json['missing'] == [999]
+
+
+def test_unchanged_book_answers_304(client, member):
+    book = make_book()
+    etag = get_book(client, member, book.id).headers['ETag']
+    assert get_book(client, member, book.id, **{'If-None-Match': etag}).status_code == 304
+
+
+def test_orm_change_invalidates_the_cached_book(client, member):
+    book = make_book(title='Before')
+    assert get_book(client, member, book.id).json['title'] == 'Before'
+    book.title = 'After'
+    db.session.commit()
+    assert get_book(client, member, book.id).json['title'] == 'After'
+
+
+def test_stock_update_invalidates_the_cached_book(client, member):
+    book = make_book(stock=2)
+    assert get_book(client, member, book.id).json['available'] == 2
+    stock.reserve(book.id)
+    db.session.commit()
+    assert get_book(client, member, book.id).json['available'] == 1
+
+
+def test_rolled_back_change_keeps_the_cache(client, member):
+    book = make_book()
+    get_book(client, member, book.id)
+    stock.reserve(book.id)
+    db.session.rollback()
+    assert book.id in book_cache.get_many([book.id])
+
+
+def test_invalidation_reaches_caches_sharing_the_stamp(tmp_path):
+    path = str(tmp_path / 'book.version')
+    first, second = EntityCache('book'), EntityCache('book')
+    first.share_version(path)
+    second.share_version(path)
+    second.set_many(second.generation, {1: 'one', 2: 'two'})
+
+    generation = second.generation
+    first.invalidate([1])
+    assert second.get_many([1, 2]) == {}
+    # A fill that started before the invalidation is refused
+    second.set_many(generation, {1: 'one'})
+    assert second.get_many([1]) == {}
+
+
+def test_write_in_another_app_is_seen_at_once(app, client, member):
+    book = make_book(stock=2)
+    first = get_book(client, member, book.id)
+    assert first.json['available'] == 2
+
+    config = {key: app.config[key] for key in ('SQLALCHEMY_DATABASE_URI', 'CATALOG_VERSION_FILE', 'BOOK_VERSION_FILE')}
+    config.update(JOBS_IN_PROCESS=False, SWEEP_INTERVAL=0)
+    script = RESERVE_IN_ANOTHER_APP.format(config=config, book_id=book.id)
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, check=True)
+
+    response = get_book(client, member, book.id, **{'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.json['available'] == 1
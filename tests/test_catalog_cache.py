@@ -0,0 +1,72 @@
+import subprocess
+import sys
+import cache
+from cache import ResponseCache, catalog_cache
+from extensions import db
+from models import Book
+from helpers import ROOT, auth_headers, make_book
+
+BUMP_IN_ANOTHER_PROCESS = (
+    "from cache import ResponseCache\n"
+    "cache = ResponseCache('catalog')\n"
+    "cache.share_version({path!r})\n"
+    "cache.bump()\n"
+)
+
+
+def test_bump_reaches_caches_sharing_the_stamp(tmp_path):
+    path = str(tmp_path / 'catalog.version')
+    first, second = ResponseCache('catalog'), ResponseCache('catalog')
+    first.share_version(path)
+    second.share_version(path)
+    assert first.current_version() == second.current_version()
+    assert first.etag('key') == second.etag('key')
+
+    version = second.current_version()
+    second.set('key', version, b'[]')
+    first.bump()
+    assert second.current_version() == first.version
+    assert second.get('key') is None
+    # An entry built before the bump is refused
+    second.set('key', version, b'[]')
+    assert second.get('key') is None
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    response_cache = ResponseCache('catalog', ttl=60)
+    version = response_cache.current_version()
+    response_cache.set('key', version, b'[]')
+    response_cache.set_encoded('key', version, 'gzip', b'gz')
+    assert response_cache.get('key') == (b'[]', {})
+
+    now = cache.time.monotonic()
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now + 61)
+    assert response_cache.get('key') is None
+    assert response_cache.get_encoded('key', 'gzip') is None
+
+
+def test_all_books_sees_a_bump_from_another_process(app, client, member):
+    book = make_book(stock=3)
+    headers = auth_headers(member)
+    url = '/all_books?limit=10&fields=id,stock'
+    assert client.get(url, headers=headers).json == [{'id': book.id, 'stock': 3}]
+
+    # A write the way a CLI command makes it: the row changes and the bump
+    # happens in a different process
+    db.session.execute(db.update(Book).where(Book.id == book.id).values(stock=1))
+    db.session.commit()
+    assert client.get(url, headers=headers).json == [{'id': book.id, 'stock': 3}]
+
+    script = BUMP_IN_ANOTHER_PROCESS.format(path=app.config['CATALOG_VERSION_FILE'])
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, check=True)
+    assert client.get(url, headers=headers).json == [{'id': book.id, 'stock': 1}]
+
+
+def test_stale_etag_is_not_answered_with_304(app, client, member):
+    make_book()
+    headers = auth_headers(member)
+    etag = client.get('/all_books?limit=10', headers=headers).headers['ETag']
+    assert client.get('/all_books?limit=10', headers=dict(headers, **{'If-None-Match': etag})).status_code == 304
+
+    catalog_cache.bump()
+    assert client.get('/all_books?limit=10', headers=dict(headers, **{'If-None-Match': etag})).status_code == 200
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+from helpers import ROOT, flask_command
+
+TOOLING = ('bench', 'seed', 'loadtest')
+
+
+def test_create_app_does_not_import_tooling(tmp_path):
+    script = ('import sys; from app import create_app; create_app(); '
+              f'print([name for name in {TOOLING!r} if name in sys.modules])')
+    output = subprocess.run([sys.executable, '-c', script], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    assert output.strip() == '[]'
+
+
+def test_tooling_commands_still_run(tmp_path):
+    database = tmp_path / 'cli.db'
+    for name in TOOLING:
+        result = flask_command(name, '--help', database=database)
+        assert result.returncode == 0, result.stderr
+        assert f'flask {name} [OPTIONS]' in result.stdout
@@ -0,0 +1,51 @@
+import gzip
+import json
+import pytest
+from helpers import auth_headers, make_book
+
+
+@pytest.fixture
+def books(app):
+    for n in range(40):
+        make_book(title=f'Book {n}', description='A fairly long description of the book. ' * 5)
+
+
+def get(client, user, url, encoding):
+    return client.get(url, headers=dict(auth_headers(user), **{'Accept-Encoding': encoding}))
+
+
+def test_large_page_is_gzipped_and_cached_compressed(client, member, books):
+    url = '/all_books?limit=40'
+    plain = get(client, member, url, 'identity')
+    assert 'Content-Encoding' not in plain.headers
+
+    for _ in range(2):  # built, then served from the cache
+        response = get(client, member, url, 'gzip')
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert json.loads(gzip.decompress(response.data)) == plain.json
+
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    response = client.get(url, headers=dict(auth_headers(member), **{'If-None-Match': etag}))
+    assert response.status_code == 304
+
+
+def test_streamed_catalog_is_compressed_chunk_by_chunk(client, member, books):
+    response = get(client, member, '/all_books', 'gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    assert len(json.loads(gzip.decompress(response.data))) == 40
+
+
+def test_small_bodies_are_sent_as_they_are(client, member, books):
+    response = get(client, member, '/all_books?limit=1&fields=id', 'gzip')
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.json) == 1
+
+
+def test_brotli_is_preferred_when_available(client, member, books):
+    brotli = pytest.importorskip('brotli')
+    response = get(client, member, '/all_books?limit=40', 'gzip, br')
+    assert response.headers['Content-Encoding'] == 'br'
+    assert len(json.loads(brotli.decompress(response.data))) == 40
@@ -0,0 +1,58 @@
+from sqlalchemy import event
+from extensions import db
+from models import Borrow
+from helpers import add_borrows, auth_headers, make_book
+from archive import archive
+
+
+def dashboard(client, user, **args):
+    response = client.get('/borrowed_books/dashboard', query_string=args, headers=auth_headers(user))
+    assert response.status_code == 200
+    return response
+
+
+def test_borrows_carry_their_book_in_one_query(client, member):
+    books = [make_book(title=f'Book {n}') for n in range(3)]
+    for book in books:
+        add_borrows(member, book, 1)
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        rows = dashboard(client, member, fields='id,title').json
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert [row['title'] for row in rows] == ['Book 2', 'Book 1', 'Book 0']
+    # No lookup per book; the token's user may still be loaded
+    assert len([statement for statement in statements if 'book' in statement]) == 1
+
+
+def test_pages_and_status_filter(client, member):
+    book = make_book()
+    borrow_ids = add_borrows(member, book, 3)
+    db.session.get(Borrow, borrow_ids[1]).status = 'returned'
+    db.session.commit()
+
+    response = dashboard(client, member, fields='id', limit=2)
+    assert [row['id'] for row in response.json] == borrow_ids[:0:-1]
+    cursor = response.headers['X-Next-Cursor']
+    response = dashboard(client, member, fields='id', limit=2, before=cursor)
+    assert [row['id'] for row in response.json] == [borrow_ids[0]]
+    assert 'X-Next-Cursor' not in response.headers
+
+    rows = dashboard(client, member, fields='id,status', status='pending').json
+    assert {row['status'] for row in rows} == {'pending'}
+
+
+def test_archived_borrows_merge_in_order(client, member):
+    book = make_book(title='Kept')
+    borrow_ids = add_borrows(member, book, 3)
+    cold = db.session.get(Borrow, borrow_ids[1])
+    cold.status, cold.borrow_date = 'returned', cold.borrow_date.replace(year=2000)
+    db.session.commit()
+    archive(borrow_days=30, sale_days=30)
+
+    rows = dashboard(client, member, fields='id,title', include_archived=1).json
+    assert [row['id'] for row in rows] == borrow_ids[::-1]
+    assert {row['title'] for row in rows} == {'Kept'}
@@ -0,0 +1,48 @@
+import shutil
+import pytest
+from app import create_app
+from extensions import db
+from models import Book, Borrow
+from helpers import app_config, auth_headers, make_book, make_user
+
+
+def test_sqlite_connections_get_their_pragmas(app):
+    with db.engine.connect() as connection:
+        pragma = lambda name: connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+        assert pragma('journal_mode').lower() == app.config['SQLITE_JOURNAL_MODE'].lower()
+        assert pragma('busy_timeout') == app.config['SQLITE_BUSY_TIMEOUT_MS']
+
+
+@pytest.fixture
+def routed_app(migrated_db, tmp_path):
+    # Two separate files stand in for a primary and its replica
+    primary, replica = tmp_path / 'primary.db', tmp_path / 'replica.db'
+    shutil.copyfile(migrated_db, primary)
+    shutil.copyfile(migrated_db, replica)
+    app = create_app(app_config(primary, tmp_path, DATABASE_READ_URL=f'sqlite:///{replica}'))
+    with app.app_context():
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_read_only_handlers_read_the_replica(routed_app):
+    client = routed_app.test_client()
+    user, book = make_user('reader'), make_book()
+    headers = auth_headers(user)
+
+    # Writes land on the primary only, which the replica has not caught up with
+    response = client.post(f'/borrow_book/{book.id}', headers=headers)
+    assert response.status_code == 201
+    assert Borrow.query.count() == 1
+    assert client.get('/borrowed_books', headers=headers).json == []
+
+    replica = db.engines['replica']
+    with replica.begin() as connection:
+        connection.execute(Book.__table__.insert().values(
+            id=book.id, title='x', description='x', release_date=book.release_date, author='x',
+            category='x', price=1.0, stock=1))
+        connection.execute(Borrow.__table__.insert().values(
+            user_id=user.id, book_id=book.id, borrow_date=book.release_date, status='pending'))
+    assert len(client.get('/borrowed_books', headers=headers).json) == 1
@@ -0,0 +1,42 @@
+import shutil
+import pytest
+from sqlalchemy import create_engine, event, text
+from app import create_app
+from extensions import db
+from instrumentation import instrumentation
+
+
+@pytest.fixture
+def instrumented_app(migrated_db, tmp_path):
+    path = tmp_path / 'timed.db'
+    shutil.copyfile(migrated_db, path)
+    config = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SQL_INSTRUMENTATION': True,
+        'JOBS_IN_PROCESS': False,
+        'CATALOG_VERSION_FILE': str(tmp_path / 'catalog.version'),
+    }
+    # An earlier app in the same process must not leave its listeners behind
+    create_app(config)
+    app = create_app(config)
+
+    @app.route('/one-query')
+    def one_query():
+        db.session.execute(text('SELECT 1'))
+        return ''
+
+    yield app
+    instrumentation.enabled = False
+
+
+def test_each_query_is_counted_once(instrumented_app):
+    response = instrumented_app.test_client().get('/one-query')
+    assert 'desc="1 queries"' in response.headers['Server-Timing']
+
+
+def test_other_engines_are_not_instrumented(instrumented_app):
+    with instrumented_app.app_context():
+        assert event.contains(db.engine, 'after_cursor_execute', instrumentation._after_cursor_execute)
+    other = create_engine('sqlite://')
+    assert not event.contains(other, 'after_cursor_execute', instrumentation._after_cursor_execute)
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+import pytest
+from extensions import db
+from jobs import JobWorker, enqueue, job_handler, metrics
+from models import Job
+
+calls = []
+
+
+def fail_loudly(payload, job):
+    calls.append(('on_failure', payload['n']))
+    raise RuntimeError('on_failure broke')
+
+
+@job_handler('test_flaky', on_failure=fail_loudly)
+def flaky(payload, job):
+    calls.append(('run', payload['n']))
+    if payload.get('fail'):
+        raise RuntimeError('gateway down')
+
+
+@pytest.fixture
+def worker(app):
+    calls.clear()
+    return JobWorker(app)
+
+
+def add_job(max_attempts=3, **payload):
+    job = enqueue('test_flaky', dict({'n': 1}, **payload), max_attempts=max_attempts)
+    db.session.commit()
+    return job.id
+
+
+def test_failure_is_retried_with_backoff(worker):
+    job_id = add_job(fail=True)
+    assert worker.run_once()
+    job = db.session.get(Job, job_id)
+    assert (job.status, job.attempts, job.locked_at) == ('queued', 1, None)
+    assert job.last_error == 'gateway down'
+    assert calls == [('run', 1)]
+
+
+def test_failing_on_failure_still_fails_the_job(worker):
+    in_flight = metrics.in_flight
+    job_id = add_job(max_attempts=1, fail=True)
+    assert worker.run_once()
+
+    db.session.expire_all()
+    job = db.session.get(Job, job_id)
+    assert (job.status, job.attempts, job.locked_at) == ('failed', 1, None)
+    assert calls == [('run', 1), ('on_failure', 1)]
+    assert metrics.in_flight == in_flight
+    # Nothing is left to pick up, so the job is not run again
+    assert worker.run_once() is False
+    assert calls == [('run', 1), ('on_failure', 1)]
+
+
+def abandon(job_id, attempts):
+    # What a worker that died mid-run leaves behind
+    db.session.execute(db.update(Job).where(Job.id == job_id).values(
+        status='running', attempts=attempts, locked_at=datetime.utcnow() - timedelta(hours=1)))
+    db.session.commit()
+
+
+def test_abandoned_job_with_attempts_left_is_reclaimed(worker):
+    job_id = add_job(max_attempts=3)
+    abandon(job_id, attempts=1)
+    assert worker.run_once()
+    db.session.expire_all()
+    job = db.session.get(Job, job_id)
+    assert (job.status, job.attempts) == ('done', 2)
+    assert calls == [('run', 1)]
+
+
+def test_abandoned_job_on_its_last_attempt_is_failed_not_rerun(worker):
+    job_id = add_job(max_attempts=3)
+    abandon(job_id, attempts=3)
+    assert worker.run_once() is False
+    db.session.expire_all()
+    job = db.session.get(Job, job_id)
+    assert (job.status, job.attempts, job.locked_at) == ('failed', 3, None)
+    assert calls == [('on_failure', 1)]
+
+
+def test_unknown_kind_fails_without_a_handler(worker):
+    job = Job(kind='test_missing', payload='{}', max_attempts=1)
+    db.session.add(job)
+    db.session.commit()
+    assert worker.run_once()
+    db.session.expire_all()
+    assert db.session.get(Job, job.id).status == 'failed'
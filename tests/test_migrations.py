@@ -0,0 +1,8 @@
+from helpers import flask_command
+
+
+def test_models_match_migrations(migrated_db):
+    # The hand-made search index objects must not show up as removals
+    result = flask_command('db', 'check', database=migrated_db)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'book_fts' not in result.stderr
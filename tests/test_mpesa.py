@@ -0,0 +1,60 @@
+import threading
+import pytest
+import mpesa
+from fake_mpesa import start_fake_mpesa
+from mpesa import MpesaClient
+
+
+@pytest.fixture
+def server():
+    server = start_fake_mpesa()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server):
+    return MpesaClient('key', 'secret', '174379', 'passkey', 'http://127.0.0.1:1/callback',
+                       base_url=server.url)
+
+
+def test_token_is_fetched_once_for_many_pushes(server):
+    client = make_client(server)
+    for _ in range(3):
+        assert client.stk_push('254700000000', 10)['ResponseCode'] == '0'
+    assert (server.token_requests, server.stk_requests) == (1, 3)
+
+
+def test_concurrent_callers_share_one_refresh(server):
+    client = make_client(server)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(client.get_access_token())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.token_requests == 1
+    assert len(set(tokens)) == 1
+
+
+def test_revoked_token_is_refreshed_once(server):
+    client = make_client(server)
+    client.get_access_token()
+    server.token = 'revoked-elsewhere'
+    assert client.stk_push('254700000000', 10)['ResponseCode'] == '0'
+    assert server.token_requests == 2
+
+
+def test_token_is_refreshed_before_it_expires(server, monkeypatch):
+    # Usable for 10 seconds once the safety margin is taken off
+    server.expires_in = MpesaClient.TOKEN_EXPIRY_MARGIN + 10
+    client = make_client(server)
+    now = [1000.0]
+    monkeypatch.setattr(mpesa.time, 'monotonic', lambda: now[0])
+    client.get_access_token()
+    now[0] += 9
+    client.get_access_token()
+    assert server.token_requests == 1
+    now[0] += 2
+    client.get_access_token()
+    assert server.token_requests == 2
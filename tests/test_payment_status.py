@@ -0,0 +1,68 @@
+import threading
+import time
+import pytest
+import payments
+from extensions import db
+from models import Sale
+from notifications import NotificationHub
+from helpers import auth_headers, make_book, make_user
+
+
+@pytest.fixture
+def sale(app, monkeypatch):
+    # A hub of this app's own, not one left behind by an earlier test
+    monkeypatch.setattr(payments, 'sale_events', None)
+    user, book = make_user('buyer'), make_book()
+    sale = Sale(user_id=user.id, book_id=book.id, phone_number='254700000000', amount=100.0)
+    db.session.add(sale)
+    db.session.commit()
+    return sale
+
+
+def settle_later(app, sale_id, delay):
+    def settle():
+        time.sleep(delay)
+        with app.app_context():
+            db.session.get(Sale, sale_id).status = 'completed'
+            db.session.commit()
+    thread = threading.Thread(target=settle)
+    thread.start()
+    return thread
+
+
+def test_waiter_is_woken_by_the_commit(app, client, member, sale):
+    app.config['PAYMENT_STATUS_RECHECK'] = 30
+    thread = settle_later(app, sale.id, 0.2)
+    started = time.monotonic()
+    response = client.get(f'/payment_status/{sale.id}?wait=10', headers=auth_headers(member))
+    thread.join()
+    assert response.json['status'] == 'completed'
+    assert response.json['settled']
+    assert time.monotonic() - started < 5
+
+
+def test_recheck_sees_changes_the_hub_never_heard_of(app, sale):
+    app.config['PAYMENT_STATUS_RECHECK'] = 0.1
+    # Stands in for a callback settled by another worker process
+    db.session.execute(db.update(Sale).where(Sale.id == sale.id).values(status='failed'))
+    db.session.commit()
+    assert payments.wait_for_sale(sale.id, 5) == 'failed'
+
+
+def test_pending_sale_answers_after_the_wait(app, sale):
+    app.config['PAYMENT_STATUS_RECHECK'] = 0.05
+    started = time.monotonic()
+    assert payments.wait_for_sale(sale.id, 0.2) == 'pending'
+    assert time.monotonic() - started >= 0.2
+
+
+def test_full_hub_answers_at_once(app, sale, monkeypatch):
+    monkeypatch.setattr(payments, 'sale_events', NotificationHub(max_waiters=0))
+    started = time.monotonic()
+    assert payments.wait_for_sale(sale.id, 10) == 'pending'
+    assert time.monotonic() - started < 1
+    assert payments.sale_events.stats['rejected'] == 1
+
+
+def test_unknown_sale_is_404(client, member, sale):
+    assert client.get('/payment_status/999?wait=1', headers=auth_headers(member)).status_code == 404
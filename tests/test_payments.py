@@ -0,0 +1,97 @@
+import pytest
+import user
+from extensions import db
+from jobs import JobWorker
+from models import PaymentCallback, Sale
+from payments import CallbackIngester, InvalidCallback, parse_stk_callback
+from helpers import auth_headers, make_book, make_user
+
+
+def stk_body(checkout_request_id, result_code=0, amount=100):
+    return {'Body': {'stkCallback': {
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': result_code,
+        'ResultDesc': 'ok',
+        'CallbackMetadata': {'Item': [{'Name': 'Amount', 'Value': amount},
+                                      {'Name': 'MpesaReceiptNumber', 'Value': 'R1'}]},
+    }}}
+
+
+def make_sale(checkout_request_id=None):
+    sale = Sale(user_id=make_user(f'buyer-{checkout_request_id}').id, book_id=make_book().id,
+                phone_number='254700000000', amount=100.0, checkout_request_id=checkout_request_id)
+    db.session.add(sale)
+    db.session.commit()
+    return sale.id
+
+
+def sale_status(sale_id):
+    db.session.expire_all()
+    return db.session.get(Sale, sale_id).status
+
+
+@pytest.fixture
+def ingester(app):
+    # Driven by hand instead of from its thread
+    app.config['MPESA_CALLBACK_MAX_ATTEMPTS'] = 3
+    return CallbackIngester(app)
+
+
+def test_parse_rejects_values_the_columns_cannot_hold():
+    with pytest.raises(InvalidCallback):
+        parse_stk_callback(stk_body('x' * 101))
+    assert parse_stk_callback(stk_body('ws_CO_1', amount='lots'))['amount'] is None
+
+
+def test_callbacks_are_applied_and_retries_dropped(app, ingester):
+    sale_id = make_sale('ws_CO_1')
+    assert ingester.submit(parse_stk_callback(stk_body('ws_CO_1')))
+    ingester._drain()
+    assert sale_status(sale_id) == 'completed'
+    assert not ingester.submit(parse_stk_callback(stk_body('ws_CO_1')))
+    assert PaymentCallback.query.count() == 1
+
+
+def test_bad_row_does_not_block_the_rest(app, ingester):
+    sale_id = make_sale('ws_CO_2')
+    poison = dict(parse_stk_callback(stk_body('ws_CO_bad')), result_code=None)  # violates NOT NULL
+    ingester.submit(poison)
+    ingester.submit(parse_stk_callback(stk_body('ws_CO_2')))
+
+    ingester._drain()
+    assert sale_status(sale_id) == 'completed'
+    assert ingester.snapshot()['buffered'] == 1
+
+    for _ in range(2):
+        ingester._drain()
+    stats = ingester.snapshot()
+    assert (stats['buffered'], stats['dead_lettered'], stats['applied']) == (0, 1, 1)
+    assert PaymentCallback.query.count() == 1
+
+
+def test_unmatched_callback_is_reconciled_once_the_sale_is_known(app, ingester):
+    # The callback is flushed before the STK job commits the CheckoutRequestID
+    sale_id = make_sale()
+    ingester.submit(parse_stk_callback(stk_body('ws_CO_3', result_code=1032)))
+    ingester._drain()
+    assert ingester.snapshot()['unmatched'] == 1
+
+    sale = db.session.get(Sale, sale_id)
+    sale.checkout_request_id = 'ws_CO_3'
+    db.session.commit()
+    assert ingester.reconcile() == 1
+    assert sale_status(sale_id) == 'failed'
+    assert ingester.reconcile() == 0
+
+
+def test_stk_job_applies_a_callback_that_arrived_first(app, client, ingester, monkeypatch):
+    ingester.submit(parse_stk_callback(stk_body('ws_CO_4')))
+    ingester._drain()
+
+    monkeypatch.setattr(user, 'stk_push_request', lambda phone, amount: {'CheckoutRequestID': 'ws_CO_4'})
+    buyer = make_user('buyer')
+    response = client.post(f'/checkout/{make_book().id}', json={'phone_number': '0700000000'},
+                           headers=auth_headers(buyer))
+    assert response.status_code == 202
+    assert JobWorker(app).run_once()
+    assert sale_status(response.json['sale_id']) == 'completed'
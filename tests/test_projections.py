@@ -0,0 +1,33 @@
+import re
+from datetime import date
+from werkzeug.http import http_date
+from extensions import db
+from models import Sale
+from helpers import add_borrows, auth_headers, make_book, make_user
+
+
+def test_listing_returns_only_the_requested_fields(client, admin):
+    response = client.get('/users?fields=username,id,username', headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert response.json == [{'username': 'admin', 'id': admin.id}]
+
+
+def test_passwords_are_never_listed(client, admin):
+    assert 'password' not in client.get('/users', headers=auth_headers(admin)).json[0]
+    response = client.get('/users?fields=id,password', headers=auth_headers(admin))
+    assert response.status_code == 400
+
+
+def test_converted_fields_keep_their_format(client, admin):
+    book = make_book()
+    user = make_user('reader')
+    add_borrows(user, book, 1)
+    db.session.add(Sale(user_id=user.id, book_id=book.id, phone_number='254700000000', amount=10.0))
+    db.session.commit()
+
+    borrows = client.get('/manage_borrow_requests?fields=id,borrow_date', headers=auth_headers(admin)).json
+    # Same wire format the ORM listing had: dates as HTTP dates
+    assert borrows[0]['borrow_date'] == http_date(date.today())
+    sales = client.get('/sales?fields=amount,created_at', headers=auth_headers(admin)).json
+    assert sales[0]['amount'] == 10.0
+    assert re.fullmatch(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d', sales[0]['created_at'])
@@ -0,0 +1,32 @@
+import queries
+from queryplans import FULL_LISTINGS, check_query_plans, hot_queries
+from helpers import auth_headers
+
+
+def test_hot_queries_use_an_index(app):
+    results = check_query_plans()
+    scans = {result['query']: result['plan'] for result in results if not result['ok']}
+    assert scans == {}
+
+
+def test_full_listings_are_checked(app):
+    assert FULL_LISTINGS <= set(hot_queries())
+
+
+def test_handlers_build_the_checked_queries(app, client, admin, monkeypatch):
+    # The plan check is only worth something if the handlers run the same
+    # builders it explains
+    seen = []
+
+    def spy(builder):
+        def wrapper(*args, **kwargs):
+            seen.append((builder.__name__, kwargs))
+            return builder(*args, **kwargs)
+        return wrapper
+
+    for name in ('sales', 'borrow_requests'):
+        monkeypatch.setattr(queries, name, spy(getattr(queries, name)))
+    headers = auth_headers(admin)
+    assert client.get('/sales?status=pending&user_id=1', headers=headers).status_code == 200
+    assert client.get('/manage_borrow_requests', headers=headers).status_code == 200
+    assert seen == [('sales', {'status': 'pending', 'user_id': 1}), ('borrow_requests', {})]
@@ -0,0 +1,69 @@
+from datetime import datetime
+from extensions import db
+from models import Sale, SalesRollup
+from helpers import auth_headers, make_book, make_user
+from rollup import rebuild_rollup
+
+
+def add_sale(user, book, amount, created_at, status='pending'):
+    sale = Sale(user_id=user.id, book_id=book.id, phone_number='254700000000', amount=amount,
+                created_at=created_at, status=status)
+    db.session.add(sale)
+    db.session.commit()
+    return sale
+
+
+def analytics(client, user, **args):
+    response = client.get('/sales/analytics', query_string=args, headers=auth_headers(user))
+    assert response.status_code == 200
+    return response.json
+
+
+def rollup_rows():
+    return sorted(
+        (row.granularity, row.period, row.book_id, row.status, row.sale_count, row.total_amount)
+        for row in SalesRollup.query if row.sale_count
+    )
+
+
+def test_rollup_follows_inserts_and_status_changes(client, admin):
+    user, book, other = make_user('buyer'), make_book(), make_book()
+    sale = add_sale(user, book, 100.0, datetime(2024, 1, 5))
+    add_sale(user, other, 50.0, datetime(2024, 1, 20), status='completed')
+    add_sale(user, book, 30.0, datetime(2024, 2, 1), status='completed')
+
+    assert analytics(client, admin) == [
+        {'month': '2024-01', 'total_sales': 150.0, 'sales_count': 2},
+        {'month': '2024-02', 'total_sales': 30.0, 'sales_count': 1},
+    ]
+    assert analytics(client, admin, status='completed', book_id=book.id) == [
+        {'month': '2024-02', 'total_sales': 30.0, 'sales_count': 1},
+    ]
+
+    sale.status = 'completed'
+    db.session.commit()
+    assert analytics(client, admin, status='completed', book_id=book.id, granularity='day') == [
+        {'day': '2024-01-05', 'total_sales': 100.0, 'sales_count': 1},
+        {'day': '2024-02-01', 'total_sales': 30.0, 'sales_count': 1},
+    ]
+    assert analytics(client, admin, status='pending') == []
+
+
+def test_rebuild_matches_the_incremental_rollup(app):
+    user, book = make_user('buyer'), make_book()
+    sale = add_sale(user, book, 100.0, datetime(2024, 1, 5))
+    add_sale(user, book, 30.0, datetime(2024, 3, 1), status='failed')
+    sale.status = 'completed'
+    db.session.commit()
+
+    incremental = rollup_rows()
+    rebuild_rollup()
+    assert rollup_rows() == incremental
+
+
+def test_rolled_back_sale_leaves_no_rollup(app):
+    user, book = make_user('buyer'), make_book()
+    db.session.add(Sale(user_id=user.id, book_id=book.id, phone_number='254700000000', amount=10.0))
+    db.session.flush()
+    db.session.rollback()
+    assert rollup_rows() == []
@@ -0,0 +1,41 @@
+from extensions import db
+from models import Book
+from helpers import auth_headers, make_book
+import search
+
+
+def search_ids(client, user, q):
+    response = client.get('/books/search', query_string={'q': q}, headers=auth_headers(user))
+    assert response.status_code == 200
+    return [book['id'] for book in response.json]
+
+
+def test_title_matches_rank_above_description_matches(client, member):
+    in_description = make_book(title='Gardening', description='A history of dragons')
+    in_title = make_book(title='Dragons of autumn')
+    make_book(title='Cooking')
+    assert search_ids(client, member, 'dragon') == [in_title.id, in_description.id]
+
+
+def test_index_follows_updates_and_deletes(client, member):
+    book = make_book(title='Old title')
+    book.title = 'Fresh title'
+    db.session.commit()
+    assert search_ids(client, member, 'fresh') == [book.id]
+    assert search_ids(client, member, 'old') == []
+
+    db.session.delete(db.session.get(Book, book.id))
+    db.session.commit()
+    assert search_ids(client, member, 'fresh') == []
+
+
+def test_query_syntax_is_treated_as_words(client, member):
+    book = make_book(title='Night AND day')
+    assert search_ids(client, member, 'night" AND "day*') == [book.id]
+    assert search_ids(client, member, 'night OR"') == []
+    assert client.get('/books/search?q=', headers=auth_headers(member)).status_code == 400
+
+
+def test_scan_fallback_finds_the_same_books(app):
+    book = make_book(title='Dragons of autumn')
+    assert search._search_scan(['dragons'], 10) == [book.id]
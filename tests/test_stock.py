@@ -0,0 +1,137 @@
+import threading
+import pytest
+import stock
+from extensions import db
+from models import Book, Borrow
+from helpers import add_borrows, make_book, make_user
+
+THREADS = 12
+
+
+def run_concurrently(app, borrow_ids, step):
+    """Run ``step(borrow_id)`` for every borrow, all threads starting at once.
+
+    Each step commits when it returns True and rolls back otherwise. Returns
+    the ids whose step committed and any errors raised.
+    """
+    barrier = threading.Barrier(len(borrow_ids))
+    lock = threading.Lock()
+    committed, errors = [], []
+
+    def worker(borrow_id):
+        with app.app_context():
+            barrier.wait()
+            try:
+                if step(borrow_id):
+                    db.session.commit()
+                    with lock:
+                        committed.append(borrow_id)
+                else:
+                    db.session.rollback()
+            except Exception as e:
+                db.session.rollback()
+                with lock:
+                    errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(borrow_id,)) for borrow_id in borrow_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return committed, errors
+
+
+def book_counts(book_id):
+    db.session.expire_all()
+    book = db.session.get(Book, book_id)
+    return book.stock, book.reserved
+
+
+def statuses(borrow_ids):
+    return sorted(status for (status,) in db.session.query(Borrow.status).filter(Borrow.id.in_(borrow_ids)))
+
+
+def test_reserve_never_oversubscribes(app):
+    user, book = make_user('reader'), make_book(stock=3)
+    borrow_ids = add_borrows(user, book, THREADS)
+
+    def approve(borrow_id):
+        return (stock.transition(borrow_id, 'pending', 'awaiting_pickup')
+                and stock.reserve(book.id))
+
+    committed, errors = run_concurrently(app, borrow_ids, approve)
+    assert errors == []
+    assert len(committed) == 3
+    assert book_counts(book.id) == (3, 3)
+    assert statuses(borrow_ids) == ['awaiting_pickup'] * 3 + ['pending'] * (THREADS - 3)
+
+
+def test_transition_moves_a_borrow_once(app):
+    user, book = make_user('reader'), make_book(stock=3)
+    borrow_id, = add_borrows(user, book, 1)
+
+    def approve(_):
+        return (stock.transition(borrow_id, 'pending', 'awaiting_pickup')
+                and stock.reserve(book.id))
+
+    committed, errors = run_concurrently(app, [borrow_id] * THREADS, approve)
+    assert errors == []
+    assert len(committed) == 1
+    assert book_counts(book.id) == (3, 1)
+
+
+def test_pick_up_and_return_lose_no_updates(app):
+    user, book = make_user('reader'), make_book(stock=THREADS, reserved=THREADS)
+    borrow_ids = add_borrows(user, book, THREADS, status='awaiting_pickup')
+
+    def pick_up(borrow_id):
+        return (stock.transition(borrow_id, 'awaiting_pickup', 'picked up')
+                and stock.check_out(book.id))
+
+    committed, errors = run_concurrently(app, borrow_ids, pick_up)
+    assert errors == [] and len(committed) == THREADS
+    assert book_counts(book.id) == (0, 0)
+
+    def give_back(borrow_id):
+        if not stock.transition(borrow_id, 'picked up', 'returned'):
+            return False
+        stock.check_in(book.id)
+        return True
+
+    committed, errors = run_concurrently(app, borrow_ids, give_back)
+    assert errors == [] and len(committed) == THREADS
+    assert book_counts(book.id) == (THREADS, 0)
+    assert statuses(borrow_ids) == ['returned'] * THREADS
+
+
+def test_check_out_refuses_an_empty_shelf(app):
+    user, book = make_user('reader'), make_book(stock=2)
+    borrow_ids = add_borrows(user, book, THREADS, status='awaiting_pickup')
+
+    def pick_up(borrow_id):
+        return (stock.transition(borrow_id, 'awaiting_pickup', 'picked up')
+                and stock.check_out(book.id))
+
+    committed, errors = run_concurrently(app, borrow_ids, pick_up)
+    assert errors == []
+    assert len(committed) == 2
+    assert book_counts(book.id) == (0, 0)
+
+
+@pytest.mark.parametrize('sane_rowcount', [True, False])
+def test_batches_report_a_short_update(app, monkeypatch, sane_rowcount):
+    # Without a sane multi-row rowcount (psycopg2) the guards must still be checked
+    monkeypatch.setattr(db.engine.dialect, 'supports_sane_multi_rowcount', sane_rowcount)
+    user, full, spare = make_user('reader'), make_book(stock=1, reserved=1), make_book(stock=2)
+    pending = add_borrows(user, spare, 2)
+    db.session.get(Borrow, pending[1]).status = 'awaiting_pickup'
+    db.session.commit()
+
+    assert stock.reserve_many({spare.id: 1}) is True
+    assert stock.reserve_many({spare.id: 1, full.id: 1}) is False
+    db.session.rollback()
+    assert stock.transition_many('pending', 'awaiting_pickup', {borrow_id: {} for borrow_id in pending}) is False
+    db.session.rollback()
+    assert stock.check_out_many({spare.id: 3}) is False
+    db.session.rollback()
+    assert book_counts(spare.id) == (2, 0)
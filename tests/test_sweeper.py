@@ -0,0 +1,62 @@
+from datetime import date, datetime, timedelta
+from extensions import db
+from models import Book, Borrow
+from helpers import add_borrows, auth_headers, make_book, make_user
+import sweeper
+
+
+def statuses(borrow_ids):
+    db.session.expire_all()
+    return [db.session.get(Borrow, borrow_id).status for borrow_id in borrow_ids]
+
+
+def test_late_approval_gets_a_full_pickup_window(app, client, admin):
+    user, book = make_user('reader'), make_book(stock=1)
+    borrow_id, = add_borrows(user, book, 1)
+    # Requested long before anyone got to it
+    db.session.get(Borrow, borrow_id).borrow_date = date.today() - timedelta(days=5)
+    db.session.commit()
+
+    response = client.post(f'/approve_borrow/{borrow_id}', json={'return_date': '2030-01-01'},
+                          headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert db.session.get(Borrow, borrow_id).approved_at is not None
+
+    sweeper.sweep()
+    assert statuses([borrow_id]) == ['awaiting_pickup']
+
+
+def test_batch_approval_sets_approved_at(client, admin):
+    user, book = make_user('reader'), make_book(stock=1)
+    borrow_id, = add_borrows(user, book, 1)
+    items = [{'borrow_id': borrow_id, 'return_date': '2030-01-01'}]
+    response = client.post('/batch/approve_borrow', json={'items': items}, headers=auth_headers(admin))
+    assert response.json['results'][0]['ok']
+    db.session.expire_all()
+    assert db.session.get(Borrow, borrow_id).approved_at is not None
+
+
+def test_uncollected_approvals_expire_and_release_their_copy(app):
+    user, book = make_user('reader'), make_book(stock=2, reserved=2)
+    ttl = timedelta(days=app.config['BORROW_PICKUP_TTL_DAYS'])
+    old, fresh = add_borrows(user, book, 2, status='awaiting_pickup')
+    now = datetime.utcnow()
+    db.session.get(Borrow, old).approved_at = now - ttl - timedelta(hours=1)
+    db.session.get(Borrow, fresh).approved_at = now - ttl + timedelta(hours=1)
+    db.session.commit()
+
+    result = sweeper.sweep(now=now)
+    assert result['expired']['awaiting_pickup'] == 1
+    assert statuses([old, fresh]) == ['expired', 'awaiting_pickup']
+    assert db.session.get(Book, book.id).reserved == 1
+
+
+def test_pending_requests_expire_by_request_date(app):
+    user, book = make_user('reader'), make_book()
+    ttl = timedelta(days=app.config['BORROW_PENDING_TTL_DAYS'])
+    old, fresh = add_borrows(user, book, 2)
+    db.session.get(Borrow, old).borrow_date = date.today() - ttl - timedelta(days=1)
+    db.session.commit()
+
+    sweeper.sweep()
+    assert statuses([old, fresh]) == ['expired', 'pending']
@@ -0,0 +1,63 @@
+import io
+import pytest
+from PIL import Image
+from jobs import JobWorker
+from helpers import auth_headers
+
+BOOK_FORM = {'title': 'A book', 'description': 'About things', 'release_date': '2020-01-01',
+             'author': 'An author', 'category': 'Fiction', 'price': '100', 'stock': '2'}
+
+
+@pytest.fixture
+def uploads(app, tmp_path):
+    folder = tmp_path / 'uploads'
+    folder.mkdir()
+    app.config['UPLOAD_FOLDER'] = str(folder)
+    return folder
+
+
+def png(size=(800, 400)):
+    data = io.BytesIO()
+    Image.new('RGB', size, 'teal').save(data, 'PNG')
+    return data.getvalue()
+
+
+def add_book(client, admin, image, filename='cover.png'):
+    form = dict(BOOK_FORM, photo=(io.BytesIO(image), filename))
+    return client.post('/add_book', data=form, headers=auth_headers(admin), content_type='multipart/form-data')
+
+
+def test_identical_covers_are_stored_once(client, admin, uploads):
+    image = png()
+    first, second = add_book(client, admin, image), add_book(client, admin, image)
+    assert first.status_code == second.status_code == 201
+    assert first.json['photo'] == second.json['photo']
+    assert [path.name for path in uploads.iterdir()] == [first.json['photo']]
+
+
+def test_variants_are_served_once_generated(app, client, admin, uploads):
+    response = add_book(client, admin, png())
+    urls = response.json['photo_urls']
+
+    # Before the job runs the original stands in, uncached
+    fallback = client.get(urls['thumb'])
+    assert fallback.status_code == 200
+    assert fallback.mimetype == 'image/png'
+    assert 'immutable' not in fallback.headers['Cache-Control']
+
+    worker = JobWorker(app)
+    while worker.run_once():
+        pass
+
+    thumb = client.get(urls['thumb'])
+    assert thumb.mimetype == 'image/webp'
+    assert 'immutable' in thumb.headers['Cache-Control']
+    with Image.open(io.BytesIO(thumb.data)) as image:
+        assert max(image.size) == 200
+
+
+def test_oversized_cover_is_refused(app, client, admin, uploads):
+    app.config['MAX_UPLOAD_BYTES'] = 100
+    response = add_book(client, admin, png())
+    assert response.status_code == 413
+    assert list(uploads.iterdir()) == []
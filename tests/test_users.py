@@ -0,0 +1,97 @@
+import subprocess
+import sys
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from extensions import db
+from cache import TTLCache, user_cache
+from decorators import load_user
+from helpers import ROOT, auth_headers, make_book
+
+# An admin request served by another app instance in its own process, as by
+# another gunicorn worker
+ADMIN_REQUEST_IN_ANOTHER_APP = (
+    "from flask_jwt_extended import create_access_token\n"
+    "from app import create_app\n"
+    "app = create_app({config!r})\n"
+    "with app.app_context():\n"
+    "    token = create_access_token(identity={{'id': {admin_id}, 'username': 'admin', 'role': 'admin'}})\n"
+    "response = app.test_client().open({path!r}, method={method!r}, json={body!r},\n"
+    "                                  headers={{'Authorization': 'Bearer ' + token}})\n"
+    "assert response.status_code == 200, response.data\n"
+)
+
+
+def borrow(client, book, headers):
+    return client.post(f'/borrow_book/{book.id}', headers=headers)
+
+
+def test_user_is_loaded_once_then_cached(client, member):
+    books = [make_book(), make_book()]
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        for book in books:
+            assert borrow(client, book, auth_headers(member)).status_code == 201
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert len([statement for statement in statements if 'FROM user' in statement]) == 1
+
+
+def test_tokens_without_an_id_still_work(client, member):
+    token = create_access_token(identity={'username': member.username, 'role': member.role})
+    response = borrow(client, make_book(), {'Authorization': 'Bearer ' + token})
+    assert response.status_code == 201
+
+
+def test_deleting_a_user_drops_the_cached_entry(client, admin, member):
+    headers = auth_headers(member)
+    # Caches the user without leaving a borrow that would block the delete
+    response = borrow(client, make_book(stock=0), headers)
+    assert response.json['message'] == 'Book not available for borrowing.'
+    assert user_cache.get(member.id) is not None
+
+    response = client.delete(f'/delete_user/{member.id}', headers=auth_headers(admin))
+    assert response.status_code == 200
+    assert user_cache.get(member.id) is None
+    # The token outlives the user but no longer gets in
+    assert borrow(client, make_book(), headers).status_code == 401
+
+
+def admin_request_in_another_app(app, admin, method, path, body=None):
+    config = {key: app.config[key] for key in ('SQLALCHEMY_DATABASE_URI', 'CATALOG_VERSION_FILE',
+                                               'BOOK_VERSION_FILE', 'USER_VERSION_FILE', 'JWT_SECRET_KEY')}
+    config.update(JOBS_IN_PROCESS=False, SWEEP_INTERVAL=0, JWT_VERIFY_SUB=False, BCRYPT_ROUNDS=4)
+    script = ADMIN_REQUEST_IN_ANOTHER_APP.format(config=config, admin_id=admin.id, path=path,
+                                                 method=method, body=body)
+    subprocess.run([sys.executable, '-c', script], cwd=ROOT, check=True)
+
+
+def test_invalidation_reaches_caches_sharing_the_stamp(tmp_path):
+    path = str(tmp_path / 'user.version')
+    first, second = TTLCache(), TTLCache()
+    first.share_version(path)
+    second.share_version(path)
+    second.set(1, 'user')
+
+    version = second.version
+    first.invalidate(1)
+    assert second.get(1) is None
+    # A value read before the invalidation is refused
+    second.set(1, 'user', version)
+    assert second.get(1) is None
+
+
+def test_edit_in_another_app_is_seen_at_once(app, admin, member):
+    assert load_user(member.id).username == 'member'
+    admin_request_in_another_app(app, admin, 'PUT', f'/edit_user/{member.id}', {'username': 'renamed'})
+    db.session.remove()
+    assert load_user(member.id).username == 'renamed'
+
+
+def test_delete_in_another_app_is_seen_at_once(app, client, admin, member):
+    headers = auth_headers(member)
+    # Caches the user without leaving a borrow that would block the delete
+    borrow(client, make_book(stock=0), headers)
+    admin_request_in_another_app(app, admin, 'DELETE', f'/delete_user/{member.id}')
+    assert borrow(client, make_book(), headers).status_code == 401
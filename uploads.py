@@ -0,0 +1,135 @@
+import os
+import re
+import hashlib
+import tempfile
+from flask import Blueprint, current_app, send_from_directory, abort
+from jobs import enqueue, job_handler
+
+media = Blueprint('media', __name__)
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+# Variant name -> longest edge in pixels. Variants are always WebP.
+VARIANTS = {'thumb': 200, 'medium': 600}
+
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_ADDRESSED_RE = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]+)+$')
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def upload_folder():
+    return os.path.join(current_app.root_path, current_app.config['UPLOAD_FOLDER'])
+
+
+def variant_filename(photo, variant):
+    digest = photo.split('.', 1)[0]
+    return f'{digest}.{variant}.webp'
+
+
+def photo_urls(photo):
+    if not photo:
+        return None
+    prefix = current_app.config['MEDIA_URL']
+    urls = {'original': prefix + photo}
+    # Variants only exist for content-addressed uploads
+    if CONTENT_ADDRESSED_RE.match(photo):
+        for variant in VARIANTS:
+            urls[variant] = prefix + variant_filename(photo, variant)
+    return urls
+
+
+def save_upload(file_storage):
+    """Stream an uploaded image to disk under its SHA-256 and return the name.
+
+    The file is hashed while it is copied, so it is read exactly once. An
+    identical image that was uploaded before is reused instead of stored
+    again.
+    """
+    folder = upload_folder()
+    max_bytes = current_app.config['MAX_UPLOAD_BYTES']
+    extension = file_storage.filename.rsplit('.', 1)[1].lower()
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+
+        filename = f'{digest.hexdigest()}.{extension}'
+        final_path = os.path.join(folder, filename)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            return filename, False
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # Variants are generated by the job worker once the book is committed
+    enqueue('image_variants', {'photo': filename})
+    return filename, True
+
+
+@job_handler('image_variants')
+def generate_variants(payload, job):
+    from PIL import Image
+
+    folder = upload_folder()
+    photo = payload['photo']
+    with Image.open(os.path.join(folder, photo)) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for variant, edge in VARIANTS.items():
+            target = os.path.join(folder, variant_filename(photo, variant))
+            if os.path.exists(target):
+                continue
+            resized = image.copy()
+            resized.thumbnail((edge, edge))
+            # Write then rename so a half-written file is never served
+            tmp_path = target + '.tmp'
+            resized.save(tmp_path, 'WEBP', quality=current_app.config['WEBP_QUALITY'], method=4)
+            os.replace(tmp_path, target)
+
+
+@media.route('/media/<path:filename>', methods=['GET'])
+def serve_media(filename):
+    folder = upload_folder()
+    if CONTENT_ADDRESSED_RE.match(filename):
+        if os.path.exists(os.path.join(folder, filename)):
+            # The name is the content hash, so the bytes can never change
+            response = send_from_directory(folder, filename, max_age=31536000)
+            response.cache_control.immutable = True
+            response.cache_control.public = True
+            return response
+
+        # Variant not generated yet: fall back to the original, uncached
+        digest = filename.split('.', 1)[0]
+        for extension in ALLOWED_EXTENSIONS:
+            original = f'{digest}.{extension}'
+            if os.path.exists(os.path.join(folder, original)):
+                response = send_from_directory(folder, original, max_age=0)
+                response.cache_control.no_cache = True
+                return response
+        abort(404)
+
+    # Files uploaded before content addressing can be overwritten
+    return send_from_directory(folder, filename, max_age=0)
@@ -1,43 +1,250 @@
-from flask import Blueprint, request, jsonify
-from app import db
-from models import Borrow, Book, User, Sale
-from flask_jwt_extended import jwt_required, get_jwt_identity, current_user
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from extensions import db
+from models import Borrow, Book, Sale, BorrowArchive
+from flask_jwt_extended import jwt_required
 from datetime import date
+from itertools import islice
 from mpesa import stk_push_request
+from search import search_books
+from cache import catalog_cache
+from compression import negotiate_encoding, compress, mark_encoded
+from jobs import enqueue, job_handler
+from decorators import get_current_user_id, load_user
+from database import read_only
+from uploads import photo_urls
+from projections import (BOOK_FIELDS, MY_BORROW_FIELDS, MY_BORROW_ARCHIVE_FIELDS, MY_BORROW_DASHBOARD_FIELDS,
+                         MY_BORROW_ARCHIVE_DASHBOARD_FIELDS, InvalidFields)
+from archive import include_archived
+from stock import release
+from books import load_books, books_etag
+import queries
+from payments import parse_stk_callback, InvalidCallback, apply_callback, get_ingester, wait_for_sale
 
 user = Blueprint('user', __name__)
 
+def book_to_dict(book):
+    return {
+        'id': book.id,
+        'title': book.title,
+        'author': book.author,
+        'description': book.description,
+        'release_date': book.release_date,
+        'category': book.category,
+        'price': book.price,
+        'stock': book.stock,
+        'available': book.stock - book.reserved,
+        'photo': book.photo,
+        'photo_urls': photo_urls(book.photo)
+    }
+
+
+def stream_json_rows(query, to_dict):
+    # Write a JSON array one batch of rows at a time from a server-side
+    # cursor so the full result set is never held in memory
+    encoder = current_app.json
+    batch_size = current_app.config['BOOKS_STREAM_BATCH']
+    rows = iter(query.yield_per(batch_size))
+    yield b'['
+    first = True
+    while True:
+        batch = [to_dict(row) for row in islice(rows, batch_size)]
+        if not batch:
+            break
+        # Encode the batch as an array and drop its brackets
+        chunk = encoder.dumps_bytes(batch)[1:-1]
+        yield chunk if first else b',' + chunk
+        first = False
+    yield b']'
+
+
+def cache_stream(chunks, key, version, headers):
+    # Pass chunks through to the client and keep a copy for the cache, unless
+    # the body grows past the configured limit
+    max_bytes = current_app.config['CATALOG_CACHE_MAX_BYTES']
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if parts is not None:
+            size += len(chunk)
+            if size > max_bytes:
+                parts = None
+            else:
+                parts.append(chunk)
+        yield chunk
+    if parts is not None:
+        catalog_cache.set(key, version, b''.join(parts), headers)
+
+
+def cached_response(body, headers, key, version, etag):
+    response = Response(body, mimetype='application/json', headers=headers)
+    response.set_etag(etag)
+    encoding = None
+    if current_app.config['COMPRESS_RESPONSES'] and len(body) >= current_app.config['COMPRESS_MIN_BYTES']:
+        encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    # Compress once per catalog version and keep the bytes with the entry
+    encoded = catalog_cache.get_encoded(key, encoding)
+    if encoded is None:
+        encoded = compress(body, encoding, current_app.config)
+        catalog_cache.set_encoded(key, version, encoding, encoded)
+    response.set_data(encoded)
+    mark_encoded(response, encoding)
+    return response
+
+
 @user.route('/all_books', methods=['GET'])  
 @jwt_required()  
 def all_books():
     try:
-        # Retrieve all books from the database
-        books = Book.query.all()
-        
-        # Convert book objects into a list of dictionaries
-        books_list = [
-            {
-                'id': book.id,
-                'title': book.title,
-                'author': book.author,
-                'description': book.description,
-                'release_date': book.release_date,
-                'category': book.category,
-                'price': book.price,
-                'stock': book.stock,
-                'photo': book.photo
-            } for book in books
-        ]
-        
-        return jsonify(books_list), 200  
+        after = request.args.get('after', type=int)
+        limit = request.args.get('limit', type=int)
+        stream = request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+        # Without paging parameters the whole catalog is streamed, which keeps
+        # the response shape older clients expect without buffering every row
+        stream = stream or (after is None and limit is None)
+        try:
+            fields = BOOK_FIELDS.parse(request.args.get('fields'))
+        except InvalidFields as e:
+            return jsonify({'message': str(e)}), 400
+        if not stream:
+            limit = limit or current_app.config['BOOKS_PAGE_SIZE']
+            limit = max(1, min(limit, current_app.config['BOOKS_MAX_PAGE_SIZE']))
+
+        # Answer from the cache before touching the database
+        key = (after, limit, stream, tuple(fields))
+        version = catalog_cache.current_version()
+        etag = catalog_cache.etag(key, version)
+        if request.if_none_match.contains_weak(etag):
+            catalog_cache.record_not_modified()
+            return not_modified(etag)
+
+        cached = catalog_cache.get(key)
+        if cached is not None:
+            body, headers = cached
+            return cached_response(body, headers, key, version, etag), 200
+
+        # Keyset pagination on the primary key, so every page is an index seek
+        query = Book.query.order_by(Book.id)
+        if after is not None:
+            query = query.filter(Book.id > after)
+        # Plain rows with only the requested columns; the id always comes
+        # last for the cursor
+        query = BOOK_FIELDS.query(query, fields, Book.id)
+        to_dict = BOOK_FIELDS.row_converter(fields)
+
+        if stream:
+            if limit is not None:
+                query = query.limit(max(limit, 0))
+            chunks = cache_stream(stream_json_rows(query, to_dict), key, version, {})
+            response = Response(stream_with_context(chunks), mimetype='application/json')
+            response.set_etag(etag)
+            return response, 200
+
+        # Fetch one extra row to know whether another page exists
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        headers = {}
+        if has_more:
+            headers['X-Next-Cursor'] = str(rows[-1][-1])
+        response = jsonify([to_dict(row) for row in rows])
+        response.headers.extend(headers)
+        response.set_etag(etag)
+        catalog_cache.set(key, version, response.get_data(), headers)
+        return response, 200  
     except Exception as e:
         return jsonify({'message': 'Error retrieving books', 'error': str(e)}), 500
 
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag, weak=bool(current_app.config['COMPRESS_RESPONSES'] and negotiate_encoding()))
+    return response
+
+
+def parse_book_ids(value):
+    try:
+        book_ids = [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        return None, 'ids must be a comma separated list of book ids.'
+    if not book_ids:
+        return None, 'ids is required.'
+    if len(book_ids) > current_app.config['BOOKS_MAX_PAGE_SIZE']:
+        return None, f"At most {current_app.config['BOOKS_MAX_PAGE_SIZE']} ids per request."
+    return list(dict.fromkeys(book_ids)), None
+
+
+# Not read_only: a lagging replica could put a just-invalidated row back
+# into the cache
+@user.route('/books/<int:book_id>', methods=['GET'])
+@jwt_required()
+def get_book(book_id):
+    try:
+        fields = BOOK_FIELDS.parse(request.args.get('fields'))
+    except InvalidFields as e:
+        return jsonify({'message': str(e)}), 400
+
+    entry = load_books([book_id]).get(book_id)
+    if entry is None:
+        return jsonify({'message': 'Book not found'}), 404
+
+    etag = books_etag([entry], fields)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    book = entry[0]
+    response = jsonify({name: book[name] for name in fields})
+    response.set_etag(etag)
+    return response, 200
+
+
+@user.route('/books', methods=['GET'])
+@jwt_required()
+def get_books():
+    book_ids, error = parse_book_ids(request.args.get('ids', ''))
+    if error:
+        return jsonify({'message': error}), 400
+    try:
+        fields = BOOK_FIELDS.parse(request.args.get('fields'))
+    except InvalidFields as e:
+        return jsonify({'message': str(e)}), 400
+
+    found = load_books(book_ids)
+    # Books come back in the order they were asked for
+    entries = [found[book_id] for book_id in book_ids if book_id in found]
+    etag = books_etag(entries, fields)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    response = jsonify({
+        'books': [{name: book[name] for name in fields} for book, _ in entries],
+        'missing': [book_id for book_id in book_ids if book_id not in found]
+    })
+    response.set_etag(etag)
+    return response, 200
+
+
+@user.route('/books/search', methods=['GET'])
+@jwt_required()
+@read_only
+def search_catalog():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'message': 'Search query is required'}), 400
+
+    limit = request.args.get('limit', type=int) or current_app.config['BOOKS_PAGE_SIZE']
+    limit = max(1, min(limit, current_app.config['BOOKS_MAX_PAGE_SIZE']))
+
+    try:
+        books = search_books(q, limit)
+        return jsonify([book_to_dict(book) for book in books]), 200
+    except Exception as e:
+        return jsonify({'message': 'Error searching books', 'error': str(e)}), 500
+
 @user.route('/borrow_book/<int:book_id>', methods=['POST'])
 @jwt_required()
 def borrow_book(book_id):
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user['username']).first()
+    user = load_user(get_current_user_id())
 
     if user is None:
         return jsonify({'message': 'User not found.'}), 404
@@ -46,10 +253,10 @@ def borrow_book(book_id):
     if book is None:
         return jsonify({'message': 'Book not found.'}), 404
 
-    if book.stock <= 0:
+    if book.stock - book.reserved <= 0:
         return jsonify({'message': 'Book not available for borrowing.'}), 404
 
-    existing_borrow = Borrow.query.filter_by(user_id=user.id, book_id=book.id, status='pending').first()
+    existing_borrow = queries.pending_borrow(user.id, book.id).first()
     if existing_borrow:
         return jsonify({'message': 'You have already requested to borrow this book.'}), 400
 
@@ -71,30 +278,71 @@ def borrow_book(book_id):
 
 @user.route('/borrowed_books', methods=['GET'])
 @jwt_required()
+@read_only
 def get_borrowed_books():
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user['username']).first()
-
-    borrowed_books = Borrow.query.filter_by(user_id=user.id).all()
-    result = [{'id': b.id, 'book_id': b.book_id, 'borrow_date': b.borrow_date, 'return_date': b.return_date, 'status': b.status, 'borrow_price': b.borrow_price, 'instructions': b.instructions} for b in borrowed_books]
+    try:
+        fields = MY_BORROW_FIELDS.parse(request.args.get('fields'))
+    except InvalidFields as e:
+        return jsonify({'message': str(e)}), 400
+    user_id = get_current_user_id()
+    result = []
+    if include_archived(request.args):
+        result = MY_BORROW_ARCHIVE_FIELDS.rows(queries.user_borrows(BorrowArchive, user_id), fields)
+    result.extend(MY_BORROW_FIELDS.rows(queries.user_borrows(Borrow, user_id), fields))
 
     return jsonify(result), 200
 
+
+@user.route('/borrowed_books/dashboard', methods=['GET'])
+@jwt_required()
+@read_only
+def borrowed_books_dashboard():
+    # The user's borrows together with the book details a dashboard shows,
+    # read with one joined query per table instead of a lookup per book
+    try:
+        fields = MY_BORROW_DASHBOARD_FIELDS.parse(request.args.get('fields'))
+    except InvalidFields as e:
+        return jsonify({'message': str(e)}), 400
+    before = request.args.get('before', type=int)
+    limit = request.args.get('limit', type=int) or current_app.config['BOOKS_PAGE_SIZE']
+    limit = max(1, min(limit, current_app.config['BOOKS_MAX_PAGE_SIZE']))
+    statuses = [status.strip() for status in request.args.get('status', '').split(',') if status.strip()]
+
+    user_id = get_current_user_id()
+    sources = [(Borrow, MY_BORROW_DASHBOARD_FIELDS)]
+    if include_archived(request.args):
+        sources.append((BorrowArchive, MY_BORROW_ARCHIVE_DASHBOARD_FIELDS))
+    rows = []
+    for model, projection in sources:
+        # The borrow id comes last for the cursor
+        query = projection.query(queries.borrow_dashboard(model, user_id, statuses, before), fields, model.id)
+        to_dict = projection.row_converter(fields)
+        # One extra row tells whether another page exists
+        rows.extend((row[-1], to_dict(row)) for row in query.limit(limit + 1))
+
+    rows.sort(key=lambda item: item[0], reverse=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    response = jsonify([item for _, item in rows])
+    if has_more:
+        response.headers['X-Next-Cursor'] = str(rows[-1][0])
+    return response, 200
+
 @user.route('/cancel_borrow/<int:borrow_id>', methods=['DELETE'])
 @jwt_required()
 def cancel_borrow(borrow_id):
-    current_user = get_jwt_identity()
-    user = User.query.filter_by(username=current_user['username']).first()
-
-    if user is None:
-        return jsonify({'message': 'User not found.'}), 404
-
-    borrow_request = Borrow.query.filter_by(id=borrow_id, user_id=user.id).first()
+    borrow_request = Borrow.query.filter_by(id=borrow_id, user_id=get_current_user_id()).first()
     if borrow_request is None:
         return jsonify({'message': 'Borrow request not found or does not belong to user.'}), 404
 
     db.session.delete(borrow_request)
+    # An approved request was holding a copy
+    if borrow_request.status == 'awaiting_pickup':
+        release(borrow_request.book_id)
     db.session.commit()
+    if borrow_request.status == 'awaiting_pickup':
+        catalog_cache.bump()
 
     return jsonify({'message': 'Borrow request canceled successfully!'}), 200
 
@@ -103,6 +351,10 @@ def cancel_borrow(borrow_id):
 @user.route('/checkout/<int:book_id>', methods=['POST'])
 @jwt_required()
 def checkout(book_id):
+    user = load_user(get_current_user_id())
+    if user is None:
+        return jsonify({'message': 'User not found.'}), 404
+
     book = Book.query.get(book_id)
     if not book:
         return jsonify({"message": "Book not found"}), 404
@@ -124,39 +376,71 @@ def checkout(book_id):
     if len(phone_number) != 12:
         return jsonify({"message": "Phone number must be 12 digits long (including '254')"}), 400
 
-    sale = Sale(user_id=current_user.id, book_id=book_id, phone_number=phone_number, amount=book.price)
+    sale = Sale(user_id=user.id, book_id=book_id, phone_number=phone_number, amount=book.price)
     db.session.add(sale)
+    db.session.flush()
+
+    # The STK push runs on the job worker; the job is committed with the sale
+    enqueue('stk_push', {'sale_id': sale.id})
     db.session.commit()
 
-    mpesa_response = stk_push_request(phone_number, book.price)
+    return jsonify({"message": "Checkout initiated", "sale_id": sale.id, "status": sale.status}), 202
 
-    return jsonify({"message": "Checkout initiated", "sale_id": sale.id, "mpesa_response": mpesa_response}), 201
 
+def fail_stk_push(payload, job):
+    sale = db.session.get(Sale, payload['sale_id'])
+    if sale is not None and sale.status == 'pending':
+        sale.status = 'failed'
 
-@user.route('/mpesa/notification', methods=['POST'])
-def mpesa_notification():
-    data = request.json
 
-    # Log the callback for debugging
-    print("M-Pesa Callback: ", data)
+@job_handler('stk_push', on_failure=fail_stk_push)
+def run_stk_push(payload, job):
+    sale = db.session.get(Sale, payload['sale_id'])
+    if sale is None or sale.status != 'pending' or sale.checkout_request_id:
+        return
+
+    mpesa_response = stk_push_request(sale.phone_number, sale.amount)
+    checkout_request_id = mpesa_response.get('CheckoutRequestID')
+    if not checkout_request_id:
+        raise RuntimeError(f"STK push not accepted: {mpesa_response}")
+
+    sale.checkout_request_id = checkout_request_id
+    # Commit first: a callback flushed from now on finds the sale itself,
+    # and one stored unmatched before this commit is found just below
+    db.session.commit()
+
+    # Locked, so the flusher's reconcile pass never applies it as well
+    callback = queries.unapplied_callback(checkout_request_id).with_for_update(skip_locked=True).first()
+    if callback is not None and sale.status == 'pending':
+        apply_callback(sale, callback)
 
-    # Process the callback and update sale status accordingly
-    sale_id = data.get('sale_id')
-    status = data.get('status')
 
-    # Fetch the sale and update the status
-    sale = Sale.query.get(sale_id)
-    if sale:
-        sale.status = status
-        db.session.commit()
+@user.route('/mpesa/notification', methods=['POST'])
+def mpesa_notification():
+    data = request.get_json(silent=True)
+    try:
+        parsed = parse_stk_callback(data, request.headers.get('Idempotency-Key'))
+    except InvalidCallback as e:
+        return jsonify({"ResultCode": 1, "ResultDesc": str(e)}), 400
 
-    return jsonify({"message": "Notification received"}), 200
+    # Acknowledge now; the sale is updated by the next coalesced flush
+    get_ingester().submit(parsed)
+    return jsonify({"ResultCode": 0, "ResultDesc": "Accepted"}), 200
 
 @user.route('/payment_status/<int:sale_id>', methods=['GET'])
 @jwt_required()
 def payment_status(sale_id):
-    sale = Sale.query.get(sale_id)
-    if not sale:
+    # ?wait=N holds the request for up to N seconds while the sale is
+    # pending and answers as soon as the callback settles it
+    wait = request.args.get('wait', 0, type=float)
+    wait = max(0.0, min(wait, current_app.config['PAYMENT_STATUS_MAX_WAIT']))
+    status = wait_for_sale(sale_id, wait)
+    if status is None:
         return jsonify({"message": "Sale not found"}), 404
-    
-    return jsonify({"message": f"Payment status is: {sale.status}"}), 200
+
+    return jsonify({
+        "sale_id": sale_id,
+        "status": status,
+        "settled": status != 'pending',
+        "message": f"Payment status is: {status}"
+    }), 200